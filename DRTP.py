@@ -1,894 +1,1045 @@
+import heapq
 import socket
 import time
-import threading
-from header import create_packet, parse_header, parse_flags
+from struct import pack, unpack_from
+from header import create_packet, parse_header, parse_header_from, parse_flags, MSS, HEADER_SIZE
+from header import seq_add, seq_diff, unwrap_seq, random_isn, window_shift, encode_window, decode_window, RECEIVE_WINDOW
+from profiling import timed_phase
 
 socket.setdefaulttimeout(0.5)
 
+# Receive buffers have room for a full datagram plus the trailers of the socket layers (e.g. the CRC32).
+RECV_BUFFER_SIZE = 2048
+
 def is_last_packet(data):
     _, _, flags, _ = parse_header(data)
     _, _, fin = parse_flags(flags)
 
     return fin == 1
 
-def SYN_packet(seq, ack, win):
+# The SYN and the SYN-ACK can carry the sender's window scale (one byte), see header.py.
+def SYN_packet(seq, ack, win, shift=None):
     flags = (1 << 3)  # SYN=1, ACK=0, FIN=0
-    return create_packet(seq, ack, flags, win, b'')
+    return create_packet(seq, ack, flags, win, b'' if shift is None else pack('!B', shift))
 
-def SYN_ACK_packet(seq, ack, win):
+def SYN_ACK_packet(seq, ack, win, shift=None):
     flags = (1 << 2) | (1 << 3)  # SYN=1, ACK=1, FIN=0
-    return create_packet(seq, ack, flags, win, b'')
+    return create_packet(seq, ack, flags, win, b'' if shift is None else pack('!B', shift))
 
 def ACK_packet(seq, ack, win):
     flags = (1 << 2)  # SYN=0, ACK=1, FIN=0
     return create_packet(seq, ack, flags, win, b'')
 
-def FIN_packet(seq, ack, win):
+def FIN_packet(seq, ack, win, data=b''):
     flags = (1 << 1)  # SYN=0, ACK=0, FIN=1
-    return create_packet(seq, ack, flags, win, b'')
+    return create_packet(seq, ack, flags, win, data)
+
+# The flags of the header, see header.py.
+SYN_FLAG = (1 << 3)
+ACK_FLAG = (1 << 2)
+FIN_FLAG = (1 << 1)
+
+# The FIN handshake that closes a session uses FIN and ACK together. The last data packet has the FIN flag
+# alone, and any sequence number (0 too, after a wrap), so the flags are what tell the two apart.
+CLOSE_FLAGS = (1 << 2) | (1 << 1)
+
+def CLOSE_packet(data=b''):
+    return create_packet(0, 0, CLOSE_FLAGS, 0, data)
+
+# The file info datagram is sent by the client right after the handshake. It carries the file name,
+# optionally followed by NUL separated key=value options (e.g. the total size), so a server
+# can prepare the output before the first data packet arrives:  name\0size=1234\0...
+def file_info_packet(file_name, **options):
+    fields = [file_name.encode('latin1')]  # Use latin1 encoding to preserve binary data
+    for key, value in options.items():
+        if value is not None:
+            fields.append(f"{key}={value}".encode('latin1'))
+    return b'\0'.join(fields)
+
+def parse_file_info(data):
+    fields = data.split(b'\0')
+    file_name = fields[0].decode('latin1')
+    options = {}
+    for field in fields[1:]:
+        key, _, value = field.decode('latin1').partition('=')
+        options[key] = value
+    return file_name, options
+
+# When a client asks to resume, the server answers the file info datagram with the chunk ranges it is
+# still missing: a header with the RANGES flag and the ISN as ACK number, then a count followed by
+# (start, end) pairs of chunk indices, end exclusive.
+# If there are more gaps than fit in one datagram, the closest ones are merged
+# (a few chunks the server already has will then be sent again).
+RANGES_FLAG = (1 << 5)
+
+def limit_ranges(ranges, max_size=MSS):
+    ranges = list(ranges)
+    max_ranges = (max_size - 4) // 8
+    while len(ranges) > max_ranges:
+        gaps = [ranges[i + 1][0] - ranges[i][1] for i in range(len(ranges) - 1)]
+        i = gaps.index(min(gaps))
+        ranges[i:i + 2] = [(ranges[i][0], ranges[i + 1][1])]
+    return ranges
+
+def ranges_packet(ranges, isn):
+    payload = pack('!I', len(ranges))
+    for start, end in ranges:
+        payload += pack('!II', start, end)
+    return create_packet(0, isn, RANGES_FLAG, 0, payload)
+
+# Returns the ranges, or None if data is not the ranges reply of this session (e.g. a repeated SYN-ACK).
+def parse_ranges(data, isn):
+    if len(data) < HEADER_SIZE + 4:
+        return None
+    _, ack, flags, _ = parse_header(data[:HEADER_SIZE])
+    if flags != RANGES_FLAG or ack != isn:
+        return None
+    count, = unpack_from('!I', data, HEADER_SIZE)
+    if len(data) < HEADER_SIZE + 4 + 8 * count:
+        return None
+    return [unpack_from('!II', data, HEADER_SIZE + 4 + 8 * i) for i in range(count)]
+
+# Hands out the payloads of a transfer one chunk at a time. The data can be bytes or any iterable of
+# buffers (a pipe, a file read in blocks, a generator). The source looks just far enough ahead to know
+# whether the current chunk is the last one (it gets the FIN flag), so a sender only ever holds the
+# packets of its window and memory stays bounded however long the stream is.
+class ChunkSource:
+
+    def __init__(self, data, mss=MSS):
+        self.mss = mss
+        self.sent_bytes = 0
+        self.buffer = bytearray()
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            self.blocks = iter([data] if len(data) else [])
+        else:
+            self.blocks = iter(data)
+        self.exhausted = False
+
+    # Returns (chunk, is_last). An empty stream gives a single empty chunk, so the receiver still sees a FIN.
+    def next_chunk(self):
+        while len(self.buffer) <= self.mss and not self.exhausted:
+            try:
+                self.buffer += next(self.blocks)
+            except StopIteration:
+                self.exhausted = True
+
+        chunk = bytes(self.buffer[:self.mss])
+        del self.buffer[:self.mss]
+        self.sent_bytes += len(chunk)
+        return chunk, self.exhausted and not self.buffer
+
+    # Returns (packet, is_last): the next chunk in a data packet with sequence number seq. The window
+    # protocols take their packets from here, so a source can also hand out packets that are built
+    # already (a PacketPipeline, pipeline.py).
+    def next_packet(self, seq):
+        chunk, is_last = self.next_chunk()
+        return create_packet(seq, 0, (1 << 1) if is_last else 0, 0, chunk), is_last
+
+# In-order payloads either go to a streaming sink (anything with write(), e.g. a Decompressor) or are
+# collected in received_file_data and written to the file at the end. The digest, if any, sees the same bytes.
+# The payload may be a view of a receive buffer that is reused for a later packet, so everything that
+# keeps it must copy it: the bytearray and the sinks do, the digest worker (which hashes later) gets a copy.
+def deliver_payload(payload, received_file_data, sink=None, digest=None):
+    if sink is not None:
+        sink.write(payload)
+    else:
+        received_file_data.extend(payload)
+    if digest is not None:
+        digest.update(bytes(payload))
+
+# The receive loops read every datagram with recvfrom_into into a preallocated buffer and work on
+# memoryviews of it, so a packet is not copied until its payload is written to the output.
+# A buffer goes back to the pool once its payload is consumed, only packets that have to wait
+# (out of order in sr) keep theirs until they are delivered.
+class BufferPool:
+
+    def __init__(self, count=64, size=RECV_BUFFER_SIZE):
+        self.size = size
+        self.free = [bytearray(size) for _ in range(count)]
+
+    def get(self):
+        return self.free.pop() if self.free else bytearray(self.size)
+
+    def put(self, buffer):
+        self.free.append(buffer)
+
+# The receive window a server can honour: datagrams beyond what the socket buffer holds are dropped by
+# the kernel, so the buffer is enlarged to RECEIVE_WINDOW if the system allows it (net.core.rmem_max)
+# and about half of it is advertised (Linux reports twice the size it was given and every datagram
+# also costs its bookkeeping). Sockets without a buffer (the simulator's) get the full RECEIVE_WINDOW.
+def receive_window(sock):
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_WINDOW)
+        return min(RECEIVE_WINDOW, sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) // 2)
+    except (AttributeError, OSError):
+        return RECEIVE_WINDOW
+
+# The window field of a server's ACKs, as a function: a session socket of a multi-client server
+# (scheduler.py) has a window_share() that changes as sessions come and go and is read for every ACK,
+# any other socket advertises the fixed receive_window().
+def advertised_window(sock, wscale):
+    share = getattr(sock, 'window_share', None)
+    if share is None:
+        win = encode_window(receive_window(sock), wscale)
+        return lambda: win
+    return lambda: encode_window(share(), wscale)
+
+# Retransmission timers. The RTT is estimated as in TCP (RFC 6298) from packets that were only sent once,
+# a timer that runs out is backed off exponentially (doubling up to MAX_RTO) and gives up after
+# MAX_RETRIES retransmissions. Before the first sample the timeout is INITIAL_RTO.
+INITIAL_RTO = 0.25
+MIN_RTO = 0.02
+MAX_RTO = 4.0
+MAX_RETRIES = 8
+
+class RTTEstimator:
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = INITIAL_RTO
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, MIN_RTO), MAX_RTO)
+
+    # Timeout for the given retransmission (0 = the first send).
+    def timeout(self, retransmission=0):
+        return min(self.rto * (1 << retransmission), MAX_RTO)
+
+    # Tail-loss probe timeout: two RTTs without an ACK after the last packet means the tail was probably
+    # lost, probing then is much quicker than waiting for the retransmission timeout.
+    def probe_timeout(self):
+        if self.srtt is None:
+            return self.rto
+        return min(max(2 * self.srtt, MIN_RTO), self.rto)
+
+# recvfrom that gives up (TimeoutError) at the deadline (a time.monotonic() value).
+def receive_before(sock, deadline, flags=0):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("timed out")
+    sock.settimeout(remaining)
+    if flags:
+        return sock.recvfrom(1472, flags)
+    return sock.recvfrom(1472)
 
 # The handshake function is responsible for establishing a connection between the client and the server.
 # This is a crucial step in any connection-oriented communication protocol, such as TCP.
 # It uses the SYN, SYN-ACK, ACK process, which ensures both sides are ready for communication.
-def handshake(server_socket, client_socket, is_server, server_ip=None, server_port=None, init_seq_number=0):
+# The client's SYN carries its initial sequence number (random unless init_seq_number is given), the first
+# data packet has seq ISN + 1. Both sides announce their window scale, the server only scales the windows
+# it advertises if the client announced one too.
+# A lost SYN or SYN-ACK is retransmitted when its timer runs out (backed off up to MAX_RETRIES times), the
+# RTT of the exchange is the first sample of rtt (an RTTEstimator, if given). The server does not need the
+# final ACK itself: the first packet the client sends afterwards (left in the socket for the caller) also
+# completes the handshake.
+# log gets the progress messages (print by default).
+# Returns (peer address, ISN, window scale of the server's advertised windows).
+def handshake(server_socket, client_socket, is_server, server_ip=None, server_port=None, init_seq_number=None, rtt=None, log=print):
     client_address = None
+    isn = random_isn() if init_seq_number is None else init_seq_number
+    shift = 0
+    rtt = rtt if rtt is not None else RTTEstimator()
 
     # The is_server boolean flag is used to differentiate the server's handshake process from the client's.
     if is_server:
-        print("-----Server: Starting handshake process------\n")
+        log("-----Server: Starting handshake process------\n")
+        saved_timeout = server_socket.gettimeout()
 
         while True:
             try:
                
                 # Step 1: Server receives a SYN (Synchronize) message from the client.
                 # The SYN message is the client's request to establish a connection.
+                server_socket.settimeout(saved_timeout)
                 data, client_address = server_socket.recvfrom(1472)
+                if len(data) < 12:
+                    continue
                 header = data[:12]
-                _,_,flags,_ = parse_header(header)
+                isn,_,flags,_ = parse_header(header)
                 syn, ack, fin = parse_flags(flags)
             except TimeoutError:
                 # If a TimeoutError occurs, the server will keep waiting for the SYN message.
                 continue    
 
-            while True:
-                    # If the correct SYN flag is received, the server moves to step 2.
-                    if flags == (1 << 3):
-                        print("Server: Received SYN from client.")
-                        # Step 2: Server sends a SYN-ACK (Synchronize-Acknowledge) message back to the client.
-                        # This confirms that the server is ready for communication.
-                        syn_ack_packet = SYN_ACK_packet(0, 0, 0)
-                        server_socket.sendto(syn_ack_packet, client_address)
-                        print("Server: Sent SYN-ACK to client.")
+            # If the correct SYN flag is not received, the server keeps waiting.
+            if flags != (1 << 3):
+                log("Server: Waiting for correct SYN flag.")
+                continue
+
+            log("Server: Received SYN from client.")
+            # Step 2: Server sends a SYN-ACK (Synchronize-Acknowledge) message back to the client.
+            # This confirms that the server is ready for communication.
+            # Window scaling is only used if the client announced a scale as well.
+            if len(data) > 12:
+                shift = window_shift(RECEIVE_WINDOW)
+                syn_ack_packet = SYN_ACK_packet(0, seq_add(isn, 1), 0, shift)
+            else:
+                syn_ack_packet = SYN_ACK_packet(0, seq_add(isn, 1), 0)
+
+            # Step 3: Server waits for an ACK (Acknowledge) message from the client, resending the SYN-ACK
+            # when the timer runs out or the client repeats its SYN (the SYN-ACK was lost).
+            # The ACK message is the client's confirmation that it is also ready for communication.
+            # The packets are peeked at first, so a data packet (the ACK was lost) stays in the socket.
+            completed = False
+            for attempt in range(MAX_RETRIES + 1):
+                server_socket.sendto(syn_ack_packet, client_address)
+                sent_at = time.monotonic()
+                log("Server: Sent SYN-ACK to client." if attempt == 0 else "Server: Resent SYN-ACK to client.")
+                deadline = sent_at + rtt.timeout(attempt)
+                log("Server: Waiting for ACK from client.")
+                try:
+                    while True:
+                        data, address = receive_before(server_socket, deadline, socket.MSG_PEEK)
+                        if address != client_address:
+                            server_socket.recvfrom(1472)
+                            continue
+                        # Anything too short for a header is the client's file info, so the ACK was lost.
+                        flags = parse_header(data[:12])[2] if len(data) >= 12 else None
+                        if flags == (1 << 3):
+                            # The client did not get our SYN-ACK, answer its repeated SYN.
+                            server_socket.recvfrom(1472)
+                            server_socket.sendto(syn_ack_packet, client_address)
+                            continue
+                        if flags == (1 << 2):
+                            server_socket.recvfrom(1472)
+                            log("Server: Received ACK from client. Handshake completed.")
+                        else:
+                            log("Server: Received data from client, the ACK was lost. Handshake completed.")
+                        if attempt == 0:
+                            rtt.sample(time.monotonic() - sent_at)
+                        completed = True
                         break
-                    else:
-                        # If the correct SYN flag is not received, the server keeps waiting.
-                        print("Server: Waiting for correct SYN flag.")
-                        continue
-                
-            while True:
-                print("Server: Waiting for ACK from client.")
-                # Step 3: Server waits for an ACK (Acknowledge) message from the client.
-                # The ACK message is the client's confirmation that it is also ready for communication.
-                data, _ = server_socket.recvfrom(1472)
-                header=data[:12]
-                _, _, flags, _ = parse_header(header)
-
-                if flags == (1 << 2):
-                    print("Server: Received ACK from client. Handshake completed.")
-                    break
-                else:
-                    # If the correct ACK flag is not received, the server keeps waiting.
-                    print("Server: Waiting for correct ACK flag.")
+                except TimeoutError:
                     continue
-            
-            break
+                break
+
+            if completed:
+                break
+            log(f"Server: Error: no ACK from {client_address[0]}:{client_address[1]} after {MAX_RETRIES} retries, waiting for a new connection.")
+
+        server_socket.settimeout(saved_timeout)
     else:
         # This part of the function handles the client-side handshake process.
-        print("-----Client: Starting handshake process-----\n")
-        while True:
-            print("Client: Sending SYN to server.")
+        log("-----Client: Starting handshake process-----\n")
+        saved_timeout = client_socket.gettimeout()
+
+        for attempt in range(MAX_RETRIES + 1):
+            log("Client: Sending SYN to server.")
 
             # Step 1: Client sends a SYN message to the server to request a connection.
-            syn_packet = SYN_packet(0, 0, 0)
+            syn_packet = SYN_packet(isn, 0, 0, window_shift(RECEIVE_WINDOW))
             client_socket.sendto(syn_packet, (server_ip, server_port))
-            print("Client: Sent SYN to server.")
-
-            # Step 2: The client then waits for a SYN-ACK message from the server.
-            print("Client: Waiting for SYN-ACK from server.")
-            data, _ = client_socket.recvfrom(1472)
-            header = data[:12]
-            _, _, flags, _ = parse_header(header)
-            syn, ack, fin = parse_flags(flags)
+            sent_at = time.monotonic()
+            log("Client: Sent SYN to server.")
 
-            if flags == (1 << 2) | (1 << 3):
-                print("Client: Received SYN-ACK from server.")
+            # Step 2: The client then waits for a SYN-ACK message from the server, the SYN is sent
+            # again if none arrives before the timer runs out.
+            log("Client: Waiting for SYN-ACK from server.")
+            deadline = sent_at + rtt.timeout(attempt)
+            try:
+                while True:
+                    data, _ = receive_before(client_socket, deadline)
+                    if len(data) >= 12 and parse_header(data[:12])[2] == (1 << 2) | (1 << 3):
+                        break
+                    log("Client: Waiting for correct SYN-ACK flag.")
+            except TimeoutError:
+                log("Client: No SYN-ACK from server, resending the SYN.")
+                continue
 
-                # Step 3: Upon receiving the SYN-ACK message, the client sends an ACK message to the server,
-                #  thus completing the handshake.
-                ack_packet = ACK_packet(0, 0, 0)
-                client_socket.sendto(ack_packet, (server_ip, server_port))
-                print("Client: Sent ACK to server. Handshake completed.")
+            log("Client: Received SYN-ACK from server.")
+            # Only the answer to the first SYN is a clean RTT sample.
+            if attempt == 0:
+                rtt.sample(time.monotonic() - sent_at)
+            # The server's window scale, no scale means its windows are not scaled.
+            shift = data[12] if len(data) > 12 else 0
+
+            # Step 3: Upon receiving the SYN-ACK message, the client sends an ACK message to the server,
+            #  thus completing the handshake.
+            ack_packet = ACK_packet(0, 0, 0)
+            client_socket.sendto(ack_packet, (server_ip, server_port))
+            log("Client: Sent ACK to server. Handshake completed.")
+            break
+        else:
+            client_socket.settimeout(saved_timeout)
+            raise ConnectionError(f"no SYN-ACK from {server_ip}:{server_port} after {MAX_RETRIES} retries")
 
-                break
-            else:
-                print("Client: Waiting for correct SYN-ACK flag.")
-                continue
+        client_socket.settimeout(saved_timeout)
+        client_address = (server_ip, server_port)
         
-    return client_address
+    return client_address, isn, shift
 
 # The fin_handshake function handles the termination of the connection between the client and the server.
 # This termination follows the FIN, ACK process, which ensures a graceful closing of the connection.
-def fin_handshake(server_socket, client_socket, is_server, server_ip=None, server_port=None):
-    
+# The client can put the end-to-end digest of the data in the FIN packet, the server returns it.
+# The client resends the FIN when its timer runs out (backed off, at most MAX_RETRIES times). The server
+# answers retransmitted data packets too (the client did not get the ACK of the tail of the data, method
+# says how to ACK them and last_seq is the wire sequence number of the last data packet, a receiver's
+# last_seq), and it lingers a little after its ACK to answer a repeated FIN.
+# log gets the progress messages (print by default).
+def fin_handshake(server_socket, client_socket, is_server, server_ip=None, server_port=None, digest=b'', method=None, rtt=None, last_seq=None, log=print):
+    fin_payload = b''
+    rtt = rtt if rtt is not None else RTTEstimator()
+
     # The 'is_server' flag differentiates between the server-side and client-side termination processes.
     if is_server:
-        print("------[Server]: Initiated FIN handshake, awaiting client's FIN packet.---------\n")
-
+        log("------[Server]: Initiated FIN handshake, awaiting client's FIN packet.---------\n")
+        saved_timeout = server_socket.gettimeout()
 
+        # Give up if the client stays silent for longer than its retransmissions could take.
+        deadline = time.monotonic() + MAX_RETRIES * MAX_RTO
+        fin_received = False
         while True:
                 try:
                     # Server waits for a FIN (Finish) packet from the client, signaling that the client wants to 
                     # close the connection.                    
-                    data, client_address = server_socket.recvfrom(1472)
+                    data, client_address = receive_before(server_socket, deadline)
+                    if len(data) < 12:
+                        continue
                     header=data[:12]
-                    _, _, flags, _ = parse_header(header)
+                    seq, ack, flags, _ = parse_header(header)
 
-                    if flags == (1 << 1):
-                        print("[Server]: FIN packet received from client. Preparing to send ACK packet back...")
+                    # The closing FIN has the FIN and ACK flags, a late retransmission of the last data packet
+                    # has the FIN flag alone.
+                    if flags == CLOSE_FLAGS:
+                        log("[Server]: FIN packet received from client. Preparing to send ACK packet back...")
+                        fin_payload = data[12:]
 
                         # Upon receiving the FIN packet, the server responds with an ACK (Acknowledge) packet.                      
-                        ack_packet = ACK_packet(0, 0, 0)
+                        ack_packet = CLOSE_packet()
                         server_socket.sendto(ack_packet, client_address)
-                        print("[Server]: ACK sent to client, connection closing process is in progress.")
-                        break
+                        log("[Server]: ACK sent to client, connection closing process is in progress.")
+                        # Linger long enough for the client to repeat its FIN several times if our ACK is lost.
+                        fin_received = True
+                        deadline = time.monotonic() + rtt.timeout(4)
+
+                    elif len(data) > 12 and not flags & ~(1 << 1):
+                        # All the data is here, so a retransmitted data packet only needs its ACK again.
+                        if method == "stop_and_wait":
+                            ack_packet = ACK_packet(seq, seq_add(ack, 1), 0)
+                        elif method == "auto":
+                            # Selective, cumulative up to the last packet and with the FIN flag: everything is in.
+                            ack_packet = create_packet(seq, seq if last_seq is None else last_seq, FIN_FLAG, 0, b'')
+                        elif method == "sr":
+                            # Selective, with the FIN flag: everything is in.
+                            ack_packet = create_packet(0, seq, FIN_FLAG, 0, b'')
+                        else:
+                            # Cumulative up to the last packet, with the FIN flag.
+                            ack_packet = create_packet(0, seq if last_seq is None else last_seq, FIN_FLAG, 0, b'')
+                        server_socket.sendto(ack_packet, client_address)
+                        log("[Server]: Retransmitted data packet received, ACKed it again.")
 
                     else:
-                        print("[Server]: Non-FIN packet received, still waiting for client's FIN...")
+                        log("[Server]: Non-FIN packet received, still waiting for client's FIN...")
                         continue
                 except TimeoutError:
-                    # If a TimeoutError occurs, the server keeps waiting for the FIN packet.                   
-                    continue
+                    if not fin_received:
+                        log("[Server]: Error: the client did not close the connection.")
+                    break
+
+        server_socket.settimeout(saved_timeout)
 
     else:
-        print("-------[Client]: Initiated FIN handshake.--------\n")
+        log("-------[Client]: Initiated FIN handshake.--------\n")
+        saved_timeout = client_socket.gettimeout()
 
-        while True:
+        for attempt in range(MAX_RETRIES + 1):
             # Client initiates the termination process by sending a FIN packet to the server.            
-            fin_packet = FIN_packet(0, 0, 0)
+            fin_packet = CLOSE_packet(digest)
             client_socket.sendto(fin_packet, (server_ip, server_port))
-            print("[Client]: Sending FIN to the server. Awaiting response...")
+            log("[Client]: Sending FIN to the server. Awaiting response...")
 
-            while True:
-                try:
-                    # Client waits for an ACK packet from the server to confirm the closing of the connection.
-                    data, _ = client_socket.recvfrom(1472)
-                    seq, ack, _, _ = parse_header(data)
-                    header = data[:12]
-                    _, _, flags, _ = parse_header(header)
-
-                    if flags == (1 << 2):
-                        print("[Client]: ACK received from server!")
+            try:
+                # Client waits for an ACK packet from the server to confirm the closing of the connection.
+                # Late ACKs of data packets are skipped, the ACK of the FIN has the FIN and ACK flags.
+                deadline = time.monotonic() + rtt.timeout(attempt)
+                while True:
+                    data, _ = receive_before(client_socket, deadline)
+                    if len(data) >= 12 and parse_header(data[:12])[2] == CLOSE_FLAGS:
                         break
-                    else:
-                        print("[Client]: No ACK received from server, awaiting...")
-                        continue
-                except TimeoutError:
-                    # If no ACK packet is received within a certain time frame, the client continues to wait.
-                    print("[Client]: No ACK received from server, awaiting...")
-                    break
-            
-            break
-            
-# The stop_and_wait function implements the Stop-and-Wait protocol for reliable data transmission.
-# The sender sends a packet and then waits for an acknowledgement from the receiver before sending the next packet.
-# This method is used both by the server to receive data and the client to send data.
-def stop_and_wait(socket, is_server, file_data=None, server_ip=None, server_port=None, new_file_name=None, test_case=None):
+                log("[Client]: ACK received from server!")
+                break
+            except TimeoutError:
+                # If no ACK packet is received before the timer runs out, the client sends the FIN again.
+                log("[Client]: No ACK received from server, resending the FIN...")
+        else:
+            log(f"[Client]: Error: no ACK for the FIN after {MAX_RETRIES} retries, closing anyway.")
 
-    # In the start of each transmission, record the start time.
-    start_time = time.time()
+        client_socket.settimeout(saved_timeout)
 
-    # The 'is_server' flag differentiates between the server-side and client-side of the protocol.
-    if is_server:
-        print("\n------ SERVER: STOP_AND_WAIT IN DRTP METHOD STARTs ------\n")
-        
-        ack_counter = -2
-        
-        # Initialize an empty bytearray to store the received data
-        received_file_data = bytearray()
-        print("Server: Initialized data reception")
+    return fin_payload
+            
+# The reliability strategies. A strategy object runs one transfer at a time in the calling thread and keeps
+# the state of that transfer in its __slots__ (reset at the start of each transfer), so the same object can
+# be reused by a DRTPConnection (connection.py). The functions stop_and_wait, gbn, sr and auto further down
+# are thin shims over them for the command line tool and the simulator.
+#   send(sock, peer, source, ...)      the client side, source is a ChunkSource (or anything else with
+#                                      next_packet(), e.g. a PacketPipeline)
+#   receive(sock, sink, digest, ...)   the server side, returns the data (a bytearray) unless it went to
+#                                      sink or straight into the output file (placement, see placement.py)
+# log (e.g. print) gets a message for every packet, without one a transfer is silent. The test cases of the
+# command line: "lose" and "double" skip or double the first send of packet #TEST_PACKET on the client,
+# "skip_ack" leaves out the ACK of the TEST_PACKET-th packet the server receives.
+# After a transfer the receiver's last_seq is the wire sequence number of the last packet, the server's
+# fin_handshake needs it to ACK late retransmissions.
+TEST_PACKET = 2
+
+class Strategy:
+
+    __slots__ = ('test_case', 'sock', 'peer', 'isn', 'mss', 'wscale', 'rtt', 'log', 'last_seq')
+    # Name of the method (the -r option) and the title of the banner of the shims.
+    method = None
+    title = None
+
+    def __init__(self, test_case=None):
+        self.test_case = test_case
+        self.last_seq = None
+
+    def _start(self, sock, peer, isn, mss, wscale, rtt, log):
+        self.sock = sock
+        self.peer = peer
+        self.isn = isn
+        self.mss = mss
+        self.wscale = wscale
+        self.rtt = rtt if rtt is not None else RTTEstimator()
+        self.log = log
+
+    # The first send of a new packet (number counts from 1), which the "lose" and "double" test cases change.
+    def _send_new(self, number, packet):
+        if number == TEST_PACKET and self.test_case == "lose":
+            if self.log:
+                self.log(f"Test case 'lose': Client skipped sending packet #{number}")
+            return
+        self.sock.sendto(packet, self.peer)
+        if number == TEST_PACKET and self.test_case == "double":
+            self.sock.sendto(packet, self.peer)
+            if self.log:
+                self.log(f"Test case 'double': Client sent packet #{number} twice")
+        elif self.log:
+            self.log(f"Client: Sent packet #{number}")
+
+    # True if the ACK of the count-th packet received is left out ("skip_ack" test case).
+    def _skip_ack(self, count, number):
+        if self.test_case != "skip_ack" or count != TEST_PACKET:
+            return False
+        if self.log:
+            self.log(f"Test case 'skip_ack': Server skipped the ACK of packet #{number}")
+        return True
+
+    # An extra line for the statistics at the end of a transfer, if the strategy has something to add.
+    def summary(self):
+        return None
+
+
+# One packet at a time. Packet n goes out with seq ISN + n and ACK number ISN + n - 1 and the server answers
+# it with seq and ACK number ISN + n. Its timer is backed off with every timeout, after MAX_RETRIES of them
+# the transfer fails with a ConnectionError. The server ACKs a repeated packet (its ACK was lost) again.
+class StopAndWait(Strategy):
+
+    __slots__ = ('next_seq', 'expected')
+    method = "stop_and_wait"
+    title = "STOP_AND_WAIT"
+
+    def send(self, sock, peer, source, isn=0, mss=MSS, wscale=0, rtt=None, metrics=None, log=None):
+        self._start(sock, peer, isn, mss, wscale, rtt, log)
+        self.next_seq = 1
+        # Live values for the metrics endpoint (metrics.py), only read when it is scraped.
+        if metrics is not None:
+            metrics.watch(window=lambda: 1, acked_packets=lambda: self.next_seq - 1)
+        buffer = bytearray(RECV_BUFFER_SIZE)
+        saved_timeout = sock.gettimeout()
+        try:
+            is_last = False
+            while not is_last:
+                chunk, is_last = source.next_chunk()
+                wire_seq = seq_add(isn, self.next_seq)
+                packet = create_packet(wire_seq, seq_add(isn, self.next_seq - 1), FIN_FLAG if is_last else 0, 0, chunk)
+                self._deliver(packet, wire_seq, buffer)
+                self.next_seq += 1
+        finally:
+            sock.settimeout(saved_timeout)
+
+    # Sends the packet until its ACK arrives, ACKs of earlier packets (late duplicates) are skipped.
+    def _deliver(self, packet, wire_seq, buffer):
+        retries = 0
         while True:
+            if retries == 0:
+                self._send_new(self.next_seq, packet)
+            else:
+                self.sock.sendto(packet, self.peer)
+                if self.log:
+                    self.log(f"Client: Timeout, resent packet #{self.next_seq}")
+            sent_at = time.monotonic()
+            deadline = sent_at + self.rtt.timeout(retries)
             try:
-                # Server waits for a packet from the client
-                ack_counter += 1
-                data, client_address = socket.recvfrom(1472)
-                payload = data[12:]
-                header = data [:12]
-                # Parse the packet header to get the sequence number, ACK number, and flags
-                seq, ack, flags, _ = parse_header(header)
-                print(f"\nServer: Packet seq # {seq} received with ACK #{ack} and flags {flags}")
-
-                # In case the test case is not "skip_ack" or it's not the 3rd packet (ack_counter != 2),
-                # the server processes the packet normally.
-                if test_case != "skip_ack" or ack_counter != 2:
-                    # Add the received payload to the received_file_data bytearray
-                    received_file_data.extend(payload)
-                    print(f"Server: Data appended, length of received data: {len(received_file_data)} bytes")
-
-                    # Server sends an ACK packet back to the client
-                    ack += 1
-                    ack_packet = ACK_packet(seq, ack, 0)
-                    print(f"Server: Created ACK packet_ack #{ack}")
-                    socket.sendto(ack_packet, client_address)
-                    print(f"Server: ACK_packet ack #{ack} sent to client\n")
-                    
-                    # If the FIN flag is set, the server ends the communication
-                    if flags == (1 << 1):
-                        print(f"Server: Received FIN_flag #{flags}, ending communication")
+                while True:
+                    self.sock.settimeout(max(deadline - time.monotonic(), 0.001))
+                    nbytes, _ = self.sock.recvfrom_into(buffer)
+                    if nbytes < HEADER_SIZE:
+                        continue
+                    seq, ack, flags, _ = parse_header_from(buffer)
+                    if flags == ACK_FLAG and seq == wire_seq and ack == wire_seq:
                         break
-                else:
-                    # In the "skip_ack" test case for the packet, the server deliberately skips sending an ACK
-                    print(f"Test case 'skip_ack': Server is skipped sending Ack #{ack}")
-                    continue
             except TimeoutError:
-                # If a TimeoutError occurs, the server keeps waiting for the packet.
+                retries += 1
+                if retries > MAX_RETRIES:
+                    raise ConnectionError(f"packet #{self.next_seq} was not acknowledged after {MAX_RETRIES} retries")
                 continue
-                
-        # Write the received data to a file    
-        with open(new_file_name, 'wb') as file:
-            print("Server: Writing received data to file\n")
-            file.write(received_file_data)
-
-            
-        return received_file_data
-        
+            # Only a packet that was sent once gives a clean RTT sample.
+            if retries == 0:
+                self.rtt.sample(time.monotonic() - sent_at)
+            if self.log:
+                self.log(f"Client: Received ACK of packet #{self.next_seq}")
+            return
+
+    # The packets arrive in order, so direct placement is not used (the caller writes the file).
+    def receive(self, sock, sink=None, digest=None, placement=None, isn=0, mss=MSS, wscale=0, metrics=None, log=None):
+        self._start(sock, None, isn, mss, wscale, None, log)
+        # Wire sequence number of the next packet to deliver.
+        self.expected = seq_add(isn, 1)
+        if metrics is not None:
+            metrics.watch(delivered_packets=lambda: seq_diff(self.expected, isn) - 1)
+        received = bytearray()
+        # One receive buffer for the whole transfer, each payload is consumed before the next packet is read.
+        buffer = bytearray(RECV_BUFFER_SIZE)
+        count = 0
+        while True:
+            try:
+                nbytes, address = sock.recvfrom_into(buffer)
+            except TimeoutError:
+                continue
+            if nbytes < HEADER_SIZE:
+                continue
+            packet = memoryview(buffer)[:nbytes]
+            seq, ack, flags, _ = parse_header_from(packet)
+            count += 1
+            number = seq_diff(seq, isn)
+            delivered = seq == self.expected
+            if delivered:
+                deliver_payload(packet[HEADER_SIZE:], received, sink, digest)
+                self.expected = seq_add(self.expected, 1)
+                if log:
+                    log(f"Server: Packet #{number} received, {nbytes - HEADER_SIZE} bytes")
+            elif log:
+                log(f"Server: Duplicate packet #{number}, sending its ACK again")
+            if not self._skip_ack(count, number):
+                sock.sendto(ACK_packet(seq, seq_add(ack, 1), 0), address)
+            if delivered and flags == FIN_FLAG:
+                self.last_seq = seq
+                if log:
+                    log("Server: Received the FIN flag, ending communication")
+                break
+        return received if sink is None else None
+
+
+# Go-Back-N, and the sliding window that SelectiveRepeat and Adaptive build on.
+# The sender keeps up to window packets in flight (fewer if the server advertises a smaller receive window)
+# with a retransmission timer per packet in a heap, so a timeout check only looks at the earliest ones.
+# A timer that runs out resends the whole window (gbn) or only its packet, backed off every time, and
+# MAX_RETRIES retransmissions of a packet fail the transfer with a ConnectionError. Once everything is
+# sent and no ACK came for about two RTTs, the last packet is resent as a tail-loss probe.
+# The sender is done when nothing is left unacked, it does not wait for an ACK with the FIN flag.
+# The receiver ACKs every packet and sets the FIN flag once everything up to the last packet is in.
+class GoBackN(Strategy):
+
+    __slots__ = ('window', 'base', 'next_seq', 'current_window', 'unacked', 'timers', 'last_progress', 'probed',
+                 'expected', 'buffered', 'fin_seq')
+    method = "gbn"
+    title = "GO-BACK-N"
+    # A timeout resends the whole window (gbn) or only the packet whose timer ran out.
+    resend_window = True
+    # The receiver keeps packets that arrive out of order (sr, auto) or drops them (gbn).
+    reorder = False
+
+    def __init__(self, window=5, test_case=None):
+        super().__init__(test_case)
+        self.window = window
+
+    # ---------- sender ----------
+
+    def send(self, sock, peer, source, isn=0, mss=MSS, wscale=0, rtt=None, metrics=None, log=None):
+        self._start(sock, peer, isn, mss, wscale, rtt, log)
+        self.base = self.next_seq = 1
+        self.current_window = self.window
+        # seq -> [packet, send time, retransmissions] of the unacked packets in sending order (the first key is
+        # the window base), and a heap of (expiry, seq, send time) timers, an entry is stale once its packet
+        # was ACKed or resent.
+        self.unacked = {}
+        self.timers = []
+        # When the last ACK arrived (or the last new packet went out) and whether the tail was probed since.
+        self.last_progress = time.monotonic()
+        self.probed = False
+        # Live values for the metrics endpoint (metrics.py), only read when it is scraped.
+        if metrics is not None:
+            metrics.watch(window=self._send_window, acked_packets=lambda: self.base - 1)
+        buffer = bytearray(RECV_BUFFER_SIZE)
+        saved_timeout = sock.gettimeout()
+        all_sent = False
+        try:
+            while not all_sent or self.unacked:
+                while not all_sent and self.next_seq < self.base + self._send_window():
+                    packet, all_sent = source.next_packet(seq_add(isn, self.next_seq))
+                    now = time.monotonic()
+                    self.unacked[self.next_seq] = [packet, now, 0]
+                    heapq.heappush(self.timers, (now + self.rtt.timeout(), self.next_seq, now))
+                    self.last_progress = now
+                    self._sent_new()
+                    self._send_new(self.next_seq, packet)
+                    self.next_seq += 1
+                if not self.unacked:
+                    continue
 
-    else:
-        # Client-side of the Stop-and-Wait protocol
-        print("\n------ CLIENT: STOP_AND_WAIT IN DRTP METHOD STARTs ------\n")
-
-        # Initialize the sequence number, ACK number, the last received ACK number, and the packet counter
-        sequens = 1
-        ack = 0
-        last_received_ack = -1
-        packet_counter = 0
-
-        # The client sends the file data in chunks of 1460 bytes (the maximum payload size) until all the data is sent.
-        for i in range(0, len(file_data), 1460):
-            chunk = file_data[i:i + 1460]
-            print(f"\nClient: Preparing packet #{sequens}")
-
-            # Check if this is the last chunk of data to be sent.
-            # If it is, then set the FIN flag to 1, indicating the end of transmission.
-            is_last_chunk = i + 1460 >= len(file_data)
-            fin_flag = (1 << 1) if is_last_chunk else 0
-            
-            while True:
-                # Increment the packet counter for each packet created.
-                packet_counter += 1
-
-                # Create a packet with the FIN flag if it's the last chunk
-                packet = create_packet(sequens, ack, fin_flag, 0, chunk)
-                print(f"Client: Packet #{sequens} created with ACK #{ack} and flags {fin_flag}")
-
-                # Check if the test case is "lose" and if it's the 2nd packet (packet_counter == 2).
-                # If it is, then the client deliberately skips sending this packet.
-                if test_case != "lose" or packet_counter != 2:
-
-                    # If it's not the "lose" test case for the 2nd packet,
-                    # then the client sends the packet to the server.
-                    socket.sendto(packet, (server_ip, server_port))
-                    print(f"Client: Packet #{sequens} sent to server")
-                
-                if test_case == "lose" and packet_counter == 2:
-                    print(f"Test case 'lose': Client is skipped sending packet #{sequens}")
-                    
-
-                # Wait for the ACK from the server
+                # Wait for an ACK until the earliest timer (or the tail-loss probe) is due.
+                deadline = self.timers[0][0] if self.timers else time.monotonic() + self.rtt.timeout()
+                if all_sent and not self.probed:
+                    deadline = min(deadline, self.last_progress + self.rtt.probe_timeout())
                 try:
-                    # Set a timeout
-                    data, _ = socket.recvfrom(1472)
-
-                    # Parse the received ACK packet header to get the sequence number, ACK number, and flags
-                    header = data[:12]
-                    seq, ack, flags, _ = parse_header(header)
-                    print(f"\nClient: Received ACK #{ack} with seq #{seq} and flags {flags}")
-                    
-                    if ack == last_received_ack:  
-                        # If a duplicate ACK is received, then the client resends the packet
-                        print("Client: Duplicate ACK received, resending the packet")
-                        continue
-                    else:
-                        
-                        # If a valid ACK is received (ACK flag is set and the sequence number equals the ACK number),
-                        # then the client breaks the loop and moves on to the next packet.
-                        if flags == (1 << 2) and seq == ack:
-                            last_received_ack = ack
-                            sequens += 1
-                            print(f"Client: Valid ACK received, preparing the next packet\n")
-                            break
-                        else:
-                            # If the ACK is invalid, then the client keeps waiting for a valid ACK.
-                            print("Client: Invalid ACK received, waiting for the valid ACK")
-                            continue
-
+                    sock.settimeout(max(deadline - time.monotonic(), 0.001))
+                    nbytes, _ = sock.recvfrom_into(buffer)
+                    if nbytes >= HEADER_SIZE:
+                        self._acked(buffer)
                 except TimeoutError:
-                    print("Client: Timeout, resending the packet")
-                    # If a TimeoutError occurs, then the client resends the same packet.
-                    continue
-
-            # If it's the last chunk and a valid ACK is received, then the client ends the transmission.    
-            if is_last_chunk and flags == (1 << 2):
-                # At the end of the transmission, record the end time.
-                end_time = time.time()
-                
-
-                    # Calculate the total transferred data in MB
-                total_data_Mb = (len(file_data)/1000000)*8
-                total_data_Kb = (len(file_data) / 1000)*8
-                total_data_MB = round(len(file_data)/1000000,2)
-                total_data_KB = round(len(file_data)/1000,2)
-
-                # Calculate the time taken in seconds
-                duration = round(end_time - start_time,3) # this is in seconds
-                time_taken = end_time - start_time
-                
-
-                # Calculate the bandwidth in Mbps
-                bandwidth = round(total_data_Mb / time_taken if total_data_Mb >= 1 else total_data_Kb / time_taken,2)
-
-                print("----------------------------------------------------------")
-                if total_data_Mb >= 1:
-                    print(f"DURATION: {duration} s\t DATA SIZE: {total_data_MB} MB\t BANDWIDTH: {bandwidth} Mbps")
-                    print("----------------------------------------------------------")
-                else:
-                    print(f"DURATION: {duration} s\t DATA SIZE: {total_data_KB} KB\t BANDWIDTH: {bandwidth} Kbps")
-                    print("----------------------------------------------------------")
+                    pass
+                self._expire(all_sent)
+        finally:
+            sock.settimeout(saved_timeout)
+
+    def _send_window(self):
+        return self.current_window
+
+    # Hooks of the adaptive strategy.
+    def _sent_new(self):
+        pass
+
+    def _lost(self):
+        pass
+
+    # The packet numbers an ACK covers: everything up to the cumulative one, and the selective one.
+    def _ack_numbers(self, wire_seq, wire_ack):
+        cumulative = unwrap_seq(wire_ack, self.base, self.isn)
+        return cumulative, cumulative
+
+    def _acked(self, packet):
+        wire_seq, wire_ack, flags, win = parse_header_from(packet)
+        # A late copy of the SYN-ACK is not an ACK of data.
+        if flags & SYN_FLAG:
+            return
+        if win:
+            self.current_window = min(self.window, max(1, decode_window(win, self.wscale) // self.mss))
+        cumulative, selective = self._ack_numbers(wire_seq, wire_ack)
+        if self.log:
+            self.log(f"Client: Received ACK #{selective}, cumulative ACK #{cumulative}, flags {flags}")
+        acked = None
+        while self.unacked:
+            first = next(iter(self.unacked))
+            if first > cumulative:
                 break
-                    
+            entry = self.unacked.pop(first)
+            if first == selective:
+                acked = entry
+        if selective > cumulative:
+            acked = self.unacked.pop(selective, None)
+        if acked is not None:
+            # Only a packet that was sent once gives a clean RTT sample.
+            if acked[2] == 0:
+                self.rtt.sample(time.monotonic() - acked[1])
+            self.last_progress = time.monotonic()
+            self.probed = False
+        self.base = next(iter(self.unacked)) if self.unacked else self.next_seq
+
+    # Resends a packet of the window and restarts its (backed off) timer.
+    def _resend(self, seq, entry, now):
+        self.sock.sendto(entry[0], self.peer)
+        entry[1] = now
+        entry[2] += 1
+        heapq.heappush(self.timers, (now + self.rtt.timeout(entry[2]), seq, now))
+        if self.log:
+            self.log(f"Client: Resent packet #{seq}")
+
+    def _expire(self, all_sent):
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            _, seq, send_time = heapq.heappop(self.timers)
+            entry = self.unacked.get(seq)
+            if entry is None or entry[1] != send_time:
+                continue
+            # The RTO may have grown since the timer was set (the queue builds up during the first window),
+            # check against the current one so a late ACK is not taken for a loss.
+            expiry = send_time + self.rtt.timeout(entry[2])
+            if expiry > now:
+                heapq.heappush(self.timers, (expiry, seq, send_time))
+                continue
+            if entry[2] >= MAX_RETRIES:
+                raise ConnectionError(f"packet #{seq} was not acknowledged after {MAX_RETRIES} retries")
+            self._lost()
+            if self.resend_window:
+                # Go back N: everything that is still unacked goes out again.
+                for resend_seq, resend_entry in self.unacked.items():
+                    self._resend(resend_seq, resend_entry, now)
+            else:
+                self._resend(seq, entry, now)
+
+        # Tail-loss probe: everything is sent and nothing was ACKed for about two RTTs, so the last packets
+        # were probably lost. Resending the last one gets an answer long before its timer would run out.
+        if all_sent and self.unacked and not self.probed and now - self.last_progress > self.rtt.probe_timeout():
+            seq = next(reversed(self.unacked))
+            if self.log:
+                self.log("Client: Tail-loss probe")
+            self._resend(seq, self.unacked[seq], now)
+            self.probed = True
+
+    # ---------- receiver ----------
+
+    def receive(self, sock, sink=None, digest=None, placement=None, isn=0, mss=MSS, wscale=0, metrics=None, log=None):
+        self._start(sock, None, isn, mss, wscale, None, log)
+        # Packet number of the next packet to deliver (with placement: after the contiguous edge).
+        self.expected = 1
+        # Packets received out of order (seq -> payload) and the packet number of the last packet (it has the
+        # FIN flag), the transfer is complete once everything up to it has been delivered.
+        self.buffered = {}
+        self.fin_seq = None
+        # Live values for the metrics endpoint (metrics.py), only read when it is scraped.
+        if metrics is not None:
+            metrics.watch(delivered_packets=lambda: self.expected - 1, reorder_buffer=lambda: len(self.buffered))
+        # Receive window advertised in every ACK (scaled if the client announced a window scale)
+        advertised = advertised_window(sock, wscale)
+        received = bytearray()
+        # Packets are read into buffers of the pool and worked on in place, a buffer stays out of the pool
+        # while its packet waits in self.buffered.
+        buffers = BufferPool()
+        count = 0
+        while True:
+            buffer = buffers.get()
+            try:
+                nbytes, address = sock.recvfrom_into(buffer)
+            except TimeoutError:
+                buffers.put(buffer)
+                continue
+            # A stray datagram too short for a header is no packet of the transfer.
+            if nbytes < HEADER_SIZE:
+                buffers.put(buffer)
+                continue
+            packet = memoryview(buffer)[:nbytes]
+            wire_seq, _, flags, _ = parse_header_from(packet)
+            # The packet number nearest to the one we expect, so wrapped sequence numbers still compare right.
+            seq = unwrap_seq(wire_seq, self.expected, isn)
+            count += 1
+            if log:
+                log(f"Server: Received packet #{seq} with flags {flags}")
+            payload = packet[HEADER_SIZE:]
+            kept = False
+            if placement is not None:
+                # Direct placement: the payload goes straight to its offset in the output file, nothing is
+                # buffered and the transfer is complete once the whole file is in place.
+                placement.place(seq, payload, flags == FIN_FLAG)
+                self.expected = placement.contiguous + 1
+                complete = placement.is_complete()
+            else:
+                if flags == FIN_FLAG:
+                    self.fin_seq = seq
+                if seq == self.expected:
+                    deliver_payload(payload, received, sink, digest)
+                    self.expected += 1
+                    while self.expected in self.buffered:
+                        held = self.buffered.pop(self.expected)
+                        deliver_payload(held, received, sink, digest)
+                        buffers.put(held.obj)
+                        self.expected += 1
+                elif self.reorder and seq > self.expected and seq not in self.buffered:
+                    self.buffered[seq] = payload
+                    kept = True
+                complete = self.fin_seq is not None and self.expected > self.fin_seq
+            if not kept:
+                buffers.put(buffer)
+
+            if not self._skip_ack(count, seq):
+                sock.sendto(self._ack_packet(wire_seq, complete, advertised()), address)
+            if complete:
+                self.last_seq = seq_add(isn, self.expected - 1)
+                if log:
+                    log("Server: All packets received, ending communication")
+                break
+        return received if sink is None and placement is None else None
+
+    # gbn: the cumulative ACK of the packets received in order.
+    def _ack_packet(self, wire_seq, complete, win):
+        return create_packet(0, seq_add(self.isn, self.expected - 1), FIN_FLAG if complete else 0, win, b'')
+
+
+# Selective Repeat: every packet is ACKed on its own (the ACK number is its seq), the receiver keeps the
+# packets that arrive out of order and a timeout only resends the packet whose timer ran out.
+class SelectiveRepeat(GoBackN):
+
+    __slots__ = ()
+    method = "sr"
+    title = "SELECTIVE REPEAT"
+    resend_window = False
+    reorder = True
+
+    def _ack_numbers(self, wire_seq, wire_ack):
+        return 0, unwrap_seq(wire_ack, self.base, self.isn)
+
+    def _ack_packet(self, wire_seq, complete, win):
+        return create_packet(0, wire_seq, FIN_FLAG if complete else 0, win, b'')
+
+
+# Adaptive method: the sender picks its retransmission strategy while the transfer runs.
+# The receiver buffers packets that arrive out of order (like sr) and every ACK carries both kinds of
+# acknowledgement: seq is the packet it answers (selective) and ack the last packet received in order
+# (cumulative), so it serves a sender in any of the three strategies.
+# The sender measures the RTT (RTTEstimator, it sets the timers) and the loss rate (the share of packets
+# that had to be resent, averaged over the last ~LOSS_WEIGHT**-1 packets) and switches between
+#   stop_and_wait  one packet in flight: before there is an RTT sample (the handshake usually gives one)
+#                  and while the receiver's window has room for a single packet
+#   gbn            a timeout resends every unacked packet of the window, cheap per ACK, but every loss
+#                  costs about a window of extra packets
+#   sr             a timeout resends only that packet, what GBN would resend needlessly is worth the
+#                  bookkeeping once loss rate * window passes AUTO_WASTE_HIGH (back below AUTO_WASTE_LOW)
+LOSS_WEIGHT = 1 / 64
+AUTO_WASTE_HIGH = 0.1
+AUTO_WASTE_LOW = 0.02
+
+class Adaptive(GoBackN):
+
+    __slots__ = ('mode', 'loss', 'mode_packets', 'switches')
+    method = "auto"
+    title = "ADAPTIVE"
+    reorder = True
+
+    def send(self, sock, peer, source, isn=0, mss=MSS, wscale=0, rtt=None, metrics=None, log=None):
+        self.mode = "stop_and_wait"
+        self.loss = 0.0
+        self.mode_packets = {"stop_and_wait": 0, "gbn": 0, "sr": 0}
+        self.switches = 0
+        super().send(sock, peer, source, isn, mss, wscale, rtt, metrics, log)
+
+    @property
+    def resend_window(self):
+        return self.mode == "gbn"
+
+    def _send_window(self):
+        return 1 if self.mode == "stop_and_wait" else self.current_window
+
+    def _sent_new(self):
+        self.loss *= 1 - LOSS_WEIGHT
+        self.mode_packets[self.mode] += 1
+
+    def _lost(self):
+        self.loss += LOSS_WEIGHT
+
+    # Picks the strategy from the measurements after every round of the sender.
+    def _expire(self, all_sent):
+        super()._expire(all_sent)
+        if self.rtt.srtt is None:
+            return
+        waste = self.loss * self.current_window
+        if self.current_window == 1:
+            mode = "stop_and_wait"
+        elif waste > AUTO_WASTE_HIGH:
+            mode = "sr"
+        elif waste < AUTO_WASTE_LOW or self.mode == "stop_and_wait":
+            mode = "gbn"
+        else:
+            mode = self.mode
+        if mode != self.mode:
+            if self.log:
+                self.log(f"Client: Switching from {self.mode} to {mode} (loss {self.loss:.1%}, RTT {self.rtt.srtt * 1000:.1f} ms, window {self.current_window})")
+            self.mode = mode
+            self.switches += 1
+
+    def _ack_numbers(self, wire_seq, wire_ack):
+        return unwrap_seq(wire_ack, self.base, self.isn), unwrap_seq(wire_seq, self.base, self.isn)
+
+    # auto: the seq of the packet it answers and the cumulative ACK.
+    def _ack_packet(self, wire_seq, complete, win):
+        return create_packet(wire_seq, seq_add(self.isn, self.expected - 1), FIN_FLAG if complete else 0, win, b'')
+
+    def summary(self):
+        return ("ADAPTIVE: packets sent as " + ", ".join(f"{mode} {count}" for mode, count in self.mode_packets.items())
+                + f", {self.switches} switch(es), loss {self.loss:.1%}, RTT {(self.rtt.srtt or 0) * 1000:.1f} ms")
+
+
+STRATEGIES = {"stop_and_wait": StopAndWait, "gbn": GoBackN, "sr": SelectiveRepeat, "auto": Adaptive}
+
+# Client side of the functions below: sends file_data (bytes, an iterable of buffers or a packet source) with
+# the strategy, logging every packet, and prints the duration, size and bandwidth of the transfer.
+def send_transfer(strategy, sock, file_data, server_ip, server_port, mss=MSS, isn=0, wscale=0, rtt=None, metrics=None):
+    print(f"------ CLIENT: {strategy.title} IN DRTP METHOD STARTS ------\n")
+    start_time = time.time()
+    source = file_data if hasattr(file_data, 'next_packet') else ChunkSource(file_data, mss)
+    strategy.send(sock, (server_ip, server_port), source, isn, mss, wscale, rtt, metrics, log=print)
+    end_time = time.time()
+
+    # Calculate the total transferred data in MB
+    total_data_Mb = (source.sent_bytes/1000000)*8
+    total_data_Kb = (source.sent_bytes / 1000)*8
+    total_data_MB = round(source.sent_bytes/1000000,2)
+    total_data_KB = round(source.sent_bytes/1000,2)
+
+    # Calculate the time taken in seconds
+    duration = round(end_time - start_time,3) # this is in seconds
+    time_taken = end_time - start_time
+
+    # Calculate the bandwidth in Mbps
+    bandwidth = round(total_data_Mb / time_taken if total_data_Mb >= 1 else total_data_Kb / time_taken,2)
+
+    print("----------------------------------------------------------")
+    if total_data_Mb >= 1:
+        print(f"DURATION: {duration} s\t DATA SIZE: {total_data_MB} MB\t BANDWIDTH: {bandwidth} Mbps")
+    else:
+        print(f"DURATION: {duration} s\t DATA SIZE: {total_data_KB} KB\t BANDWIDTH: {bandwidth} Kbps")
+    summary = strategy.summary()
+    if summary is not None:
+        print(summary)
+    print("----------------------------------------------------------")
+
+# Server side of the functions below: receives one transfer with the strategy, logging every packet, and
+# writes it to new_file_name. With a sink or placement the data is already written, the caller closes them
+# (it may still need to save progress). Returns the data, or None if it went to a sink or placement.
+def receive_transfer(strategy, sock, new_file_name=None, placement=None, mss=MSS, digest=None, sink=None, timer=None, isn=0, wscale=0, metrics=None):
+    print(f"\n------ SERVER: {strategy.title} IN DRTP METHOD STARTS ------\n")
+    received_file_data = strategy.receive(sock, sink, digest, placement, isn, mss, wscale, metrics, log=print)
+    if received_file_data is None:
+        print("\n------ Server: Received data already placed in the file ------\n")
+        return None
+
+    with timed_phase(timer, "disk write"), open(new_file_name, 'wb') as file:
+        print("\n------ Server: Writing received data to file ------\n")
+        file.write(received_file_data)
+    return received_file_data
 
+# The stop_and_wait function implements the Stop-and-Wait protocol for reliable data transmission.
+# The sender sends a packet and then waits for an acknowledgement from the receiver before sending the next packet.
+# This method is used both by the server to receive data and the client to send data.
+def stop_and_wait(socket, is_server, file_data=None, server_ip=None, server_port=None, new_file_name=None, test_case=None, mss=MSS, digest=None, sink=None, timer=None, isn=0, rtt=None, metrics=None):
+    if is_server:
+        return receive_transfer(StopAndWait(test_case), socket, new_file_name, None, mss, digest, sink, timer, isn, 0, metrics)
+    send_transfer(StopAndWait(test_case), socket, file_data, server_ip, server_port, mss, isn, 0, rtt, metrics)
 
 """
 The `gbn` function implements the Go-Back-N (GBN) protocol for reliable data transmission over a network.
  It operates in both client and server modes for sending and receiving data, respectively. The function handles
    packet loss scenarios with a sliding window mechanism and acknowledgment packets.
 """
-def gbn(socket, is_server, file_data=None, server_ip=None, server_port=None, new_file_name=None, N=5, test_case=None):
-    
-    # Test case number for simulating specific packet scenarios
-    test_case_num = 2
-
+def gbn(socket, is_server, file_data=None, server_ip=None, server_port=None, new_file_name=None, N=5, test_case=None, placement=None, mss=MSS, digest=None, sink=None, timer=None, isn=0, wscale=0, rtt=None, metrics=None):
     if is_server:
-        
-        print("\n------ SERVER: GO-BACK-N IN DRTP METHOD STARTS ------\n")
-
-        # (Server code remains the same until the packet_receiver function)
-        
-        # Base sequence number for the sliding window
-        base = 1
-        # Buffer for storing out of order packets
-        window_packets = []
-        # Lock for synchronizing access to shared resources
-        lock = threading.Lock()
-        # Byte array for storing received file data
-        received_file_data = bytearray()
-
-        # Packet receiver thread function
-        def packet_receiver():
-            
-            print("\nSERVER: packet_receiver: Thread start ------\n")
-
-            # Nonlocal keyword allows us to assign to variables in the nearest enclosing scope that is not global
-            nonlocal base
-            nonlocal window_packets
-            nonlocal received_file_data
-
-            # Continuously listen for incoming packets
-            while True:
-                try:
-                    # Receive a packet from the client
-                    data, client_address = socket.recvfrom(1472)
-                    seq, ack, flags, _ = parse_header(data[:12])
-                    print(f"\n------\nServer: Received packet seq #{seq}, ACK #{ack}, and flags {flags}")
-                    payload = data[12:]
-                    
-                    # If the packet sequence number is equal to the base, it's the packet we're expecting
-                    if seq == base:
-                        # Append the packet data to our received data
-                        print(f"\nServer: Checking if packet seq #{seq} equals base {base}")
-                        received_file_data.extend(payload)
-
-                        # Skip acknowledgement for the second packet if test_case is "skip_ack"
-                        if test_case == "skip_ack" and seq == test_case_num:
-                            print(f"Server: 'Skipping' acknowledgement for packet #{seq} (Test case: 'skip_ack')")
-                        else:
-                            # Send an acknowledgment packet back to the client
-                            ack_packet = create_packet(0, seq, flags, 0, b'')
-                            print(f"\nServer: Created ACK packet #{seq}, with flags {flags}")
-                            socket.sendto(ack_packet, client_address)
-                            print(f"Server: Sent ACK packet #{seq} to client\n------")
-
-                        with lock:
-                             # Increase the base sequence number
-                            base += 1
-
-                            # Remove the first packet from the window
-                            if window_packets:
-                                window_packets.pop(0)
-
-                        if flags == (1 << 1):
-                            print(f"\nServer: Received FIN flag, ending communication.....")
-                            #if received FIN flag, stop listening and receive any more packets.
-                            break        
-
-                    elif base < seq:
-                        #if the received packet wasn't in order, e.g losing previous packet. it will be ignored and send it
-                        #to the window_packets.
-                        with lock:
-                            window_packets.append((seq, payload))
-                            window_packets.sort(key=lambda x: x[0])
-                        
-                except TimeoutError:
-                    #in case of late in receiving more packet, relooping to listening until receiving FIN flag.
-                    continue
-            print("\n------ SERVER: packet_receiver: Thread finished\n")        
-        
-        # Start the packet receiver thread
-        recv_thread = threading.Thread(target=packet_receiver)
-        recv_thread.start()
-        
-        recv_thread.join()
-        
-        with open(new_file_name, 'wb') as file:
-            print("\n------ Server: Writing received data to file ------\n")
-            file.write(received_file_data)
-
-        return received_file_data
-
-    else:
-      
-        # Client side
-        print("------ CLIENT: GO-BACK-N IN DRTP METHOD STARTS ------\n")
-
-        # start time of sending data
-        start_time = time.time()
-
-        # `c_base` and `c_next_seq_num` are sequence numbers representing the base of the window 
-        # and the next packet to be sent, respectively
-        c_base = 1
-        c_next_seq_num = 1
-        # `c_window_packets` is a list used to keep track of packets within the window that have been sent but not yet acknowledged
-        c_window_packets = []
-        # `c_lock` is a threading lock used to ensure that operations on shared resources are performed atomically 
-        c_lock = threading.Lock()
-        packet_counter = 0 # To be used in the double test case
-
-        # `c_packet_sender` is a function to handle the sending of packets
-        def c_packet_sender():
-            print("CLIENT: c_packet_sender: Thread started ------\n")
-            
-            # Make `c_base`, `c_next_seq_num`, and `c_window_packets` accessible in this function
-            nonlocal c_base
-            nonlocal c_next_seq_num
-            nonlocal c_window_packets
-            nonlocal packet_counter
-
-            # Divide the file data into chunks to send as individual packets
-            chunks = [file_data[i:i + 1460] for i in range(0, len(file_data), 1460)]
-            # Continuously send packets while there are still chunks left to send
-            while True:
-                
-
-                # Send all packets in the current window
-                while c_next_seq_num < c_base + N and c_next_seq_num <= len(chunks):
-                    # Increment the packet counter for each packet created.
-                    packet_counter += 1
-
-                    # Create a packet for the current chunk
-                    chunk = chunks[c_next_seq_num - 1]
-                    print(f"\n------\nClient: Creating chunk #{c_next_seq_num}")
-                    fin_flag = (1 << 1) if c_next_seq_num == len(chunks) else 0
-                    packet = create_packet(c_next_seq_num, 0, fin_flag, 0, chunk)
-                    print(f"Client: Created packet #{c_next_seq_num} with flags {fin_flag}")
-
-                    # Add the packet to the window
-                    with c_lock:
-                        c_window_packets.append((packet, time.time()))
-                        
-                    # Check if the test case is "double" and if it's the 2nd packet (packet_counter == 2).
-                    # If it is, then the client deliberately sends this packet twice.
-                    if test_case == "double" and packet_counter == 2:
-                        print(f"Test case 'DOUBLE': Client is sending packet #{c_next_seq_num} twice")
-                        socket.sendto(packet, (server_ip, server_port))
-                        print(f"Client: Sent packet #{c_next_seq_num} to server\n------")
-                        socket.sendto(packet, (server_ip, server_port))
-                        print(f"Client: Packet #{c_next_seq_num} sent to server twice")
-
-                    # "Lose" a packet if test_case is "lose" and c_next_seq_num =2 in our case, we can edit it as well.
-                    elif test_case == "lose" and c_next_seq_num == test_case_num:
-                        print(f"Client: skipped sending packet #{c_next_seq_num} (Test case: 'lose')")
-                    else:
-                        # Send the packet
-                        socket.sendto(packet, (server_ip, server_port))
-                        print(f"Client: Sent packet #{c_next_seq_num} to server\n------")
-                    
-                    c_next_seq_num += 1
-                
-                # Exit the loop if all packets have been sent
-                with c_lock:
-                    if fin_flag == (1 << 1):
-                        print(f"Client: NO MORE PACKETS TO SEND")
-                        break
-
-            print("\n------ CLIENT: c_packet_sender: Thread finished\n")
-           
-
-        # `c_packet_receiver` is a function to handle the receiving of acknowledgements
-        def c_packet_receiver():
-            print("\nCLIENT: c_packet_receiver: Thread started ------\n")
-
-            # Make `c_base` and `c_window_packets` accessible in this function
-            nonlocal c_base
-            nonlocal c_window_packets
-
-            # Continuously listen for acknowledgements
-            while True:
-                try:
-                    # Receive an acknowledgement from the server
-                    data, _ = socket.recvfrom(1472)
-                    _, ack, flags, _ = parse_header(data[:12])
-                    print(f"\n------\nClient: Received ACK #{ack} with flags {flags}")
-
-                    # Update the window based on the received acknowledgement
-                    with c_lock:
-                        if ack >= c_base:
-                            # Remove all acknowledged packets from the window
-                            while c_window_packets:
-                                packet, time = c_window_packets[0]
-                                seq_num, _, _, _ = parse_header(packet[:12])  # assuming that header is the first 12 bytes
-                                if seq_num <= ack:
-                                    c_window_packets.pop(0)
-                                    print(f"Client: Popped packet #{seq_num} from window_packets")
-                                else:
-                                    break
-                            c_base = ack + 1
-                        # If we received a packet with a FIN flag, we end the communication.
-                        if flags == (1 << 1):
-                            import time
-                            print(f"\nClient: Received FIN flag, ending communication......\n")
-                            
-                            # At the end of the transmission, record the end time.
-                            end_time = time.time()
-                            
-                            # Calculate the total transferred data in MB
-                            total_data_Mb = (len(file_data)/1000000)*8
-                            total_data_Kb = (len(file_data) / 1000)*8
-                            total_data_MB = round(len(file_data)/1000000,2)
-                            total_data_KB = round(len(file_data)/1000,2)
-
-                            # Calculate the time taken in seconds
-                            duration = round(end_time - start_time,3) # this is in seconds
-                            time_taken = end_time - start_time
-                            
-
-                            # Calculate the bandwidth in Mbps
-                            bandwidth = round(total_data_Mb / time_taken if total_data_Mb >= 1 else total_data_Kb / time_taken,2)
-
-                            print("----------------------------------------------------------")
-                            if total_data_Mb >= 1:
-                                print(f"DURATION: {duration} s\t DATA SIZE: {total_data_MB} MB\t BANDWIDTH: {bandwidth} Mbps")
-                                print("----------------------------------------------------------")
-                            else:
-                                print(f"DURATION: {duration} s\t DATA SIZE: {total_data_KB} KB\t BANDWIDTH: {bandwidth} Kbps")
-                                print("----------------------------------------------------------")
-                            break
-                except TimeoutError:
-                    # If we hit a timeout, it means we haven't received an ACK for a packet. 
-                    # We resend all packets in the window.
-                    with c_lock:
-                        for packet, _ in c_window_packets:
-                            socket.sendto(packet, (server_ip, server_port))
-                            print(f"\nClient: RESEND Window")
-
-            # Once we have received all ACKs (or hit the maximum number of retries), this thread can finish.    
-            print("\n------ CLIENT: c_packet_receiver: Thread finished\n")
-
-        # Start a thread for sending packets and another for receiving ACKs. This allows us to send and receive simultaneously.
-        send_thread = threading.Thread(target=c_packet_sender)
-        send_thread.start()
-
-        c_recv_thread = threading.Thread(target=c_packet_receiver)
-        c_recv_thread.start()
-
-        # We wait until both threads have finished before we continue. This is necessary to ensure that all packets have been 
-        # sent and all acknowledgements have been received before the program exits.
-        send_thread.join()
-        c_recv_thread.join()
+        return receive_transfer(GoBackN(N, test_case), socket, new_file_name, placement, mss, digest, sink, timer, isn, wscale, metrics)
+    send_transfer(GoBackN(N, test_case), socket, file_data, server_ip, server_port, mss, isn, wscale, rtt, metrics)
 
 # Method implements Selective Repeat protocol.
-def sr(socket, is_server, file_data=None, server_ip=None, server_port=None, new_file_name=None, N=5, test_case=None):
-    
-    #to be used at the test case.
-    test_case_num = 2
-
-    # The server side of the protocol
+def sr(socket, is_server, file_data=None, server_ip=None, server_port=None, new_file_name=None, N=5, test_case=None, placement=None, mss=MSS, digest=None, sink=None, timer=None, isn=0, wscale=0, rtt=None, metrics=None):
     if is_server:
-        print("\n------ SERVER: SELECTIVE REPEAT IN DRTP METHOD STARTS ------")
-        
-        # Defines the base sequence number and a list to hold received packets
-        base = 1
-        expected_seq_num = 1
-        received_packets = []
-        lock = threading.Lock()
-        received_file_data = bytearray()
-
-        # A thread that handles receiving packets from the client
-        # Handles incoming packets from the client
-        # This function runs in its own thread to allow simultaneous sending and receiving
-        def packet_receiver():
-            # Acknowledgment counter
-            ack_counter = 0
-            print("\nSERVER: packet_receiver: Thread start ------\n")
-
-            # Local variables to access shared variables
-            nonlocal base
-            nonlocal expected_seq_num
-            nonlocal received_packets
-            nonlocal received_file_data
-
-            # Packet receiving loop
-            while True:
-                
-                try:
-                    # Receive data from the client
-                    data, client_address = socket.recvfrom(1472)
-
-                    # Parse the packet header
-                    seq, ack, flags, _ = parse_header(data[:12])
-                    print(f"\n------\nServer: Received packet seq #{seq}, ACK #{ack}, and flags {flags}")
-                    payload = data[12:]
-                    ack_counter += 1
-
-                    # Skip acknowledgement for a packet if test_case is "skip_ack"
-                    if test_case == "skip_ack" and ack_counter == 2:
-                        print(f"Server: 'Skipping' acknowledgement for packet #{seq} (Test case: 'skip_ack')")
-                    else:
-                        # Send an ACK back to the client for the received packet
-                        ack_packet = create_packet(0, seq, flags, 0, b'')
-                        print(f"\nServer: Created ACK packet #{seq}, with flags {flags}")
-                        socket.sendto(ack_packet, client_address)
-                        print(f"Server: Sent ACK packet #{seq} to client\n------")
-
-                    # If the expected packet is received, append it to the data
-                    if seq == expected_seq_num:
-                        received_file_data.extend(payload)
-
-                        with lock:
-                            expected_seq_num += 1
-                            # re-sort the received packets
-                            received_packets.sort(key=lambda x: x[0])
-
-                            # keep checking if the next packet has received already and stored in the received_packets array.
-                            # and remove it from the array if founded.
-                            while received_packets and received_packets[0][0] == expected_seq_num:
-                                _, payload = received_packets.pop(0)
-                                received_file_data.extend(payload)
-                                expected_seq_num += 1
-
-                        if flags == (1 << 1):
-                            print(f"\nServer: Received FIN flag, ending communication.....")
-                            # Stop the receiving process after received FIN flag.
-                            break        
-
-                    # If a packet with a higher sequence number is received, it is stored in received_packets list 
-                    # and to handle later in order.
-                    elif seq > expected_seq_num:
-                        with lock:
-                            # store the packet and re-sort the list
-                            received_packets.append((seq, payload))
-                            received_packets.sort(key=lambda x: x[0])
-                        
-                except TimeoutError:
-                    continue
-            print("\n------ SERVER: packet_receiver: Thread finished\n")        
-
-        # Start the packet receiver thread
-        recv_thread = threading.Thread(target=packet_receiver)
-        recv_thread.start()
-        
-        # Wait for the packet receiver thread to finish
-        recv_thread.join()
-        
-        # Write the received data to a file
-        with open(new_file_name, 'wb') as file:
-            print("\n------ Server: Writing received data to file ------\n")
-            file.write(received_file_data)
-
-        return received_file_data
-
-    # The client side of the protocol
-    else:
-        # Client side
-        print("------ CLIENT: GO-BACK-N IN DRTP METHOD STARTS ------\n")
-
-        # Defines the base sequence number and a list to hold window packets
-        Timeout = 0.5
-        c_base = 1
-        c_next_seq_num = 1
-        c_window_packets = []
-        c_lock = threading.Lock()
-        packet_counter = 0 # To be used in the double test case
-
-        # start time of sending data
-        start_time = time.time()
-
-        # The thread function responsible for sending packets to the server
-        def c_packet_sender():
-            print("c_packet_sender: Thread started")
-
-            # Local variables to access shared variables
-            nonlocal c_base
-            nonlocal c_next_seq_num
-            nonlocal c_window_packets
-            nonlocal packet_counter
-
-            # Divide the file data into chunks of size 1460 (maximum size that can fit into a packet)
-            chunks = [file_data[i:i + 1460] for i in range(0, len(file_data), 1460)]
-            all_chunks_sent = False
-
-            # Continuously send packets while there are still packets to send
-            while True:
-                
-
-                while c_next_seq_num < c_base + N and c_next_seq_num <= len(chunks):
-
-                    # Increment the packet counter for each packet created.
-                    packet_counter += 1
-
-                    # Create a packet for the current chunk
-                    chunk = chunks[c_next_seq_num - 1]
-                    print(f"\n------\nClient: Creating chunk #{c_next_seq_num}")
-
-                    # set FIN flag to last packet
-                    fin_flag = (1 << 1) if c_next_seq_num == len(chunks) else 0
-
-                    packet = create_packet(c_next_seq_num, 0, fin_flag, 0, chunk)
-                    print(f"Client: Created packet #{c_next_seq_num} with flags {fin_flag}")
-
-                    # append all the packets to be poped later after their ACKs be received
-                    with c_lock:
-                        # here we added the time of adding (sending) the packet, 
-                        # to be checked later.
-                        c_window_packets.append((c_next_seq_num, packet, time.time()))
-
-
-                    # Check if the test case is "double" and if it's the 2nd packet (packet_counter == 2).
-                    # If it is, then the client deliberately sends this packet twice.
-                    if test_case == "double" and packet_counter == 2:
-                        
-                        socket.sendto(packet, (server_ip, server_port))
-                        print(f"Client: Sent packet #{c_next_seq_num} to server")
-                        socket.sendto(packet, (server_ip, server_port))
-                        print(f"Client: Sent packet #{c_next_seq_num} to server")
-                        print(f"Test case 'DOUBLE': Client is sending packet #{c_next_seq_num} twice")
-
-                    # skip sending a packet if test_case is "lose"
-                    elif test_case == "lose" and c_next_seq_num == test_case_num:
-                        print(f"Client: skipped sending packet #{c_next_seq_num} (Test case: 'lose')")
-                    else:
-                        # else sent packets as normal
-                        socket.sendto(packet, (server_ip, server_port))
-                        print(f"Client: Sent packet #{c_next_seq_num} to server\n------")
-                    
-                    c_next_seq_num += 1
-
-                    # If all chunks have been sent, set the flag all_chunks_sent
-                    if c_next_seq_num > len(chunks):
-                        all_chunks_sent = True  # All chunks have been sent
-
-                # Check for timed out packets and resend them.
-                with c_lock:
-                    
-                    current_time = time.time()
-                    # parse sending time for each packet, if it still in the array more than 0.5 sec, 
-                    # it will send again.
-                    for seq_num, packet, send_time in c_window_packets:
-                        if current_time - send_time > Timeout:  # assuming Timeout is defined somewhere
-                            socket.sendto(packet, (server_ip, server_port))
-                            print(f"Client RESENT packet: {seq_num} ")
-
-                # If all chunks have been sent and all ACKs have been received, break the loop
-                if all_chunks_sent and not c_window_packets:
-                    print(f"Client: NO MORE PACKETS TO SEND")
-                    break
-
-            print("\n------ CLIENT: c_packet_sender: Thread finished\n")
-
-        # The thread function responsible for receiving ACKs from the server
-        def c_packet_receiver():
-            print("\nCLIENT: c_packet_receiver: Thread started ------\n")
-
-            # Local variables to access shared variables
-            nonlocal c_base
-            nonlocal c_window_packets
-
-            # Continuously receive ACKs from the server
-            while True:
-                try:
-                    # Receive an ACK from the server
-                    data, _ = socket.recvfrom(1472)
-
-                    # Parse the packet header
-                    _, ack, flags, _ = parse_header(data[:12])
-                    print(f"\n------\nClient: Received ACK #{ack} with flags {flags}")
-
-                    # Update the window based on the received ACK
-                    with c_lock:
-                        # Update the timestamp of the acknowledged packet
-                        for i in range(len(c_window_packets)):
-                            if c_window_packets[i][0] == ack:
-                                c_window_packets[i] = (c_window_packets[i][0], c_window_packets[i][1], time.time())
-                                break
-
-                        # remove all the ACKed packets.
-                        c_window_packets = [(seq_num, packet, send_time) for seq_num, packet, send_time in c_window_packets if seq_num != ack]
-
-                        # Update the base sequence number, where it equal to min ACK in the array.
-                        # which mean the min ACK for none ACKed packet.
-                        if c_window_packets:
-                            c_base = min(seq_num for seq_num, _, _ in c_window_packets)
-                        else:
-                            # if all the packets ACKed then slide the window.
-                            c_base = c_next_seq_num
-
-                        #if the FIN flag received, then Stop receiving.
-                        if flags == (1 << 1):
-                            print(f"\nClient: Received FIN flag, ending communication......\n")
-
-                            # At the end of the transmission, record the end time.
-                            end_time = time.time()
-                            
-                            # Calculate the total transferred data in MB
-                            total_data_Mb = (len(file_data)/1000000)*8
-                            total_data_Kb = (len(file_data) / 1000)*8
-                            total_data_MB = round(len(file_data)/1000000,2)
-                            total_data_KB = round(len(file_data)/1000,2)
-
-                            # Calculate the time taken in seconds
-                            duration = round(end_time - start_time,3) # this is in seconds
-                            time_taken = end_time - start_time
-                            
-
-                            # Calculate the bandwidth in Mbps
-                            bandwidth = round(total_data_Mb / time_taken if total_data_Mb >= 1 else total_data_Kb / time_taken,2)
-
-                            print("----------------------------------------------------------")
-                            if total_data_Mb >= 1:
-                                print(f"DURATION: {duration} s\t DATA SIZE: {total_data_MB} MB\t BANDWIDTH: {bandwidth} Mbps")
-                                print("----------------------------------------------------------")
-                            else:
-                                print(f"DURATION: {duration} s\t DATA SIZE: {total_data_KB} KB\t BANDWIDTH: {bandwidth} Kbps")
-                                print("----------------------------------------------------------")
-                            break
-
-                except TimeoutError:
-                    continue
-                
-            print("\n------ CLIENT: c_packet_receiver: Thread finished\n")
+        return receive_transfer(SelectiveRepeat(N, test_case), socket, new_file_name, placement, mss, digest, sink, timer, isn, wscale, metrics)
+    send_transfer(SelectiveRepeat(N, test_case), socket, file_data, server_ip, server_port, mss, isn, wscale, rtt, metrics)
 
-        # Start the packet sender and receiver threads
-        send_thread = threading.Thread(target=c_packet_sender)
-        send_thread.start()
-
-        c_recv_thread = threading.Thread(target=c_packet_receiver)
-        c_recv_thread.start()
-
-        send_thread.join()
-        c_recv_thread.join()
-
-
-
-
-        
-       
-
-        
+# Adaptive method, see Adaptive.
+def auto(socket, is_server, file_data=None, server_ip=None, server_port=None, new_file_name=None, N=5, test_case=None, placement=None, mss=MSS, digest=None, sink=None, timer=None, isn=0, wscale=0, rtt=None, metrics=None):
+    if is_server:
+        return receive_transfer(Adaptive(N, test_case), socket, new_file_name, placement, mss, digest, sink, timer, isn, wscale, metrics)
+    send_transfer(Adaptive(N, test_case), socket, file_data, server_ip, server_port, mss, isn, wscale, rtt, metrics)
@@ -1,9 +1,29 @@
 import argparse
+import contextlib
+import io
 import socket
 import os
-from DRTP import handshake, fin_handshake, stop_and_wait, gbn, sr
+import sys
+import threading
+import time
+from DRTP import handshake, fin_handshake, stop_and_wait, gbn, sr, auto, STRATEGIES, receive_transfer, file_info_packet, parse_file_info, limit_ranges, ranges_packet, parse_ranges, ChunkSource, RTTEstimator, receive_before, MAX_RETRIES
+from header import MSS
+from placement import PlacementWriter
+from integrity import DigestWorker, CHECKSUM_SIZE, tap_blocks
+from compression import compress_blocks, Decompressor, CODECS, BLOCK_SIZE
+from manifest import manifest_blocks, read_ahead, ManifestWriter
+from pipeline import PacketPipeline
+from delta import file_signatures, signature_block_size, file_delta, DeltaEncoder, DeltaApplier
+from connection import session_layers
+from tracing import TraceRecorder
+from metrics import MetricsServer, TransferMetrics
+from scheduler import FairScheduler, parse_client_values
+from profiling import PhaseTimer, TimedCalls, timed_blocks, profiled, PROFILERS
 
-def server(server_ip, server_port, reliable_method, test_case=None):
+# Window (in packets) for sending the block signatures of a delta transfer with gbn or sr.
+SIGNATURE_WINDOW = 32
+
+def server(server_ip, server_port, reliable_method, test_case=None, direct=False, loss=0.0, to_stdout=False, trace_file=None, sessions=None, weights=None, rates=None, metrics_server=None):
     # Set up a UDP server
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     server_socket.bind((server_ip, server_port))
@@ -13,72 +33,439 @@ def server(server_ip, server_port, reliable_method, test_case=None):
         print(f"  Test case: {test_case}")
     else:
         print()
-        
-    while True:
 
-        client_address = handshake(server_socket, None, True)
+    if sessions is None:
+        # One client, the server exits after its transfer.
+        serve_session(server_socket, server_ip, server_port, reliable_method, test_case, direct, loss, to_stdout, trace_file, metrics_server)
+        return
+
+    # Up to `sessions` clients at a time, each in a thread of its own on a session socket of the scheduler,
+    # which shares the receive processing and the advertised window between them (see scheduler.py).
+    scheduler = FairScheduler(server_socket, sessions, weights, rates)
+    print(f"Server: Serving up to {sessions} client(s) at a time with fair scheduling, until interrupted")
+    count = 0
+    try:
+        while True:
+            session = scheduler.accept()
+            count += 1
+            # Every session gets a trace file of its own.
+            session_trace = f"{trace_file}.{count}" if trace_file else None
+            threading.Thread(target=scheduled_session, args=(session, server_ip, server_port, reliable_method, test_case, direct, loss, session_trace, metrics_server), daemon=True).start()
+    finally:
+        scheduler.close()
+
+
+def scheduled_session(session, server_ip, server_port, reliable_method, test_case, direct, loss, trace_file, metrics_server):
+    try:
+        serve_session(session, server_ip, server_port, reliable_method, test_case, direct, loss, False, trace_file, metrics_server)
+    except ConnectionError as error:
+        # The scheduler closed the session, its client went quiet.
+        print(f"Server: Error: {error}")
+    finally:
+        session.close()
+        if session.dropped:
+            print(f"Server: {session.dropped} packet(s) of {session.address[0]}:{session.address[1]} were over its share and dropped")
 
-        # Receive the file name from the client
-        file_name_binary, _ = server_socket.recvfrom(1024)
-        file_name = file_name_binary.decode('latin1')  # Use latin1 encoding to preserve binary data
-        print(f"Server: Received file name '{file_name}' from the client")
+
+# One session on server_socket (the server's socket or a scheduler's session socket): handshake, file info,
+# the transfer and the FIN handshake.
+def serve_session(server_socket, server_ip, server_port, reliable_method, test_case=None, direct=False, loss=0.0, to_stdout=False, trace_file=None, metrics_server=None):
+    # RTT estimate of the session, the handshake gives the first sample.
+    rtt = RTTEstimator()
+    client_address, isn, wscale = handshake(server_socket, None, True, rtt=rtt)
+
+    # Time per phase of the session, from the end of the handshake (before it the server is only waiting).
+    timer = PhaseTimer()
+    timer.switch("setup")
+
+    # Receive the file name from the client
+    file_name_binary, _ = server_socket.recvfrom(1024)
+    file_name, file_options = parse_file_info(file_name_binary)
+    print(f"Server: Received file name '{file_name}' from the client")
+    # A manifest carries a whole directory, its files are written below <name>_rcv/.
+    manifest = file_options.get("manifest") == "1"
+    if manifest:
+        new_file_name = file_name + "_rcv"
+        print(f"Server: Will save the files in directory: '{new_file_name}'.")
+    else:
         new_file_name = os.path.splitext(file_name)[0] + "_rcv" + os.path.splitext(file_name)[1]
         print(f"Server: Will save the file in name: '{new_file_name}'.")
 
+    file_size = int(file_options["size"]) if "size" in file_options else None
+    resume = file_options.get("resume") == "1" and file_size is not None
+    # In delta mode the file is rebuilt from our earlier copy (the basis) and what the client sends.
+    delta = file_options.get("delta") == "1" and not manifest
 
-        # Print the client IP and port after handshake is complete
-        print(f"Server: Connected to client at {client_address[0]}:{client_address[1]}")
-                       
-        if reliable_method == "stop_and_wait":
-            stop_and_wait(server_socket, True, new_file_name=new_file_name, test_case=("skip_ack" if test_case == "skip_ack" else None))
+    # With checksums every datagram carries a CRC32 trailer (so the payload is 4 bytes smaller)
+    # and the client sends a digest of the whole file in its FIN packet.
+    checksum = file_options.get("checksum") == "1"
+    mss = MSS - CHECKSUM_SIZE if checksum else MSS
+    digest = DigestWorker() if checksum else None
 
-        elif reliable_method == "gbn":
-            gbn(server_socket, True, server_ip=server_ip, server_port=server_port, new_file_name=new_file_name, test_case=("skip_ack" if test_case == "skip_ack" else None))
+    # The data can be streamed to stdout instead of a file, a manifest is split into its files and a
+    # compressed stream is decompressed into the output as it arrives. These all write in order,
+    # so direct placement is not used then.
+    compress = file_options.get("compress")
+    output_file = None
+    decompressor = None
+    sink = None
+    if to_stdout:
+        output_file = sys.__stdout__.buffer
+        print("Server: Writing the received data to stdout")
+    elif manifest:
+        output_file = ManifestWriter(new_file_name)
+    elif delta:
+        # The basis is read while the new file is written, so the new file replaces it at the end.
+        output_file = open(new_file_name + ".delta", 'wb')
+    elif compress:
+        output_file = open(new_file_name, 'wb')
+    if output_file is not None:
+        output_file = TimedCalls(output_file, timer, "disk write")
+    sink = output_file
+    applier = None
+    if delta:
+        with timer.phase("signatures"):
+            signatures = file_signatures(new_file_name)
+        sink = applier = DeltaApplier(new_file_name, output_file, signature_block_size(signatures), digest)
+    if compress:
+        sink = decompressor = Decompressor(sink, None if delta else digest)
+        print(f"Server: Receiving a {compress.replace(':', ' level ')} compressed stream")
 
-        elif reliable_method == "sr":
-            sr(server_socket, True, server_ip=server_ip, server_port=server_port, new_file_name=new_file_name, test_case=("skip_ack" if test_case == "skip_ack" else None)) 
-            
-        # Call the fin_handshake method after receiving the file data 
-        fin_handshake(server_socket, None, True)
-        # Add a print statement to display that the connection with the client has been closed
-        print(f"Server: Connection with client at {client_address[0]}:{client_address[1]} has been closed")
-        break
+    # With direct placement the output file is preallocated (when the client sent the size)
+    # and every payload is written straight to its offset as it arrives.
+    # Resuming always uses direct placement, the bitmap of the last attempt is kept next to the output.
+    placement = None
+    if (direct or resume) and reliable_method != "stop_and_wait" and sink is None:
+        placement = TimedCalls(PlacementWriter(new_file_name, file_size, mss=mss, resume=resume, digest=digest), timer, "disk write", ('place', 'close'))
+        print(f"Server: Direct placement into '{new_file_name}' ({file_size if file_size is not None else 'unknown'} bytes)")
+
+    # A resuming client waits for the chunk ranges we still need before it starts sending.
+    if resume:
+        if placement is not None:
+            missing = limit_ranges(placement.missing_ranges())
+            placement.set_chunk_map(missing)
+        else:
+            # stop_and_wait can not place chunks at an offset, so ask for the whole file again.
+            missing = [(0, (file_size + mss - 1) // mss)]
+        send_ranges(server_socket, ranges_packet(missing, isn), file_name_binary, client_address)
+        missing_chunks = sum(end - start for start, end in missing)
+        print(f"Server: Resuming '{new_file_name}', {missing_chunks} chunk(s) in {len(missing)} range(s) still missing")
+
+    # A delta client waits for the signatures of our copy, they go the other way with the same method.
+    if delta:
+        if applier.basis is None:
+            print(f"Server: No earlier copy of '{new_file_name}', the client sends the whole file as literal data")
+        print(f"Server: Sending {len(signatures)} bytes of block signatures of '{new_file_name}'")
+        with timer.phase("signatures"):
+            send_signatures(server_socket, signatures, reliable_method, client_address, isn, wscale, rtt)
+
+
+    # Print the client IP and port after handshake is complete
+    print(f"Server: Connected to client at {client_address[0]}:{client_address[1]}")
+
+    trace = TraceRecorder(trace_file) if trace_file else None
+    # Live counters of the session on the metrics endpoint.
+    metrics = None
+    if metrics_server is not None:
+        metrics = TransferMetrics("server", client_address, reliable_method, rtt, mss)
+        metrics_server.add(metrics)
+    session_socket, checksum_socket = session_layers(server_socket, loss, checksum, file_options.get("fec"), trace, timer, metrics)
+    # The placement writer, the decompressor and the delta applier feed the digest themselves,
+    # the other receivers hash in-order payloads.
+    payload_digest = digest if placement is None and decompressor is None and applier is None else None
+
+    timer.switch("transfer")
+    # The receiver is kept for the FIN handshake, which answers late retransmissions on its behalf.
+    receiver = STRATEGIES[reliable_method](test_case=("skip_ack" if test_case == "skip_ack" else None))
+    try:
+        if resume and placement is not None and placement.is_complete():
+            print("Server: Nothing left to receive, the file is already complete")
+        else:
+            receive_transfer(receiver, session_socket, new_file_name, placement, mss, payload_digest, sink, timer, isn, wscale, metrics)
+    except KeyboardInterrupt:
+        # Keep what has been received so far, the client can pick up from here with --resume.
+        if placement is not None:
+            placement.save_progress()
+            print(f"\nServer: Interrupted, progress saved in '{placement.progress_file}'")
+        raise
+    finally:
+        if metrics is not None:
+            metrics.finish()
+
+    # Call the fin_handshake method after receiving the file data 
+    timer.switch("teardown")
+    client_digest = fin_handshake(session_socket, None, True, method=reliable_method, rtt=rtt, last_seq=receiver.last_seq)
 
+    if decompressor is not None:
+        decompressor.close()
+        print(f"Server: Decompressed {decompressor.decompressed} bytes")
+    if applier is not None:
+        applier.close()
+        print(f"Server: Rebuilt the file from {applier.copied_bytes} bytes of our copy and {applier.literal_bytes} literal bytes")
+    if output_file is not None:
+        if to_stdout:
+            output_file.flush()
+        else:
+            output_file.close()
+    # A stream that could not be decoded leaves a truncated output: it is not kept, and in delta mode
+    # our earlier copy stays as it was.
+    decode_errors = (decompressor.errors if decompressor is not None else 0) + (applier.errors if applier is not None else 0)
+    if decode_errors:
+        print(f"Server: Error: the transfer FAILED, {decode_errors} error(s) while decoding the received stream")
+        if delta and not to_stdout:
+            os.remove(new_file_name + ".delta")
+        elif compress and not to_stdout and not manifest:
+            os.remove(new_file_name)
+    elif delta and not to_stdout:
+        os.replace(new_file_name + ".delta", new_file_name)
+    if manifest and not to_stdout:
+        print(f"Server: Received {output_file.files} file(s), {output_file.bytes} bytes, in '{new_file_name}'")
+
+    if digest is not None:
+        if digest.digest() == client_digest:
+            print(f"Server: Integrity check passed ({digest.hexdigest()})")
+        else:
+            print(f"Server: Error: integrity check FAILED, '{new_file_name}' does not match the client's file")
+        if checksum_socket.dropped:
+            print(f"Server: {checksum_socket.dropped} corrupted packet(s) were dropped and retransmitted")
+
+    if file_options.get("fec"):
+        print(f"Server: FEC rebuilt {session_socket.recovered} lost packet(s) without a retransmission")
+
+    if placement is not None:
+        placement.close()
+
+    if trace is not None:
+        print(f"Server: Wrote {trace.close()} trace record(s) to '{trace_file}'")
 
+    timer.switch(None)
+    timer.report("Server")
 
-def client(server_ip, server_port, file_path, reliable_method, test_case=None):
+    # Add a print statement to display that the connection with the client has been closed
+    print(f"Server: Connection with client at {client_address[0]}:{client_address[1]} has been closed")
+
+
+def client(server_ip, server_port, file_path, reliable_method, test_case=None, resume=False, checksum=False, compress=None, level=6, fec=None, loss=0.0, stream_name="stdin", trace_file=None, window=5, delta=False, workers=0, metrics_server=None):
     # Set up a UDP client
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    handshake(None, client_socket, False, server_ip, server_port, 1)
+    timer = PhaseTimer()
+    timer.switch("handshake")
+    rtt = RTTEstimator()
+    try:
+        _, isn, wscale = handshake(None, client_socket, False, server_ip, server_port, rtt=rtt)
+    except ConnectionError as error:
+        print(f"Client: Error: {error}")
+        return
+    timer.switch("setup")
+
+    # "-" streams standard input, its length is not known until the pipe is closed.
+    # A directory is sent as a manifest of all its files in this one session.
+    from_stdin = file_path == "-"
+    is_directory = not from_stdin and os.path.isdir(file_path)
+    streamed = from_stdin or is_directory
 
     # Send the file name to the server
-    file_name = os.path.basename(file_path)
-    file_name_binary = file_name.encode('latin1')  # Use latin1 encoding to preserve binary data
+    # The total size lets a server using direct placement preallocate the output file.
+    if from_stdin:
+        file_name = stream_name
+    else:
+        file_name = os.path.basename(os.path.normpath(file_path))
+    file_size = None if streamed else os.path.getsize(file_path)
+    file_name_binary = file_info_packet(file_name, size=file_size, resume=(1 if resume else None), checksum=(1 if checksum else None), compress=(f"{compress}:{level}" if compress else None), fec=fec, manifest=(1 if is_directory else None), delta=(1 if delta else None))
     client_socket.sendto(file_name_binary, (server_ip, server_port))
     print(f"Client: Sent file name '{file_name}' to the server\n")
 
-    # Read the file in binary mode
-    with open(file_path, 'rb') as file:
-        file_data = file.read()
+    # The digest always covers the whole file (also when resuming) and is computed in the background.
+    mss = MSS - CHECKSUM_SIZE if checksum else MSS
+    digest = None
+    if checksum:
+        digest = DigestWorker()
+        if not streamed:
+            digest.update_file(file_path)
 
-    valid_reliable_methods = ["stop_and_wait", "gbn", "sr"]
+    # When resuming, the server answers with the chunk ranges it does not have yet.
+    missing = None
+    if resume:
+        missing = request_ranges(client_socket, file_name_binary, (server_ip, server_port), isn, rtt)
+        if missing is None:
+            print("Client: Error: no resume information received from the server")
+            return
+        missing_chunks = sum(end - start for start, end in missing)
+        print(f"Client: Server is missing {missing_chunks} chunk(s) in {len(missing)} range(s)")
 
-    if reliable_method == "stop_and_wait":
-        stop_and_wait(client_socket, False, file_data, server_ip, server_port, test_case=("lose" if test_case == "lose" else "double" if test_case == "double" else None)) 
+    # In delta mode the server first sends the block signatures of its copy of the file.
+    encoder = None
+    if delta:
+        try:
+            with timer.phase("signatures"):
+                encoder = DeltaEncoder(receive_signatures(client_socket, reliable_method, isn, wscale, rtt))
+        except ValueError as error:
+            print(f"Client: Error: {error}")
+            return
+        print(f"Client: Received {len(encoder.table)} block signature(s) of the server's copy ({encoder.block_size} byte blocks)")
 
-    elif reliable_method == "gbn":
-        gbn(client_socket, False, file_data=file_data, server_ip=server_ip, server_port=server_port, test_case=("lose" if test_case == "lose" else "double" if test_case == "double" else None))
+    # The data is read in blocks while it is being sent (only the missing chunks when resuming),
+    # so neither a large file nor an endless pipe has to fit in memory.
+    # The files of a directory are opened and read in a thread of their own, ahead of the sender.
+    file = None
+    pipeline = None
+    if workers:
+        # Worker processes build the packets of the file (with their CRC32 trailers, unless FEC still
+        # has to see the packets without them), the sender thread only sends them.
+        pipeline = PacketPipeline(file_path, isn, mss, workers, seal=checksum and not fec)
+        print(f"Client: Building the packets in {workers} worker process(es)")
+    elif is_directory:
+        blocks = read_ahead(manifest_blocks(file_path))
+    elif encoder is not None:
+        # Only the data the server does not have goes out, the rest as references to its blocks.
+        blocks = timed_blocks(file_delta(file_path, encoder), timer, "delta encode")
+    else:
+        file = sys.stdin.buffer if from_stdin else open(file_path, 'rb')
+        if missing is None:
+            blocks = read_blocks(file)
+        else:
+            blocks = read_ranges(file, missing, mss)
+        blocks = timed_blocks(blocks, timer)
+    if streamed and digest is not None:
+        blocks = tap_blocks(blocks, digest)
 
-    elif reliable_method == "sr":
-        sr(client_socket, False, file_data=file_data, server_ip=server_ip, server_port=server_port, test_case=("lose" if test_case == "lose" else "double" if test_case == "double" else None))
-    
-    
+    # Compress the blocks in a thread pool ahead of the sender, incompressible blocks are sent raw.
+    if compress:
+        blocks = compress_blocks(blocks, compress, level)
+        print(f"Client: Compressing the data with {compress} level {level} while sending")
 
+    file_data = pipeline if pipeline is not None else ChunkSource(blocks, mss)
+
+    trace = TraceRecorder(trace_file) if trace_file else None
+    # Live counters of the session on the metrics endpoint.
+    metrics = None
+    if metrics_server is not None:
+        metrics = TransferMetrics("client", (server_ip, server_port), reliable_method, rtt, mss)
+        metrics_server.add(metrics)
+    client_socket, checksum_socket = session_layers(client_socket, loss, checksum, fec, trace, timer, metrics)
+    timer.switch("transfer")
+
+    # The protocols give up with a ConnectionError when the server stops answering.
+    try:
+        if missing == []:
+            print("Client: Nothing to send, the server already has the whole file")
+
+        elif reliable_method == "stop_and_wait":
+            stop_and_wait(client_socket, False, file_data, server_ip, server_port, test_case=("lose" if test_case == "lose" else "double" if test_case == "double" else None), mss=mss, isn=isn, rtt=rtt, metrics=metrics)
+
+        elif reliable_method == "gbn":
+            gbn(client_socket, False, file_data=file_data, server_ip=server_ip, server_port=server_port, N=window, test_case=("lose" if test_case == "lose" else "double" if test_case == "double" else None), mss=mss, isn=isn, wscale=wscale, rtt=rtt, metrics=metrics)
+
+        elif reliable_method == "sr":
+            sr(client_socket, False, file_data=file_data, server_ip=server_ip, server_port=server_port, N=window, test_case=("lose" if test_case == "lose" else "double" if test_case == "double" else None), mss=mss, isn=isn, wscale=wscale, rtt=rtt, metrics=metrics)
+
+        elif reliable_method == "auto":
+            auto(client_socket, False, file_data=file_data, server_ip=server_ip, server_port=server_port, N=window, test_case=("lose" if test_case == "lose" else "double" if test_case == "double" else None), mss=mss, isn=isn, wscale=wscale, rtt=rtt, metrics=metrics)
+    except ConnectionError as error:
+        print(f"Client: Error: {error}")
+        return
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+        if metrics is not None:
+            metrics.finish()
+
+    if file is not None and not from_stdin:
+        file.close()
 
     # Call the fin_handshake method after sending the file data
-    fin_handshake(None, client_socket, False, server_ip, server_port)
+    timer.switch("teardown")
+    fin_handshake(None, client_socket, False, server_ip, server_port, digest=(digest.digest() if digest is not None else b''), rtt=rtt)
+    if encoder is not None:
+        print(f"Client: Delta sent {encoder.literal_bytes} literal bytes, {encoder.copied_blocks} block(s) of {encoder.size} bytes were already on the server")
+    if checksum_socket is not None and checksum_socket.dropped:
+        print(f"Client: {checksum_socket.dropped} corrupted ACK(s) were dropped")
+    if fec:
+        retransmitted = client_socket.retransmissions / max(client_socket.new_packets, 1)
+        print(f"Client: FEC sent {client_socket.parity_sent} parity packet(s), {retransmitted:.1%} of the packets were retransmitted")
+    if trace is not None:
+        print(f"Client: Wrote {trace.close()} trace record(s) to '{trace_file}'")
+    timer.switch(None)
+    timer.report("Client", file_size if file_size is not None else file_data.sent_bytes)
     print(f"Client: Connection with server at {server_ip}:{server_port} has been closed\n")
 
+# The ranges reply of a resume is a single datagram, the client repeats its file info until a reply
+# arrives (backed off like the data packets, up to MAX_RETRIES times) and skips anything else that comes
+# in meanwhile, e.g. a repeated SYN-ACK. Returns the missing ranges, or None if the server never answered.
+def request_ranges(sock, file_info, server_address, isn, rtt):
+    saved_timeout = sock.gettimeout()
+    try:
+        for retry in range(MAX_RETRIES + 1):
+            if retry:
+                sock.sendto(file_info, server_address)
+            deadline = time.monotonic() + rtt.timeout(retry)
+            while True:
+                try:
+                    data, _ = receive_before(sock, deadline)
+                except TimeoutError:
+                    break
+                missing = parse_ranges(data, isn)
+                if missing is not None:
+                    return missing
+        return None
+    finally:
+        sock.settimeout(saved_timeout)
+
+# The server answers every repeat of the file info with the ranges again, until the first packet of
+# something else (the data) shows that the client has them.
+def send_ranges(sock, reply, file_info, client_address):
+    sock.sendto(reply, client_address)
+    timeouts = 0
+    while timeouts < MAX_RETRIES:
+        try:
+            data, _ = sock.recvfrom(2048, socket.MSG_PEEK)
+        except TimeoutError:
+            timeouts += 1
+            continue
+        if data != file_info:
+            return
+        sock.recvfrom(2048)
+        sock.sendto(reply, client_address)
+
+# The signatures of a delta transfer go from the server to the client, so the two swap roles for
+# a moment: the server sends them with the reliable method of the session and closes the stream with a
+# FIN handshake of its own (so a retransmission of the last packet is answered before the data starts).
+def send_signatures(sock, signatures, reliable_method, client_address, isn, wscale, rtt):
+    if reliable_method == "stop_and_wait":
+        stop_and_wait(sock, False, signatures, client_address[0], client_address[1], isn=isn, rtt=rtt)
+    else:
+        protocol = {"gbn": gbn, "sr": sr, "auto": auto}[reliable_method]
+        protocol(sock, False, file_data=signatures, server_ip=client_address[0], server_port=client_address[1], N=SIGNATURE_WINDOW, isn=isn, wscale=wscale, rtt=rtt)
+    fin_handshake(None, sock, False, client_address[0], client_address[1], rtt=rtt)
+
+def receive_signatures(sock, reliable_method, isn, wscale, rtt):
+    signatures = io.BytesIO()
+    receiver = STRATEGIES[reliable_method]()
+    receive_transfer(receiver, sock, sink=signatures, isn=isn, wscale=wscale)
+    fin_handshake(sock, None, True, method=reliable_method, rtt=rtt, last_seq=receiver.last_seq)
+    return signatures.getvalue()
+
+# Reads a file (or pipe) block by block until it is exhausted.
+def read_blocks(file, block_size=BLOCK_SIZE):
+    read = getattr(file, 'read1', file.read)
+    while True:
+        block = read(block_size)
+        if not block:
+            return
+        yield block
+
+# Reads only the given (start, end) chunk ranges of a file.
+def read_ranges(file, ranges, chunk_size):
+    for start, end in ranges:
+        file.seek(start * chunk_size)
+        remaining = (end - start) * chunk_size
+        while remaining > 0:
+            block = file.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
 def main():
     # Set up argument parsing
     parser = argparse.ArgumentParser(description="Python UDP client-server application")
@@ -87,13 +474,32 @@ def main():
     group.add_argument("-c", "--client", action="store_true", help="Run as client")
     parser.add_argument("-i", "--ip", type=str, required=True, help="Server IP address")
     parser.add_argument("-p", "--port", type=int, required=True, help="Server port number")
-    parser.add_argument("-f", "--file", type=str, help="File to transfer (required for client)")
-    parser.add_argument("-r", "--reliable", type=str, required=True, help="Reliable method")
+    parser.add_argument("-f", "--file", type=str, help="File or directory to transfer (required for client), '-' streams stdin")
+    parser.add_argument("-n", "--name", type=str, default="stdin", help="Client: name to send for a stream read from stdin")
+    parser.add_argument("-o", "--stdout", action="store_true", help="Server: write the received data to stdout instead of a file")
+    parser.add_argument("-r", "--reliable", type=str, required=True, help="Reliable method: stop_and_wait, gbn, sr or auto (switches between them while it runs)")
     parser.add_argument("-t", "--test", type=str, help="Test case (optional)")
+    parser.add_argument("-w", "--window", type=int, default=5, help="Client: window size in packets for gbn, sr and auto (default 5), capped by the server's advertised window")
+    parser.add_argument("--resume", action="store_true", help="Client: only send the chunks an interrupted earlier transfer did not deliver")
+    parser.add_argument("--delta", action="store_true", help="Client: only send what changed since the copy the server already has (rsync-style)")
+    parser.add_argument("--workers", type=int, default=0, help="Client: build the packets in this many worker processes, the sender thread only sends them (gbn/sr/auto, plain files)")
+    parser.add_argument("-k", "--checksum", action="store_true", help="Client: CRC32 on every packet and an end-to-end digest checked at FIN")
+    parser.add_argument("-z", "--compress", type=str, choices=list(CODECS), help="Client: compress the file stream (zlib or lzma)")
+    parser.add_argument("-l", "--level", type=int, default=6, help="Client: compression level (default 6)")
+    parser.add_argument("--fec", type=str, help="Client: add k XOR parity packets per n data packets, as n:k or n:auto (e.g. 4:1)")
+    parser.add_argument("--loss", type=float, default=0.0, help="Drop this share of the datagrams sent after the handshake (loss emulator, e.g. 0.05)")
+    parser.add_argument("--trace", type=str, help="Record every packet event to this binary trace file (see trace_analysis.py)")
+    parser.add_argument("--profile", type=str, choices=PROFILERS, help="Profile the run: cprofile (all threads), sample (stack sampling) or tracemalloc (allocations)")
+    parser.add_argument("--profile-output", type=str, help="File for the profile (default: server.prof, client.folded, ... by role and profiler)")
+    parser.add_argument("-d", "--direct", action="store_true", help="Server: write payloads directly to their offset in the output file (gbn/sr/auto)")
+    parser.add_argument("--sessions", type=int, help="Server: serve up to this many clients at a time (fair scheduling between them) until interrupted")
+    parser.add_argument("--priority", type=str, action="append", help="Server with --sessions: weight of a client host, as HOST=WEIGHT ('*' for any other host, default 1)")
+    parser.add_argument("--metrics", type=str, help="Serve live per-session counters (Prometheus text format) on PORT, HOST:PORT or unix:PATH")
+    parser.add_argument("--rate-limit", type=str, action="append", help="Server with --sessions: rate limit of a client host in Mbps, as HOST=MBPS ('*' for any other host)")
 
     args = parser.parse_args()
 
-    valid_reliable_methods = ["stop_and_wait", "gbn", "sr"]
+    valid_reliable_methods = ["stop_and_wait", "gbn", "sr", "auto"]
     if args.reliable not in valid_reliable_methods:
         print(f"Error: Invalid reliable method. Use one of {valid_reliable_methods}.")
         return
@@ -110,19 +516,115 @@ def main():
         print("Error: 'skip_ack' test case can only be used with -s (server).")
         return
     
+    if args.direct and not args.server:
+        print("Error: --direct can only be used with -s (server).")
+        return
+    elif args.resume and not args.client:
+        print("Error: --resume can only be used with -c (client).")
+        return
+    elif args.checksum and not args.client:
+        print("Error: --checksum can only be used with -c (client), the server follows the client.")
+        return
+    elif args.compress and not args.client:
+        print("Error: --compress can only be used with -c (client), the server follows the client.")
+        return
+    elif args.stdout and not args.server:
+        print("Error: --stdout can only be used with -s (server).")
+        return
+    elif args.resume and (args.file == "-" or (args.file and os.path.isdir(args.file))):
+        print("Error: --resume needs a file, not a stream from stdin or a directory.")
+        return
+    elif args.compress and args.resume:
+        print("Error: --compress can not be combined with --resume.")
+        return
+    elif args.delta and not args.client:
+        print("Error: --delta can only be used with -c (client), the server follows the client.")
+        return
+    elif args.delta and (args.file == "-" or (args.file and os.path.isdir(args.file))):
+        print("Error: --delta needs a file, not a stream from stdin or a directory.")
+        return
+    elif args.delta and args.resume:
+        print("Error: --delta can not be combined with --resume.")
+        return
+    elif args.window < 1:
+        print("Error: --window must be at least 1.")
+        return
+    elif args.fec and not args.client:
+        print("Error: --fec can only be used with -c (client), the server follows the client.")
+        return
+    elif args.direct and args.reliable == "stop_and_wait":
+        print("Error: --direct is only supported with the gbn, sr and auto methods.")
+        return
+    elif args.workers and not args.client:
+        print("Error: --workers can only be used with -c (client).")
+        return
+    elif args.workers < 0:
+        print("Error: --workers can not be negative.")
+        return
+    elif args.workers and args.reliable == "stop_and_wait":
+        print("Error: --workers is only supported with the gbn, sr and auto methods.")
+        return
+    elif args.workers and (args.file == "-" or (args.file and os.path.isdir(args.file)) or args.compress or args.delta or args.resume):
+        print("Error: --workers needs a plain file, not a stream, a directory, --compress, --delta or --resume.")
+        return
+    elif args.sessions is not None and not args.server:
+        print("Error: --sessions can only be used with -s (server).")
+        return
+    elif args.sessions is not None and args.sessions < 1:
+        print("Error: --sessions must be at least 1.")
+        return
+    elif args.sessions is not None and args.stdout:
+        print("Error: --sessions can not be combined with --stdout.")
+        return
+    elif (args.priority or args.rate_limit) and args.sessions is None:
+        print("Error: --priority and --rate-limit need --sessions.")
+        return
+
+    try:
+        weights = parse_client_values(args.priority)
+        rates = parse_client_values(args.rate_limit)
+    except ValueError as error:
+        print(f"Error: {error}")
+        return
+
     if args.server and args.file:
         print("Error: File should not be specified when running as a server. Remove -f argument.")
         return
 
-    if args.server:
-        server(args.ip, args.port, args.reliable, args.test)
-    elif args.client:
-        if args.file:
-            client(args.ip, args.port, args.file, args.reliable, args.test)
+    metrics_server = None
+    if args.metrics:
+        try:
+            metrics_server = MetricsServer(args.metrics)
+        except (OSError, ValueError) as error:
+            print(f"Error: can not serve the metrics on '{args.metrics}': {error}")
+            return
+        print(f"Metrics: {metrics_server.address}", file=sys.stderr if args.stdout else sys.stdout)
+
+    profile_output = args.profile_output
+    if args.profile and not profile_output:
+        extension = {"cprofile": "prof", "sample": "folded", "tracemalloc": "tracemalloc"}[args.profile]
+        profile_output = f"{'server' if args.server else 'client'}.{extension}"
+
+    try:
+        if args.server:
+            if args.stdout:
+                # The data goes to stdout, so all the progress messages go to stderr.
+                with contextlib.redirect_stdout(sys.stderr), profiled(args.profile, profile_output):
+                    server(args.ip, args.port, args.reliable, args.test, args.direct, args.loss, True, args.trace, metrics_server=metrics_server)
+            else:
+                with profiled(args.profile, profile_output):
+                    server(args.ip, args.port, args.reliable, args.test, args.direct, args.loss, trace_file=args.trace, sessions=args.sessions, weights=weights, rates=rates, metrics_server=metrics_server)
+        elif args.client:
+            if args.file:
+                with profiled(args.profile, profile_output):
+                    client(args.ip, args.port, args.file, args.reliable, args.test, args.resume, args.checksum, args.compress, args.level, args.fec, args.loss, args.name, args.trace, args.window, args.delta, args.workers, metrics_server)
+            else:
+                print("Error: File is required when running as a client. Use -f to specify the file.")
         else:
-            print("Error: File is required when running as a client. Use -f to specify the file.")
-    else:
-        print("Error: Invalid arguments. Use -s for server or -c for client.")
+            print("Error: Invalid arguments. Use -s for server or -c for client.")
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
 
 if __name__ == "__main__":
     main()
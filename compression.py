@@ -0,0 +1,199 @@
+'''
+    #Optional streaming compression of the file data.
+    #The client cuts the file in blocks, compresses them in a thread pool (zlib and lzma release
+    #the GIL) ahead of the sender and sends the result as a stream of frames:
+    #   kind (1 byte) + length (4 bytes) + body
+    #Blocks that do not get smaller are sent raw, and after a run of incompressible blocks
+    #only every PROBE_EVERY-th block is tried again, so incompressible data costs almost no CPU.
+    #The server feeds the received stream into a Decompressor, which writes the original
+    #data to the output file as soon as a frame is complete.
+
+'''
+
+import lzma
+import queue
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from struct import pack, unpack_from, calcsize
+
+frame_format = '!BI'
+FRAME_HEADER_SIZE = calcsize(frame_format)
+
+RAW = 0
+ZLIB = 1
+LZMA = 2
+
+CODECS = {"zlib": ZLIB, "lzma": LZMA}
+
+BLOCK_SIZE = 256 * 1024
+
+# A block is only sent compressed if it saves at least 3%.
+MIN_SAVING = 0.03
+# After this many raw blocks in a row, only every PROBE_EVERY-th block is compressed to check again.
+INCOMPRESSIBLE_STREAK = 4
+PROBE_EVERY = 8
+
+
+def compress_block(block, kind, level):
+    if kind == ZLIB:
+        body = zlib.compress(block, level)
+    elif kind == LZMA:
+        body = lzma.compress(block, preset=level)
+    else:
+        body = block
+
+    # Incompressible data (already compressed, encrypted, random) is sent as it is.
+    if kind == RAW or len(body) > len(block) * (1 - MIN_SAVING):
+        kind, body = RAW, block
+    return pack(frame_format, kind, len(body)) + body
+
+
+def split_blocks(data, block_size=BLOCK_SIZE):
+    view = memoryview(data)
+    for i in range(0, len(data), block_size):
+        yield view[i:i + block_size]
+
+
+# Regroups an iterable of buffers of any size (small files of a manifest, pipe reads) into
+# blocks of block_size, small blocks compress badly and cost a frame header each.
+def rebatch(blocks, block_size=BLOCK_SIZE):
+    pending = bytearray()
+    for block in blocks:
+        pending += block
+        while len(pending) >= block_size:
+            yield bytes(pending[:block_size])
+            del pending[:block_size]
+    if pending:
+        yield bytes(pending)
+
+
+# Compresses blocks in a thread pool and yields the frames in order. At most 2 * workers blocks are
+# in flight, so memory stays bounded however long the input is.
+def compress_blocks(blocks, codec="zlib", level=6, workers=4, block_size=BLOCK_SIZE):
+    kind = CODECS[codec]
+    pending = deque()
+    streak = 0
+    submitted = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for block in rebatch(blocks, block_size):
+            # Skip the compression attempt while the data keeps turning out incompressible.
+            if streak >= INCOMPRESSIBLE_STREAK and submitted % PROBE_EVERY != 0:
+                block_kind = RAW
+            else:
+                block_kind = kind
+            pending.append(pool.submit(compress_block, block, block_kind, level))
+            submitted += 1
+
+            while len(pending) >= 2 * workers:
+                frame = pending.popleft().result()
+                streak = streak + 1 if frame[0] == RAW else 0
+                yield frame
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def compress_data(data, codec="zlib", level=6, workers=4, block_size=BLOCK_SIZE):
+    return b''.join(compress_blocks(split_blocks(data, block_size), codec, level, workers, block_size))
+
+
+class Decompressor:
+
+    def __init__(self, output, digest=None):
+        # output is anything with write() (an open file), digest an optional DigestWorker
+        # that gets the decompressed data.
+        self.output = output
+        self.digest = digest
+        self.buffer = bytearray()
+        self.decompressed = 0
+        # Frames that could not be decompressed, the caller fails the transfer if there are any.
+        self.errors = 0
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # Called from the receive loop with in-order payloads, the work happens in the worker thread.
+    def write(self, data):
+        self.queue.put(bytes(data))
+
+    def _run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            # After a broken frame the stream cannot be followed any more, the rest is dropped.
+            if self.errors:
+                continue
+            self.buffer += data
+            self._drain()
+
+    def _drain(self):
+        offset = 0
+        while len(self.buffer) - offset >= FRAME_HEADER_SIZE:
+            kind, length = unpack_from(frame_format, self.buffer, offset)
+            start = offset + FRAME_HEADER_SIZE
+            if len(self.buffer) - start < length:
+                break
+            body = bytes(self.buffer[start:start + length])
+            try:
+                if kind == ZLIB:
+                    block = zlib.decompress(body)
+                elif kind == LZMA:
+                    block = lzma.decompress(body)
+                else:
+                    block = body
+            except (zlib.error, lzma.LZMAError) as error:
+                print(f"Decompressor: Error: frame at byte {self.decompressed} of the output could not be decompressed ({error}), the rest of the stream is dropped")
+                self.errors += 1
+                offset = len(self.buffer)
+                break
+            self.output.write(block)
+            if self.digest is not None:
+                self.digest.update(block)
+            self.decompressed += len(block)
+            offset = start + length
+        del self.buffer[:offset]
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.buffer:
+            print(f"Decompressor: Error: {len(self.buffer)} trailing bytes do not form a complete frame")
+
+
+# Benchmark: python compression.py FILE [codec] [level] [bandwidth in Mbps]
+# Compares the time to send the file raw with the time to compress and send it, the compression
+# running ahead of the sender (so the slower of the two sets the pace).
+if __name__ == "__main__":
+    import sys
+
+    file_path = sys.argv[1]
+    codec = sys.argv[2] if len(sys.argv) > 2 else "zlib"
+    level = int(sys.argv[3]) if len(sys.argv) > 3 else 6
+    bandwidth = float(sys.argv[4]) if len(sys.argv) > 4 else 100.0
+
+    with open(file_path, 'rb') as file:
+        data = file.read()
+
+    for workers in (1, 2, 4, 8):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        compressed = compress_data(data, codec, level, workers)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+
+        raw_time = len(data) * 8 / (bandwidth * 1000000)
+        compressed_time = len(compressed) * 8 / (bandwidth * 1000000)
+        pipelined_time = max(wall, compressed_time)
+        speedup = raw_time / pipelined_time if pipelined_time else float('inf')
+
+        print("----------------------------------------------------------")
+        print(f"{codec} level {level}, {workers} worker(s), link {bandwidth} Mbps")
+        print(f"SIZE: {len(data)} -> {len(compressed)} bytes (ratio {len(compressed) / max(len(data), 1):.3f})")
+        print(f"COMPRESSION: {wall:.3f} s wall, {cpu:.3f} s CPU")
+        print(f"TRANSFER: raw {raw_time:.3f} s, compressed {pipelined_time:.3f} s, speedup {speedup:.2f}x")
+    print("----------------------------------------------------------")
@@ -0,0 +1,153 @@
+'''
+    #DRTPConnection: the protocol as an object, so it can be embedded in other programs.
+    #A connection wraps one UDP socket (or any socket-like object, e.g. the wrappers of emulator.py)
+    #and keeps its state in __slots__ instead of in the locals of one big function. Every send() on
+    #the client side is one complete DRTP session (handshake, file info, data, FIN) and every recv()
+    #on the server side receives one, so the same socket is reused from one transfer to the next.
+    #Data goes in as bytes (or an iterable of buffers) and comes out as bytes (or into any object
+    #with write()), no files are involved.
+    #The reliability strategy is pluggable: any object with the send() and receive() of the strategies
+    #in DRTP.py works. The built-in ones (StopAndWait, GoBackN, SelectiveRepeat and Adaptive) are the
+    #same code the command line tool runs, they keep the state of the transfer in __slots__ too and run
+    #it in the calling thread, without output unless the connection has a log function.
+    #A strategy's `method` attribute tells the server's FIN handshake how to re-ACK late data packets.
+
+'''
+
+import io
+import socket
+
+from DRTP import handshake, fin_handshake, file_info_packet, parse_file_info, ChunkSource, RTTEstimator
+from DRTP import StopAndWait, GoBackN, SelectiveRepeat, Adaptive, STRATEGIES
+from header import MSS, PACKET_SIZE
+from integrity import ChecksumSocket, DigestWorker, CHECKSUM_SIZE, tap_blocks
+from compression import compress_blocks, Decompressor
+from fec import FECSocket
+from emulator import LossySocket
+from tracing import TracingSocket
+from metrics import MetricsSocket
+from profiling import TimingSocket
+
+# Stacks the optional layers on the socket used after the handshake, from the network up:
+# the loss emulator, the CRC32 trailer, the packet trace (a TraceRecorder), the live counters
+# (a TransferMetrics), FEC ("n:k", k may be "auto" to follow the loss rate) and the timeout
+# timing of a PhaseTimer.
+def session_layers(sock, loss=0.0, checksum=False, fec=None, trace=None, timer=None, metrics=None):
+    if loss:
+        sock = LossySocket(sock, loss)
+    checksum_socket = None
+    if checksum:
+        sock = checksum_socket = ChecksumSocket(sock)
+    if trace is not None:
+        sock = TracingSocket(sock, trace)
+    if metrics is not None:
+        sock = MetricsSocket(sock, metrics)
+    if fec:
+        n, _, k = fec.partition(':')
+        adaptive = k == "auto"
+        sock = FECSocket(sock, int(n), 1 if adaptive or not k else int(k), adaptive)
+    if timer is not None:
+        sock = TimingSocket(sock, timer)
+    return sock, checksum_socket
+
+
+# Per-packet messages of a connection without a log function go nowhere.
+def _silent(*args, **kwargs):
+    pass
+
+
+class DRTPConnection:
+
+    __slots__ = ('sock', 'strategy', 'peer', 'log', 'mss', 'isn', 'wscale', 'rtt', 'name', 'options')
+
+    def __init__(self, sock, strategy="gbn", peer=None, log=None):
+        # strategy is the name of a built-in strategy or a strategy object. log (e.g. print) gets the
+        # progress messages of the handshakes and of every packet, without it the connection is silent.
+        self.sock = sock
+        self.strategy = STRATEGIES[strategy]() if isinstance(strategy, str) else strategy
+        self.peer = peer
+        self.log = log
+        self.mss = MSS
+        # Initial sequence number, window scale and RTT estimate of the current session, set by the handshake.
+        self.isn = 0
+        self.wscale = 0
+        self.rtt = RTTEstimator()
+        # Name and options of the last transfer received.
+        self.name = None
+        self.options = {}
+
+    @classmethod
+    def connect(cls, server_ip, server_port, strategy="gbn", log=None):
+        client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        return cls(client_socket, strategy, (socket.gethostbyname(server_ip), server_port), log)
+
+    @classmethod
+    def listen(cls, server_ip, server_port, strategy="gbn", log=None):
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server_socket.bind((server_ip, server_port))
+        return cls(server_socket, strategy, log=log)
+
+    # Sends data (bytes or an iterable of buffers) as one transfer and returns the number of bytes put
+    # in packets. The options are the ones of the command line client.
+    def send(self, data, name="data", checksum=False, compress=None, level=6, fec=None, loss=0.0):
+        self.rtt = RTTEstimator()
+        _, self.isn, self.wscale = handshake(None, self.sock, False, self.peer[0], self.peer[1], rtt=self.rtt, log=self.log or _silent)
+
+        in_memory = isinstance(data, (bytes, bytearray, memoryview))
+        blocks = [data] if in_memory else data
+        info = file_info_packet(name, size=(len(data) if in_memory else None), checksum=(1 if checksum else None), compress=(f"{compress}:{level}" if compress else None), fec=fec)
+        self.sock.sendto(info, self.peer)
+
+        self.mss = MSS - CHECKSUM_SIZE if checksum else MSS
+        digest = None
+        if checksum:
+            digest = DigestWorker()
+            blocks = tap_blocks(blocks, digest)
+        if compress:
+            blocks = compress_blocks(blocks, compress, level)
+        source = ChunkSource(blocks, self.mss)
+
+        session_socket, _ = session_layers(self.sock, loss, checksum, fec)
+        self.strategy.send(session_socket, self.peer, source, isn=self.isn, mss=self.mss, wscale=self.wscale, rtt=self.rtt, log=self.log)
+        fin_handshake(None, session_socket, False, self.peer[0], self.peer[1], digest=(digest.digest() if digest is not None else b''), rtt=self.rtt, log=self.log or _silent)
+        return source.sent_bytes
+
+    # Receives one transfer. Returns the data as bytes, or None when it was written to sink.
+    # Raises ConnectionError if the client sent a digest and the data does not match it, or if the
+    # compressed stream could not be decompressed.
+    def recv(self, sink=None, loss=0.0):
+        self.rtt = RTTEstimator()
+        self.peer, self.isn, self.wscale = handshake(self.sock, None, True, rtt=self.rtt, log=self.log or _silent)
+        info, _ = self.sock.recvfrom(PACKET_SIZE)
+        self.name, self.options = parse_file_info(info)
+
+        checksum = self.options.get("checksum") == "1"
+        self.mss = MSS - CHECKSUM_SIZE if checksum else MSS
+        digest = DigestWorker() if checksum else None
+
+        output = io.BytesIO() if sink is None else sink
+        target = output
+        decompressor = None
+        if self.options.get("compress"):
+            target = decompressor = Decompressor(output, digest)
+
+        session_socket, _ = session_layers(self.sock, loss, checksum, self.options.get("fec"))
+        self.strategy.receive(session_socket, target, digest if decompressor is None else None, isn=self.isn, mss=self.mss, wscale=self.wscale, log=self.log)
+        client_digest = fin_handshake(session_socket, None, True, method=getattr(self.strategy, 'method', None), rtt=self.rtt, last_seq=getattr(self.strategy, 'last_seq', None), log=self.log or _silent)
+
+        if decompressor is not None:
+            decompressor.close()
+            if decompressor.errors:
+                raise ConnectionError(f"the compressed stream of '{self.name}' could not be decompressed")
+        if digest is not None and digest.digest() != client_digest:
+            raise ConnectionError(f"integrity check failed for '{self.name}'")
+        return output.getvalue() if sink is None else None
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,309 @@
+'''
+    #Delta transfers (the rsync algorithm) for a file the server already has an older copy of.
+    #1) The server cuts its copy (the basis) in blocks and sends a signature per block: a weak rolling
+    #   checksum and a strong hash (BLAKE2b, 16 bytes). Signature stream:
+    #       magic (4 bytes) + block size (4 bytes) + block count (4 bytes) + count * (weak (4) + strong (16))
+    #2) The client slides a window of one block over its file. The weak checksum of the window is updated
+    #   in O(1) per byte, and only when it matches a signature is the strong hash computed. Matches become
+    #   block references, everything in between is sent as literal data:
+    #       b'C' + first block (4 bytes) + number of blocks (4 bytes)     copy blocks of the basis
+    #       b'L' + length (4 bytes) + data                                literal data
+    #   After a match the window jumps a whole block ahead, so a file that changed only in a few places
+    #   costs one checksum per block plus at most a block of rolling per change.
+    #3) The server feeds the received stream into a DeltaApplier, which rebuilds the file from the
+    #   basis and the literals in a worker thread (like the Decompressor).
+
+'''
+
+import hashlib
+import itertools
+import math
+import mmap
+import os
+import queue
+import threading
+from struct import pack, unpack_from, calcsize
+
+MAGIC = b'DSG1'
+signature_header_format = '!4sII'
+SIGNATURE_HEADER_SIZE = calcsize(signature_header_format)
+STRONG_SIZE = 16
+signature_format = f'!I{STRONG_SIZE}s'
+SIGNATURE_SIZE = calcsize(signature_format)
+
+COPY = b'C'
+LITERAL = b'L'
+copy_format = '!cII'
+literal_format = '!cI'
+COPY_SIZE = calcsize(copy_format)
+LITERAL_HEADER_SIZE = calcsize(literal_format)
+
+# Block size about the square root of the file size (as rsync), so the signatures and the per-change
+# overhead stay small for both small and large files.
+MIN_BLOCK_SIZE = 2048
+MAX_BLOCK_SIZE = 64 * 1024
+# Literal data is cut in pieces of at most this size, so the sender never holds much of it.
+MAX_LITERAL = 64 * 1024
+# Copies are read from the basis in pieces of at most this size.
+COPY_READ_SIZE = 1 << 20
+
+MOD = 1 << 16
+
+
+def block_size_for(size):
+    block_size = math.isqrt(size) // 1024 * 1024
+    return max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, block_size))
+
+
+# Weak checksum of a block: a is the sum of the bytes, b the sum of the running sums a after every byte.
+def weak_checksum(block):
+    return sum(block) % MOD, sum(itertools.accumulate(block)) % MOD
+
+
+def strong_hash(block):
+    return hashlib.blake2b(block, digest_size=STRONG_SIZE).digest()
+
+
+# Signatures of every full block of the file at path, as a signature stream. A missing file gives no
+# signatures, so the client sends everything as literal data.
+def file_signatures(path, block_size=None):
+    size = os.path.getsize(path) if path is not None and os.path.isfile(path) else 0
+    block_size = block_size or block_size_for(size)
+    entries = []
+    if size:
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(block_size), b''):
+                if len(block) < block_size:
+                    break
+                a, b = weak_checksum(block)
+                entries.append(pack(signature_format, a | (b << 16), strong_hash(block)))
+    return pack(signature_header_format, MAGIC, block_size, len(entries)) + b''.join(entries)
+
+
+def signature_block_size(data):
+    _, block_size, _ = unpack_from(signature_header_format, data)
+    return block_size
+
+
+# Returns (block size, {weak checksum: {strong hash: block index}}) of a signature stream.
+def parse_signatures(data):
+    magic, block_size, count = unpack_from(signature_header_format, data)
+    if magic != MAGIC or len(data) < SIGNATURE_HEADER_SIZE + count * SIGNATURE_SIZE:
+        raise ValueError("not a complete signature stream")
+    table = {}
+    for index in range(count):
+        weak, strong = unpack_from(signature_format, data, SIGNATURE_HEADER_SIZE + index * SIGNATURE_SIZE)
+        # Identical blocks share a signature, the first one is as good as any.
+        table.setdefault(weak, {}).setdefault(strong, index)
+    return block_size, table
+
+
+class DeltaEncoder:
+
+    def __init__(self, signatures):
+        self.block_size, self.table = parse_signatures(signatures)
+        self.literal_bytes = 0
+        self.copied_blocks = 0
+        self.size = 0
+
+    # Yields the delta stream of data (any buffer, e.g. an mmap of the file) in pieces.
+    def ops(self, data):
+        self.size = len(data)
+        view = memoryview(data)
+        n = len(data)
+        size = self.block_size
+        table = self.table
+        literal_start = 0
+        copy_start = copy_count = 0
+
+        def literal(start, end):
+            self.literal_bytes += end - start
+            for offset in range(start, end, MAX_LITERAL):
+                piece = view[offset:min(end, offset + MAX_LITERAL)]
+                yield pack(literal_format, LITERAL, len(piece)) + piece
+
+        def copy():
+            self.copied_blocks += copy_count
+            return pack(copy_format, COPY, copy_start, copy_count)
+
+        pos = 0
+        if table and n >= size:
+            a, b = weak_checksum(view[:size])
+            while True:
+                index = None
+                candidates = table.get(a | (b << 16))
+                if candidates is not None:
+                    index = candidates.get(strong_hash(view[pos:pos + size]))
+
+                if index is not None:
+                    # A match: the literal data before it goes out first, runs of consecutive blocks
+                    # become one copy.
+                    if literal_start < pos:
+                        if copy_count:
+                            yield copy()
+                            copy_count = 0
+                        yield from literal(literal_start, pos)
+                    if copy_count and index == copy_start + copy_count:
+                        copy_count += 1
+                    else:
+                        if copy_count:
+                            yield copy()
+                        copy_start, copy_count = index, 1
+                    pos += size
+                    literal_start = pos
+                    if pos + size > n:
+                        break
+                    a, b = weak_checksum(view[pos:pos + size])
+                    continue
+
+                # No match, slide the window one byte.
+                if pos + size >= n:
+                    break
+                out, new = data[pos], data[pos + size]
+                a = (a - out + new) % MOD
+                b = (b - size * out + a) % MOD
+                pos += 1
+                # Send long stretches without a match as they come instead of holding them.
+                if pos - literal_start >= MAX_LITERAL and pos - literal_start >= size:
+                    if copy_count:
+                        yield copy()
+                        copy_count = 0
+                    yield from literal(literal_start, pos)
+                    literal_start = pos
+
+        if copy_count:
+            yield copy()
+        yield from literal(literal_start, n)
+
+
+# The delta stream of the file at path, against the signatures of the encoder.
+def file_delta(path, encoder):
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield from encoder.ops(data)
+
+
+class DeltaApplier:
+
+    def __init__(self, basis_path, output, block_size, digest=None):
+        # basis_path is the older copy (None if there is none), output anything with write() and digest an
+        # optional DigestWorker that gets the rebuilt file.
+        self.basis = open(basis_path, 'rb') if basis_path is not None and os.path.isfile(basis_path) else None
+        self.output = output
+        self.block_size = block_size
+        self.digest = digest
+        self.buffer = bytearray()
+        self.literal_bytes = 0
+        self.copied_bytes = 0
+        self.errors = 0
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # Called from the receive loop with in-order payloads, the work happens in the worker thread.
+    def write(self, data):
+        self.queue.put(bytes(data))
+
+    def _run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            self.buffer += data
+            self._drain()
+
+    def _emit(self, block):
+        self.output.write(block)
+        if self.digest is not None:
+            self.digest.update(block)
+
+    def _drain(self):
+        offset = 0
+        while len(self.buffer) - offset >= LITERAL_HEADER_SIZE:
+            kind = self.buffer[offset:offset + 1]
+            if kind == COPY:
+                if len(self.buffer) - offset < COPY_SIZE:
+                    break
+                _, first, count = unpack_from(copy_format, self.buffer, offset)
+                self._copy(first, count)
+                offset += COPY_SIZE
+            elif kind == LITERAL:
+                _, length = unpack_from(literal_format, self.buffer, offset)
+                start = offset + LITERAL_HEADER_SIZE
+                if len(self.buffer) - start < length:
+                    break
+                self._emit(bytes(self.buffer[start:start + length]))
+                self.literal_bytes += length
+                offset = start + length
+            else:
+                print(f"DeltaApplier: Error: unknown operation {bytes(kind)!r}, the rest of the stream is dropped")
+                self.errors += 1
+                offset = len(self.buffer)
+        del self.buffer[:offset]
+
+    def _copy(self, first, count):
+        remaining = count * self.block_size
+        if self.basis is None:
+            print(f"DeltaApplier: Error: block {first} referenced, but there is no basis file")
+            self.errors += 1
+            return
+        self.basis.seek(first * self.block_size)
+        while remaining > 0:
+            block = self.basis.read(min(COPY_READ_SIZE, remaining))
+            if not block:
+                print(f"DeltaApplier: Error: block {first} + {count} is past the end of the basis file")
+                self.errors += 1
+                return
+            self._emit(block)
+            self.copied_bytes += len(block)
+            remaining -= len(block)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.basis is not None:
+            self.basis.close()
+        if self.buffer:
+            print(f"DeltaApplier: Error: {len(self.buffer)} trailing bytes do not form a complete operation")
+
+
+# Benchmark: python delta.py OLD NEW [bandwidth in Mbps]
+# Computes the signatures of OLD and the delta of NEW, rebuilds NEW from OLD and the delta and compares
+# the bytes and the time to send with sending NEW whole.
+if __name__ == "__main__":
+    import io
+    import sys
+    import time
+
+    old_path, new_path = sys.argv[1], sys.argv[2]
+    bandwidth = float(sys.argv[3]) if len(sys.argv) > 3 else 100.0
+
+    start = time.perf_counter()
+    signatures = file_signatures(old_path)
+    signature_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    encoder = DeltaEncoder(signatures)
+    delta = b''.join(file_delta(new_path, encoder))
+    delta_time = time.perf_counter() - start
+
+    rebuilt = io.BytesIO()
+    applier = DeltaApplier(old_path, rebuilt, encoder.block_size)
+    applier.write(delta)
+    applier.close()
+    with open(new_path, 'rb') as file:
+        same = rebuilt.getvalue() == file.read()
+
+    new_size = os.path.getsize(new_path)
+    full_time = new_size * 8 / (bandwidth * 1000000)
+    delta_bytes = len(signatures) + len(delta)
+    delta_transfer = delta_bytes * 8 / (bandwidth * 1000000)
+    print("----------------------------------------------------------")
+    print(f"BLOCK SIZE: {encoder.block_size} bytes, {encoder.copied_blocks} block(s) copied, {encoder.literal_bytes} literal bytes")
+    print(f"SIGNATURES: {len(signatures)} bytes in {signature_time:.3f} s, DELTA: {len(delta)} bytes in {delta_time:.3f} s")
+    print(f"ON THE WIRE: {delta_bytes} instead of {new_size} bytes ({delta_bytes / max(new_size, 1):.1%})")
+    print(f"TRANSFER at {bandwidth} Mbps: whole file {full_time:.3f} s, delta {delta_transfer + signature_time + delta_time:.3f} s (incl. checksums)")
+    print(f"REBUILT: {'SAME' if same else 'DIFFERENT'}")
+    print("----------------------------------------------------------")
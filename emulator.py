@@ -0,0 +1,30 @@
+'''
+    #Local loss emulator: wraps a socket and drops a share of the datagrams it sends,
+    #so loss recovery (retransmissions, FEC) can be tried on a single machine.
+    #A seed makes the pattern of dropped packets repeatable.
+
+'''
+
+import random
+
+
+class LossySocket:
+
+    def __init__(self, sock, loss=0.0, seed=None):
+        self.sock = sock
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.sent = 0
+        self.dropped = 0
+
+    def sendto(self, data, address):
+        self.sent += 1
+        if self.random.random() < self.loss:
+            # Pretend the datagram went out, the network "lost" it.
+            self.dropped += 1
+            return len(data)
+        return self.sock.sendto(data, address)
+
+    # Everything else (recvfrom, settimeout, close, ...) goes straight to the real socket.
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
@@ -0,0 +1,274 @@
+'''
+    #Forward error correction for gbn/sr data packets.
+    #The sender cuts the data packets into blocks of n packets and adds k XOR parity packets per block,
+    #parity j covering the packets at positions j, j+k, j+2k, ... of the block. The receiver can rebuild
+    #one lost packet per parity group without waiting for a retransmission timeout. The rebuilt packet
+    #is handed to the protocol as if it had arrived, so it gets ACKed like any other packet.
+    #
+    #Parity packet header:  seq = first seq of the block,  flags = PARITY (+ FIN if the block ends the file),
+    #                       ack = count << 16 | k << 8 | j,  win = XOR of the payload lengths in the group
+    #payload = XOR of the payloads in the group (zero padded to the longest one)
+    #
+    #With adaptive=True, k is picked per block from the loss rate the sender observes (share of retransmissions).
+    #A block that does not fill up within flush_after seconds (small window, end of file) is closed early,
+    #so its parity is not held back. The thread that does this runs until the block with the last packet
+    #(FIN) has its parity or the socket is closed.
+
+'''
+
+import math
+import threading
+import time
+from collections import deque
+
+from header import create_packet, parse_header, HEADER_SIZE, seq_add, seq_diff, seq_le
+
+PARITY_FLAG = (1 << 4)
+FIN_FLAG = (1 << 1)
+
+# How many recent data packets the receiver keeps to rebuild a missing one.
+CACHE_SIZE = 4096
+
+
+def xor_payloads(payloads):
+    length = max(len(payload) for payload in payloads)
+    value = 0
+    for payload in payloads:
+        value ^= int.from_bytes(bytes(payload).ljust(length, b'\0'), 'big')
+    return value.to_bytes(length, 'big')
+
+
+class FECSocket:
+
+    def __init__(self, sock, n=4, k=1, adaptive=False, flush_after=0.02):
+        self.sock = sock
+        self.n = min(n, 255)
+        self.k = max(1, min(k, self.n))
+        self.adaptive = adaptive
+        self.max_k = max(self.k, self.n // 2)
+        self.flush_after = flush_after
+        self.lock = threading.Lock()
+
+        # Sender side
+        self.highest_sent = None
+        self.block = []
+        self.block_k = self.k
+        self.block_started = 0.0
+        self.address = None
+        self.new_packets = 0
+        self.retransmissions = 0
+        self.last_new = 0
+        self.last_retransmissions = 0
+        self.loss_rate = 0.0
+        self.parity_sent = 0
+        self.flusher = None
+        # Whether the last block sent ended the transfer (FIN), and set by close().
+        self.finished = False
+        self.closed = threading.Event()
+
+        # Receiver side
+        self.cache = {}
+        self.cache_order = deque()
+        self.parities = deque(maxlen=64)
+        self.pending = deque()
+        self.recovered = 0
+
+    # ---------- sender ----------
+
+    def sendto(self, data, address):
+        result = self.sock.sendto(data, address)
+        if len(data) <= HEADER_SIZE:
+            return result
+        seq, _, flags, _ = parse_header(data[:HEADER_SIZE])
+        # Only data packets (no flags other than FIN) are protected.
+        if flags & ~FIN_FLAG:
+            return result
+
+        with self.lock:
+            self.address = address
+            if self.highest_sent is not None and seq_le(seq, self.highest_sent):
+                # Sent before: a retransmission, which is what the loss estimate is based on.
+                self.retransmissions += 1
+                return result
+            self.highest_sent = seq
+            self.new_packets += 1
+
+            if not self.block:
+                self.block_started = time.monotonic()
+                self.block_k = self._choose_k()
+            self.block.append((seq, flags, data[HEADER_SIZE:]))
+            self.finished = bool(flags & FIN_FLAG)
+
+            if len(self.block) >= self.n or flags & FIN_FLAG:
+                self._send_parity()
+            elif self.flusher is None:
+                self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+                self.flusher.start()
+        return result
+
+    def _choose_k(self):
+        if not self.adaptive:
+            return self.k
+        new = self.new_packets - self.last_new
+        if new >= self.n:
+            recent = (self.retransmissions - self.last_retransmissions) / new
+            self.loss_rate = 0.8 * self.loss_rate + 0.2 * recent
+            self.last_new = self.new_packets
+            self.last_retransmissions = self.retransmissions
+        # Enough parity for about twice the expected losses in a block.
+        return max(1, min(self.max_k, math.ceil(self.loss_rate * self.n * 2)))
+
+    # Must be called with the lock held.
+    def _send_parity(self):
+        first_seq = self.block[0][0]
+        count = len(self.block)
+        k = min(self.block_k, count)
+        fin = FIN_FLAG if self.block[-1][1] & FIN_FLAG else 0
+
+        for j in range(k):
+            group = self.block[j::k]
+            length_xor = 0
+            for _, _, payload in group:
+                length_xor ^= len(payload)
+            parity = xor_payloads([payload for _, _, payload in group])
+            packet = create_packet(first_seq, (count << 16) | (k << 8) | j, PARITY_FLAG | fin, length_xor, parity)
+            self.sock.sendto(packet, self.address)
+            self.parity_sent += 1
+        self.block = []
+
+    def _flush_loop(self):
+        while not self.closed.wait(self.flush_after / 2):
+            with self.lock:
+                if self.block and time.monotonic() - self.block_started >= self.flush_after:
+                    self._send_parity()
+                # The transfer is over, a later one starts a new thread.
+                if self.finished:
+                    self.flusher = None
+                    return
+
+    def close(self):
+        self.closed.set()
+        self.sock.close()
+
+    # ---------- receiver ----------
+
+    def recvfrom(self, bufsize):
+        while True:
+            if self.pending:
+                return self.pending.popleft()
+
+            data, address = self.sock.recvfrom(bufsize)
+            if len(data) < HEADER_SIZE:
+                return data, address
+            seq, ack, flags, win = parse_header(data[:HEADER_SIZE])
+
+            if flags & PARITY_FLAG:
+                # Parity packets never reach the protocol, they can only produce rebuilt packets.
+                self.parities.append((seq, ack, flags, win, data[HEADER_SIZE:], address))
+                self._recover(self.parities[-1])
+                continue
+
+            if len(data) > HEADER_SIZE and not flags & ~FIN_FLAG and seq not in self.cache:
+                self._remember(seq, flags, data[HEADER_SIZE:])
+                # A packet that arrives late may leave a stored parity with a single hole.
+                for parity in list(self.parities):
+                    first_seq, info = parity[0], parity[1]
+                    if 0 <= seq_diff(seq, first_seq) < info >> 16:
+                        self._recover(parity)
+            return data, address
+
+    # The receiver keeps copies of the packets anyway (to rebuild lost ones), so this simply copies
+    # the next packet into the caller's buffer.
+    def recvfrom_into(self, buffer, nbytes=0):
+        data, address = self.recvfrom(nbytes or len(buffer))
+        buffer[:len(data)] = data
+        return len(data), address
+
+    def _remember(self, seq, flags, payload):
+        self.cache[seq] = (flags, payload)
+        self.cache_order.append(seq)
+        if len(self.cache_order) > CACHE_SIZE:
+            self.cache.pop(self.cache_order.popleft(), None)
+
+    def _recover(self, parity):
+        first_seq, info, flags, length_xor, parity_payload, address = parity
+        count, k, j = info >> 16, (info >> 8) & 0xFF, info & 0xFF
+        members = [seq_add(first_seq, i) for i in range(j, count, k)]
+        missing = [seq for seq in members if seq not in self.cache]
+
+        if len(missing) != 1:
+            if not missing and parity in self.parities:
+                # Nothing to rebuild in this group any more.
+                self.parities.remove(parity)
+            return
+
+        seq = missing[0]
+        others = [self.cache[member][1] for member in members if member != seq]
+        payload = xor_payloads(others + [parity_payload])
+        length = length_xor
+        for other in others:
+            length ^= len(other)
+        payload = payload[:length]
+
+        # Only the last packet of the last block carries the FIN flag.
+        packet_flags = FIN_FLAG if flags & FIN_FLAG and seq == seq_add(first_seq, count - 1) else 0
+        self._remember(seq, packet_flags, payload)
+        self.recovered += 1
+        if parity in self.parities:
+            self.parities.remove(parity)
+
+        # Deliver the rebuilt packet, followed by the rest of its block again: a go-back-n receiver
+        # has dropped those while it was waiting for the missing one.
+        self.pending.append((create_packet(seq, 0, packet_flags, 0, payload), address))
+        for i in range(seq_diff(seq, first_seq) + 1, count):
+            later = seq_add(first_seq, i)
+            if later in self.cache:
+                later_flags, later_payload = self.cache[later]
+                self.pending.append((create_packet(later, 0, later_flags, 0, later_payload), address))
+
+    # Everything else (settimeout, close, getsockname, ...) goes straight to the real socket.
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+# Demo with the local loss emulator: sends numbered packets over loopback with loss,
+# once without and once with FEC, and counts how many arrive (or are rebuilt) without any retransmission.
+# python fec.py [loss] [n] [k]
+if __name__ == "__main__":
+    import socket
+    import sys
+    from emulator import LossySocket
+
+    loss = float(sys.argv[1]) if len(sys.argv) > 1 else 0.05
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    k = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    packets = 2000
+
+    for use_fec in (False, True):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(('127.0.0.1', 0))
+        receiver.settimeout(0.2)
+        receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 << 20)
+        sender = LossySocket(socket.socket(socket.AF_INET, socket.SOCK_DGRAM), loss, seed=1)
+        if use_fec:
+            sender = FECSocket(sender, n, k)
+            receiver = FECSocket(receiver, n, k)
+
+        for seq in range(1, packets + 1):
+            flags = FIN_FLAG if seq == packets else 0
+            sender.sendto(create_packet(seq, 0, flags, 0, seq.to_bytes(4, 'big') * 365), receiver.getsockname())
+
+        delivered = set()
+        try:
+            while True:
+                data, _ = receiver.recvfrom(1472)
+                seq, _, _, _ = parse_header(data[:HEADER_SIZE])
+                assert data[HEADER_SIZE:] == seq.to_bytes(4, 'big') * 365
+                delivered.add(seq)
+        except TimeoutError:
+            pass
+
+        overhead = (sender.parity_sent / packets) if use_fec else 0.0
+        print(f"{'FEC n=%d k=%d' % (n, k) if use_fec else 'no FEC':>12}: loss {loss:.0%}, "
+              f"{packets - len(delivered)} of {packets} packets still need a retransmission "
+              f"(overhead {overhead:.1%}{', rebuilt %d' % receiver.recovered if use_fec else ''})")
@@ -7,6 +7,7 @@
 
 from struct import *
 import struct
+import secrets
 
 
 # I integer (unsigned long) = 4bytes and H (unsigned short integer 2 bytes)
@@ -16,6 +17,11 @@ header_format = '!IIHH'
 
 #print the header size: total = 12
 
+# 12 bytes of header + 1460 bytes of application data = 1472 bytes per datagram
+HEADER_SIZE = calcsize(header_format)
+MSS = 1460
+PACKET_SIZE = HEADER_SIZE + MSS
+
 
 
 def create_packet(seq, ack, flags, win, data):
@@ -41,6 +47,62 @@ def parse_header(header):
     #parse_flags(flags)
     return header_from_msg
 
+def parse_header_from(buffer, offset=0):
+    #same as parse_header, but reads the header in place from a larger buffer
+    #(a receive buffer or a memoryview), so no slice of the packet is copied
+    return unpack_from(header_format, buffer, offset)
+
+#Sequence numbers are 32 bits on the wire and wrap around. The protocols count packets with plain
+#(unbounded) integers from the initial sequence number (ISN) picked in the handshake, so packet n goes
+#out with seq (isn + n) mod 2**32. Wire numbers are only compared with serial number arithmetic
+#(RFC 1982): a is "before" b if b is less than half the number space ahead of a.
+SEQ_BITS = 32
+SEQ_MODULUS = 1 << SEQ_BITS
+SEQ_MASK = SEQ_MODULUS - 1
+SEQ_HALF = 1 << (SEQ_BITS - 1)
+
+def seq_add(seq, n):
+    return (seq + n) & SEQ_MASK
+
+def seq_diff(a, b):
+    #signed distance from b to a, in (-2**31, 2**31]
+    diff = (a - b) & SEQ_MASK
+    return diff - SEQ_MODULUS if diff > SEQ_HALF else diff
+
+def seq_lt(a, b):
+    return seq_diff(a, b) < 0
+
+def seq_le(a, b):
+    return seq_diff(a, b) <= 0
+
+def unwrap_seq(seq, reference, isn=0):
+    #the packet number (counted from isn) of the wire number seq that is closest to the packet
+    #number reference, e.g. the next packet a receiver expects or the base of a sender's window
+    return reference + seq_diff(seq, seq_add(isn, reference))
+
+def random_isn():
+    return secrets.randbits(SEQ_BITS)
+
+#The 16 bit window field holds the receiver's window in bytes, shifted right by the window scale
+#the receiver announced in the handshake (one byte of payload in the SYN and the SYN-ACK, as in TCP).
+#A peer that sends no scale gets unscaled windows, and a window field of 0 means "not advertised".
+MAX_WINDOW_SHIFT = 14
+# Receive window the servers advertise: 64 MiB, about 46000 full packets in flight.
+RECEIVE_WINDOW = 1 << 26
+
+def window_shift(window):
+    #smallest shift that makes the window fit in 16 bits
+    shift = 0
+    while window >> shift > 0xFFFF and shift < MAX_WINDOW_SHIFT:
+        shift += 1
+    return shift
+
+def encode_window(window, shift):
+    return min(window >> shift, 0xFFFF)
+
+def decode_window(win, shift):
+    return win << shift
+
 """def parse_header(data):
     if len(data) < 12:
         raise ValueError("Data is too short to parse the header.")
@@ -0,0 +1,133 @@
+'''
+    #Integrity checks for a transfer:
+    #1) ChecksumSocket adds a CRC32 trailer to every datagram it sends and silently drops received
+    #   datagrams whose CRC does not match (they are counted in dropped, reported at the end of the
+    #   transfer). A dropped packet looks exactly like a lost one, so the normal retransmission of
+    #   stop_and_wait/gbn/sr repairs it. A SealedDatagram already ends
+    #   in its trailer (the worker processes of pipeline.py compute it) and is sent as it is.
+    #2) DigestWorker computes an end-to-end digest of the data in a worker thread, so hashing
+    #   never runs on the receive loop. The client sends its digest in the FIN packet
+    #   and the server compares it with its own.
+
+'''
+
+import os
+import queue
+import hashlib
+import threading
+import zlib
+from struct import pack, unpack_from
+
+# The CRC32 trailer takes 4 bytes, so the payload shrinks to keep datagrams at 1472 bytes.
+CHECKSUM_SIZE = 4
+
+DIGEST_ALGORITHM = 'sha256'
+
+
+# A datagram that ends in its CRC32 trailer already.
+class SealedDatagram(bytes):
+    __slots__ = ()
+
+
+class ChecksumSocket:
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.dropped = 0
+
+    def sendto(self, data, address):
+        if type(data) is SealedDatagram:
+            return self.sock.sendto(data, address)
+        return self.sock.sendto(data + pack('!I', zlib.crc32(data)), address)
+
+    def recvfrom(self, bufsize):
+        while True:
+            data, address = self.sock.recvfrom(bufsize + CHECKSUM_SIZE)
+            if len(data) >= CHECKSUM_SIZE:
+                body = data[:-CHECKSUM_SIZE]
+                crc, = unpack_from('!I', data, len(data) - CHECKSUM_SIZE)
+                if zlib.crc32(body) == crc:
+                    return body, address
+            # Corrupted (or not protected at all): drop it and let the sender retransmit.
+            self.dropped += 1
+
+    # Same check on a caller's buffer, the CRC is computed on a view of it without copying the packet.
+    def recvfrom_into(self, buffer, nbytes=0):
+        view = memoryview(buffer)
+        while True:
+            received, address = self.sock.recvfrom_into(buffer, nbytes + CHECKSUM_SIZE if nbytes else 0)
+            if received >= CHECKSUM_SIZE:
+                length = received - CHECKSUM_SIZE
+                crc, = unpack_from('!I', buffer, length)
+                if zlib.crc32(view[:length]) == crc:
+                    return length, address
+            self.dropped += 1
+
+    # Everything else (settimeout, close, getsockname, ...) goes straight to the real socket.
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+class DigestWorker:
+
+    # Small updates are batched up to this size, hashlib releases the GIL for large buffers.
+    BATCH_SIZE = 1 << 20
+
+    def __init__(self, algorithm=DIGEST_ALGORITHM):
+        self.hash = hashlib.new(algorithm)
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # Data is hashed in the order it is queued, the caller must queue it in file order.
+    def update(self, data):
+        self.queue.put(data)
+
+    # Hash length bytes at offset of an open file descriptor (read by the worker, not the caller).
+    def update_range(self, fd, offset, length):
+        self.queue.put((fd, offset, length))
+
+    def update_file(self, file_path):
+        self.queue.put(file_path)
+
+    def _run(self):
+        batch = bytearray()
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if isinstance(item, str):
+                self.hash.update(batch)
+                batch = bytearray()
+                with open(item, 'rb') as file:
+                    for block in iter(lambda: file.read(self.BATCH_SIZE), b''):
+                        self.hash.update(block)
+                continue
+            if isinstance(item, tuple):
+                fd, offset, length = item
+                item = os.pread(fd, length, offset)
+            batch += item
+            # Only hash when nothing else is waiting (or the batch is big), so many
+            # small payloads become one large update.
+            if len(batch) >= self.BATCH_SIZE or self.queue.empty():
+                self.hash.update(batch)
+                batch = bytearray()
+        self.hash.update(batch)
+
+    # Waits for everything queued so far and returns the digest.
+    def digest(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        return self.hash.digest()
+
+    def hexdigest(self):
+        self.digest()
+        return self.hash.hexdigest()
+
+
+# Passes blocks through while feeding them to a digest (for data that can only be read once).
+def tap_blocks(blocks, digest):
+    for block in blocks:
+        digest.update(block)
+        yield block
@@ -0,0 +1,171 @@
+'''
+    #Multi-file transfers: a whole directory is sent as one stream in a single session,
+    #so the handshake, the file info datagram and the FIN handshake are paid once instead of per file.
+    #Every file in the stream is framed as
+    #   name length (2 bytes) + relative path (utf-8, '/' separated) + size (8 bytes) + file data
+    #and a name length of 0 ends the manifest. Because the stream is cut into packets without
+    #looking at file boundaries, many small files share the same packets.
+
+'''
+
+import os
+import queue
+import threading
+from struct import pack, unpack_from, calcsize
+
+entry_format = '!H'
+size_format = '!Q'
+NAME_LENGTH_SIZE = calcsize(entry_format)
+SIZE_SIZE = calcsize(size_format)
+
+READ_SIZE = 256 * 1024
+
+
+# Relative paths of all regular files below root, in a stable order.
+def list_files(root):
+    files = []
+    for directory, dirs, names in os.walk(root):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                files.append(os.path.relpath(path, root).replace(os.sep, '/'))
+    return files
+
+
+def manifest_blocks(root):
+    for relative_path in list_files(root):
+        path = os.path.join(root, *relative_path.split('/'))
+        name = relative_path.encode('utf-8')
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            yield pack(entry_format, len(name)) + name + pack(size_format, size)
+            # Send exactly the size announced in the header, even if the file changes meanwhile.
+            remaining = size
+            while remaining > 0:
+                block = file.read(min(READ_SIZE, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                yield block
+            if remaining:
+                yield bytes(remaining)
+    yield pack(entry_format, 0)
+
+
+# Runs a block generator in its own thread, up to depth blocks ahead of the consumer, so opening
+# and reading many small files overlaps with sending.
+def read_ahead(blocks, depth=64):
+    buffer = queue.Queue(maxsize=depth)
+    done = object()
+
+    def producer():
+        try:
+            for block in blocks:
+                buffer.put(block)
+        finally:
+            buffer.put(done)
+
+    threading.Thread(target=producer, daemon=True).start()
+    while True:
+        block = buffer.get()
+        if block is done:
+            return
+        yield block
+
+
+# Only plain relative paths are accepted, nothing may end up outside the output directory.
+def safe_path(output_dir, relative_path):
+    parts = relative_path.split('/')
+    if relative_path.startswith('/') or any(part in ('', '.', '..') for part in parts):
+        raise ValueError(f"unsafe path in manifest: {relative_path!r}")
+    return os.path.join(output_dir, *parts)
+
+
+class ManifestWriter:
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        self.buffer = bytearray()
+        self.file = None
+        self.remaining = 0
+        self.finished = False
+        self.files = 0
+        self.bytes = 0
+        self.error = None
+        # File creation and writing happen in a worker thread, not in the receive loop.
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, data):
+        self.queue.put(bytes(data))
+
+    def _run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            if self.error is None:
+                try:
+                    self._consume(data)
+                except (OSError, ValueError) as error:
+                    self.error = error
+
+    def _consume(self, data):
+        view = memoryview(data)
+        while view:
+            if self.file is not None:
+                # Inside a file: copy as much of it as this piece of the stream holds.
+                part = view[:self.remaining]
+                self.file.write(part)
+                self.remaining -= len(part)
+                self.bytes += len(part)
+                view = view[len(part):]
+                if self.remaining == 0:
+                    self.file.close()
+                    self.file = None
+                continue
+
+            if self.finished:
+                return
+
+            # Between files: collect the header of the next entry.
+            self.buffer += view
+            view = memoryview(b'')
+            if len(self.buffer) < NAME_LENGTH_SIZE:
+                return
+            name_length, = unpack_from(entry_format, self.buffer)
+            if name_length == 0:
+                self.finished = True
+                return
+            header_size = NAME_LENGTH_SIZE + name_length + SIZE_SIZE
+            if len(self.buffer) < header_size:
+                return
+
+            name = self.buffer[NAME_LENGTH_SIZE:NAME_LENGTH_SIZE + name_length].decode('utf-8')
+            size, = unpack_from(size_format, self.buffer, NAME_LENGTH_SIZE + name_length)
+            rest = bytes(self.buffer[header_size:])
+            self.buffer = bytearray()
+
+            path = safe_path(self.output_dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.file = open(path, 'wb')
+            self.files += 1
+            self.remaining = size
+            if size == 0:
+                self.file.close()
+                self.file = None
+            view = memoryview(rest)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.error is not None:
+            print(f"Manifest: Error: {self.error}")
+        elif not self.finished:
+            print("Manifest: Error: the stream ended in the middle of the manifest")
@@ -0,0 +1,371 @@
+'''
+    #Message mode: a persistent DRTP connection for many small messages (control traffic, RPC).
+    #connect()/accept() run the normal SYN handshake once, after that both sides can send messages at any
+    #time until close(). Each direction is a selective repeat stream like sr() in DRTP.py (per packet ACKs
+    #and timers, a window of N packets), and the messages are framed inside that stream as
+    #   length (4 bytes) + kind (1 byte) + request id (4 bytes) + body
+    #Everything queued while the sender is busy goes out in the same packet, so a burst of small messages
+    #shares datagrams, and a message larger than a packet simply spans several.
+    #request() sends a REQUEST and waits for the REPLY with the same id, the other side gets the
+    #(id, body) pairs from recv_request() and answers them with reply().
+    #Both streams number their packets from the ISN of the handshake and wrap around at 2**32 (see
+    #header.py), so a connection can stay open for any number of packets. The FIN takes the sequence
+    #number after the last packet and is ACKed with it.
+    #The retransmission timers come from an RTTEstimator (first sample from the handshake) and back off
+    #with every resend of a packet. After MAX_RETRIES resends the connection has failed: the waiting
+    #request() calls raise ConnectionError and recv_message()/recv_request() return None.
+
+'''
+
+import queue
+import socket
+import threading
+import time
+from struct import pack, unpack_from, calcsize
+
+from DRTP import handshake, ACK_packet, FIN_packet, RTTEstimator, MAX_RETRIES
+from header import create_packet, parse_header, HEADER_SIZE, MSS, seq_add, unwrap_seq
+
+frame_format = '!IBI'
+FRAME_HEADER_SIZE = calcsize(frame_format)
+
+MESSAGE = 0
+REQUEST = 1
+REPLY = 2
+
+ACK_FLAG = (1 << 2)
+FIN_FLAG = (1 << 1)
+
+
+class MessageConnection:
+
+    def __init__(self, sock, peer, N=64, mss=MSS, rtt=None, isn=0):
+        self.sock = sock
+        self.peer = peer
+        self.isn = isn
+        self.N = N
+        self.mss = mss
+        self.rtt = rtt if rtt is not None else RTTEstimator()
+        # Short socket timeout, so the receive thread notices close() quickly.
+        self.sock.settimeout(0.05)
+
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+
+        # Sending side: framed messages wait in outgoing until the window has room.
+        # unacked keeps seq -> [packet, send time, retransmissions] in sending order, so its first key is
+        # the window base.
+        self.outgoing = bytearray()
+        self.next_seq = 1
+        self.unacked = {}
+        self.messages_sent = 0
+        self.packets_sent = 0
+        self.retransmissions = 0
+
+        # Receiving side
+        self.expected_seq = 1
+        self.out_of_order = {}
+        self.stream = bytearray()
+        self.messages = queue.SimpleQueue()
+        self.requests = queue.SimpleQueue()
+        self.replies = {}
+        self.next_request_id = 1
+
+        self.closing = False
+        self.peer_closed = False
+        # The ConnectionError the connection failed with (a packet was not ACKed after MAX_RETRIES resends).
+        self.failure = None
+        self.fin_acked = threading.Event()
+        self.running = True
+        self.sender = threading.Thread(target=self._send_loop, daemon=True)
+        self.receiver = threading.Thread(target=self._receive_loop, daemon=True)
+        self.sender.start()
+        self.receiver.start()
+
+    # ---------- public API ----------
+
+    def send_message(self, data):
+        self._queue_frame(MESSAGE, 0, data)
+
+    # Returns the next message, or None once the other side has closed the connection.
+    def recv_message(self, timeout=None):
+        return self._get(self.messages, timeout)
+
+    # Sends data as a request and returns the body of the reply.
+    def request(self, data, timeout=None):
+        with self.lock:
+            request_id = self.next_request_id
+            self.next_request_id = self.next_request_id % 0xFFFFFFFF + 1
+            waiter = [threading.Event(), None]
+            self.replies[request_id] = waiter
+
+        try:
+            self._queue_frame(REQUEST, request_id, data)
+            if not waiter[0].wait(timeout):
+                raise TimeoutError(f"no reply to request #{request_id} within {timeout} s")
+        finally:
+            with self.lock:
+                self.replies.pop(request_id, None)
+
+        if waiter[1] is None:
+            if self.failure is not None:
+                raise ConnectionError(f"no reply to request #{request_id}: {self.failure}")
+            raise ConnectionError("the connection was closed before the reply arrived")
+        return waiter[1]
+
+    # Returns (request id, body) of the next request, or None once the other side has closed the connection.
+    def recv_request(self, timeout=None):
+        return self._get(self.requests, timeout)
+
+    def reply(self, request_id, data):
+        self._queue_frame(REPLY, request_id, data)
+
+    # Sends whatever is still queued, then a FIN (a few tries), and stops both threads.
+    def close(self, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            self.closing = True
+            while (self.outgoing or self.unacked) and not self.peer_closed and self.failure is None and time.monotonic() < deadline:
+                self.cond.wait(0.01)
+
+        # If the other side closed first it has stopped listening, there is nobody left to ACK a FIN.
+        if not self.peer_closed and self.failure is None:
+            for attempt in range(3):
+                self.sock.sendto(FIN_packet(seq_add(self.isn, self.next_seq), 0, 0), self.peer)
+                if self.fin_acked.wait(self.rtt.timeout(attempt)):
+                    break
+
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+        self.sender.join()
+        self.receiver.join()
+        self.sock.close()
+
+    # ---------- sending ----------
+
+    def _queue_frame(self, kind, request_id, data):
+        with self.cond:
+            if self.failure is not None:
+                raise ConnectionError(f"the connection failed: {self.failure}")
+            if self.closing or self.peer_closed:
+                raise ConnectionError("the connection is closed")
+            self.outgoing += pack(frame_format, len(data), kind, request_id)
+            self.outgoing += data
+            self.messages_sent += 1
+            self.cond.notify_all()
+
+    def _send_loop(self):
+        with self.cond:
+            while self.running and self.failure is None:
+                # New packets: everything queued so far, cut into packets of at most mss bytes.
+                base = next(iter(self.unacked), self.next_seq)
+                while self.outgoing and self.next_seq < base + self.N:
+                    chunk = bytes(self.outgoing[:self.mss])
+                    del self.outgoing[:self.mss]
+                    packet = create_packet(seq_add(self.isn, self.next_seq), 0, 0, 0, chunk)
+                    self.unacked[self.next_seq] = [packet, time.monotonic(), 0]
+                    self.next_seq += 1
+                    self.sock.sendto(packet, self.peer)
+                    self.packets_sent += 1
+
+                # Resend the packets whose (backed off) timer ran out, and sleep until the next one does.
+                now = time.monotonic()
+                wait = None
+                for seq, entry in self.unacked.items():
+                    expiry = entry[1] + self.rtt.timeout(entry[2])
+                    if expiry <= now:
+                        if entry[2] >= MAX_RETRIES:
+                            self._fail(ConnectionError(f"packet #{seq} was not acknowledged after {MAX_RETRIES} retries"))
+                            return
+                        self.sock.sendto(entry[0], self.peer)
+                        entry[1] = now
+                        entry[2] += 1
+                        self.retransmissions += 1
+                        expiry = now + self.rtt.timeout(entry[2])
+                    wait = expiry - now if wait is None else min(wait, expiry - now)
+                self.cond.wait(wait)
+
+    # ---------- receiving ----------
+
+    def _receive_loop(self):
+        while self.running:
+            try:
+                data, address = self.sock.recvfrom(HEADER_SIZE + self.mss)
+            except TimeoutError:
+                continue
+            except OSError:
+                break
+            if address != self.peer or len(data) < HEADER_SIZE:
+                continue
+            seq, ack, flags, _ = parse_header(data[:HEADER_SIZE])
+
+            if flags == ACK_FLAG:
+                with self.cond:
+                    # The packet number nearest to the window base.
+                    ack = unwrap_seq(ack, next(iter(self.unacked), self.next_seq), self.isn)
+                    if self.closing and ack == self.next_seq:
+                        self.fin_acked.set()
+                    else:
+                        entry = self.unacked.pop(ack, None)
+                        if entry is not None:
+                            # Only a packet that was sent once gives a clean RTT sample.
+                            if entry[2] == 0:
+                                self.rtt.sample(time.monotonic() - entry[1])
+                            self.cond.notify_all()
+            elif flags == FIN_FLAG:
+                self.sock.sendto(ACK_packet(0, seq, 0), self.peer)
+                self._peer_finished()
+            elif flags == 0:
+                # Every data packet is ACKed, duplicates too (their first ACK may have been lost).
+                self.sock.sendto(create_packet(0, seq, ACK_FLAG, 0, b''), self.peer)
+                self._deliver(unwrap_seq(seq, self.expected_seq, self.isn), data[HEADER_SIZE:])
+            # Anything else (a late SYN-ACK of the handshake, ...) is ignored.
+
+    def _deliver(self, seq, payload):
+        if seq < self.expected_seq:
+            return
+        self.out_of_order[seq] = payload
+        while self.expected_seq in self.out_of_order:
+            self.stream += self.out_of_order.pop(self.expected_seq)
+            self.expected_seq += 1
+
+        offset = 0
+        while len(self.stream) - offset >= FRAME_HEADER_SIZE:
+            length, kind, request_id = unpack_from(frame_format, self.stream, offset)
+            start = offset + FRAME_HEADER_SIZE
+            if len(self.stream) - start < length:
+                break
+            body = bytes(self.stream[start:start + length])
+            offset = start + length
+
+            if kind == REPLY:
+                with self.lock:
+                    waiter = self.replies.get(request_id)
+                if waiter is not None:
+                    waiter[1] = body
+                    waiter[0].set()
+            elif kind == REQUEST:
+                self.requests.put((request_id, body))
+            else:
+                self.messages.put(body)
+        del self.stream[:offset]
+
+    def _peer_finished(self):
+        if self.peer_closed:
+            return
+        with self.cond:
+            self.peer_closed = True
+            self.cond.notify_all()
+            waiters = list(self.replies.values())
+        self._wake_waiters(waiters)
+
+    # The other side stopped answering, called with self.cond held.
+    def _fail(self, error):
+        self.failure = error
+        self.cond.notify_all()
+        self._wake_waiters(list(self.replies.values()))
+
+    # Wakes up everybody still waiting for something from the other side.
+    def _wake_waiters(self, waiters):
+        for waiter in waiters:
+            waiter[0].set()
+        self.messages.put(None)
+        self.requests.put(None)
+
+    def _get(self, items, timeout):
+        try:
+            item = items.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"nothing received within {timeout} s")
+        if item is None:
+            # Leave the end marker for the next caller as well.
+            items.put(None)
+        return item
+
+
+def connect(server_ip, server_port, **options):
+    client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    peer = (socket.gethostbyname(server_ip), server_port)
+    rtt = RTTEstimator()
+    _, isn, _ = handshake(None, client_socket, False, peer[0], server_port, rtt=rtt)
+    return MessageConnection(client_socket, peer, isn=isn, rtt=rtt, **options)
+
+
+def accept(server_ip, server_port, **options):
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server_socket.bind((server_ip, server_port))
+    rtt = RTTEstimator()
+    client_address, isn, _ = handshake(server_socket, None, True, rtt=rtt)
+    return MessageConnection(server_socket, client_address, isn=isn, rtt=rtt, **options)
+
+
+# Latency benchmark over loopback: python messaging.py [requests] [message size]
+# Measures request/reply round trips on one persistent connection (p50/p99) and how many
+# small one-way messages share a datagram when they are sent in a burst.
+if __name__ == "__main__":
+    import sys
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+
+    received = []
+
+    def serve():
+        conn = accept('127.0.0.1', port)
+
+        def echo():
+            while True:
+                item = conn.recv_request()
+                if item is None:
+                    break
+                conn.reply(item[0], item[1])
+
+        echo_thread = threading.Thread(target=echo, daemon=True)
+        echo_thread.start()
+        while True:
+            message = conn.recv_message()
+            if message is None:
+                break
+            received.append(len(message))
+        echo_thread.join()
+        conn.close()
+
+    server_thread = threading.Thread(target=serve)
+    server_thread.start()
+    time.sleep(0.1)
+
+    start = time.perf_counter()
+    conn = connect('127.0.0.1', port)
+    handshake_time = time.perf_counter() - start
+
+    payload = bytes(size)
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        conn.request(payload)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    packets_before = conn.packets_sent
+    start = time.perf_counter()
+    for _ in range(count):
+        conn.send_message(payload)
+    conn.close()
+    burst_time = time.perf_counter() - start
+    burst_packets = conn.packets_sent - packets_before
+    server_thread.join()
+
+    print("----------------------------------------------------------")
+    print(f"HANDSHAKE: {handshake_time * 1000:.2f} ms (paid once per connection, not per message)")
+    print(f"REQUEST/REPLY: {count} x {size} bytes, p50 {latencies[len(latencies) // 2] * 1e6:.0f} us, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:.0f} us, max {latencies[-1] * 1e6:.0f} us")
+    print(f"BURST: {len(received)} of {count} messages in {burst_time * 1000:.1f} ms, "
+          f"{burst_packets} datagrams ({count / max(burst_packets, 1):.1f} messages per datagram)")
+    print(f"RETRANSMISSIONS: {conn.retransmissions}")
+    print("----------------------------------------------------------")
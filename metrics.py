@@ -0,0 +1,276 @@
+'''
+    #Live metrics of the transfers in progress, for a Prometheus scrape (or curl) on a local endpoint:
+    #   --metrics 9100              http://127.0.0.1:9100/metrics
+    #   --metrics HOST:PORT         http://HOST:PORT/metrics
+    #   --metrics unix:PATH         the same over a Unix domain socket (curl --unix-socket PATH http://x/metrics)
+    #Every session has a TransferMetrics. Nothing on the hot path takes a lock or calls anything:
+    #1) MetricsSocket (a socket layer, like TracingSocket) counts the packets and bytes on the wire and
+    #   the retransmissions, with plain integer updates in the thread that sends or receives.
+    #2) The protocols hand watch() functions that read their own variables (the window, the base of the
+    #   window, the reorder buffer), which only run when the endpoint is scraped.
+    #3) A sampler thread records the progress of every session a few times a second, the goodput is
+    #   the progress over the last GOODPUT_WINDOW seconds.
+    #A finished session is reported with its final values for FINISHED_RETENTION seconds (long enough
+    #for a scraper to see it), then the sampler thread drops it, whether it was scraped or not.
+
+'''
+
+import collections
+import http.server
+import itertools
+import os
+import socketserver
+import threading
+import time
+from struct import unpack_from
+
+from header import header_format, HEADER_SIZE, MSS, seq_le
+from integrity import SealedDatagram, CHECKSUM_SIZE
+
+SYN_FLAG = (1 << 3)
+ACK_FLAG = (1 << 2)
+PARITY_FLAG = (1 << 4)
+
+SAMPLE_INTERVAL = 0.25
+GOODPUT_WINDOW = 1.0
+FINISHED_RETENTION = 30.0
+
+# name, type, help. The values come from TransferMetrics.values().
+METRICS = [
+    ("drtp_session_open", "gauge", "1 while the session runs, 0 once it is finished."),
+    ("drtp_session_seconds", "gauge", "Time since the session started."),
+    ("drtp_packets_sent_total", "counter", "Data packets sent, retransmissions included."),
+    ("drtp_bytes_sent_total", "counter", "Payload bytes sent for the first time."),
+    ("drtp_retransmissions_total", "counter", "Data packets sent again."),
+    ("drtp_retransmission_ratio", "gauge", "Retransmissions per data packet sent."),
+    ("drtp_packets_received_total", "counter", "Packets with a payload received, duplicates included."),
+    ("drtp_bytes_received_total", "counter", "Payload bytes received, duplicates included."),
+    ("drtp_acks_received_total", "counter", "Packets without a payload (ACKs) received."),
+    ("drtp_bytes_acked_total", "counter", "Payload bytes the receiver acknowledged in order (sender)."),
+    ("drtp_bytes_delivered_total", "counter", "Payload bytes received in order (receiver)."),
+    ("drtp_window_packets", "gauge", "Packets the sender may have in flight now."),
+    ("drtp_reorder_buffer_packets", "gauge", "Packets received out of order and held for reordering (receiver)."),
+    ("drtp_rtt_seconds", "gauge", "Smoothed round-trip time."),
+    ("drtp_rto_seconds", "gauge", "Current retransmission timeout."),
+    ("drtp_goodput_bytes_per_second", "gauge", f"Bytes acknowledged (sender) or delivered (receiver) per second over the last {GOODPUT_WINDOW:g} s."),
+]
+
+
+class TransferMetrics:
+
+    def __init__(self, role, peer, method, rtt=None, mss=MSS):
+        # role is "client" or "server", peer an (ip, port) address and rtt the session's RTTEstimator.
+        self.role = role
+        self.peer = peer
+        self.method = method
+        self.rtt = rtt
+        self.mss = mss
+        self.started = time.monotonic()
+        self.finished = None
+        # Updated by MetricsSocket.
+        self.packets_sent = 0
+        self.bytes_sent = 0
+        self.retransmissions = 0
+        self.packets_received = 0
+        self.bytes_received = 0
+        self.acks_received = 0
+        # Functions set by the protocol with watch().
+        self.window = None
+        self.acked_packets = None
+        self.delivered_packets = None
+        self.reorder_buffer = None
+        # (time, progress) samples, kept by the sampler thread.
+        self.samples = collections.deque(maxlen=int(GOODPUT_WINDOW / SAMPLE_INTERVAL) + 1)
+
+    # Registers functions that return the protocol's live values: window, acked_packets (sender),
+    # delivered_packets and reorder_buffer (receiver). Packets count from 1, so n packets are n * mss
+    # bytes (the last one may be shorter, the byte counters of the socket bound the result).
+    def watch(self, window=None, acked_packets=None, delivered_packets=None, reorder_buffer=None):
+        if window is not None:
+            self.window = window
+        if acked_packets is not None:
+            self.acked_packets = acked_packets
+        if delivered_packets is not None:
+            self.delivered_packets = delivered_packets
+        if reorder_buffer is not None:
+            self.reorder_buffer = reorder_buffer
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    def progress(self):
+        if self.acked_packets is not None:
+            return min(self.acked_packets() * self.mss, self.bytes_sent)
+        if self.delivered_packets is not None:
+            return min(self.delivered_packets() * self.mss, self.bytes_received)
+        return 0
+
+    def sample(self, now):
+        self.samples.append((now, self.progress()))
+
+    def goodput(self):
+        samples = list(self.samples)
+        if len(samples) < 2 or samples[-1][0] <= samples[0][0]:
+            return 0.0
+        return (samples[-1][1] - samples[0][1]) / (samples[-1][0] - samples[0][0])
+
+    # The values of METRICS, None for the ones that do not apply to this side.
+    def values(self):
+        now = self.finished if self.finished is not None else time.monotonic()
+        srtt = self.rtt.srtt if self.rtt is not None else None
+        return {
+            "drtp_session_open": 0 if self.finished is not None else 1,
+            "drtp_session_seconds": now - self.started,
+            "drtp_packets_sent_total": self.packets_sent,
+            "drtp_bytes_sent_total": self.bytes_sent,
+            "drtp_retransmissions_total": self.retransmissions,
+            "drtp_retransmission_ratio": self.retransmissions / self.packets_sent if self.packets_sent else 0.0,
+            "drtp_packets_received_total": self.packets_received,
+            "drtp_bytes_received_total": self.bytes_received,
+            "drtp_acks_received_total": self.acks_received,
+            "drtp_bytes_acked_total": self.progress() if self.acked_packets is not None else None,
+            "drtp_bytes_delivered_total": self.progress() if self.delivered_packets is not None else None,
+            "drtp_window_packets": self.window() if self.window is not None else None,
+            "drtp_reorder_buffer_packets": self.reorder_buffer() if self.reorder_buffer is not None else None,
+            "drtp_rtt_seconds": srtt,
+            "drtp_rto_seconds": self.rtt.rto if self.rtt is not None else None,
+            "drtp_goodput_bytes_per_second": self.goodput() if self.finished is None else 0.0,
+        }
+
+
+# Socket layer that counts what goes over the wire into a TransferMetrics.
+class MetricsSocket:
+
+    def __init__(self, sock, metrics):
+        self.sock = sock
+        self.metrics = metrics
+        self.highest_sent = None
+
+    def sendto(self, data, address):
+        if len(data) > HEADER_SIZE:
+            seq, _, flags, _ = unpack_from(header_format, data)
+            # Data packets only, a seq seen before is a retransmission (as in TracingSocket).
+            if not flags & (SYN_FLAG | ACK_FLAG | PARITY_FLAG):
+                metrics = self.metrics
+                metrics.packets_sent += 1
+                if self.highest_sent is not None and seq_le(seq, self.highest_sent):
+                    metrics.retransmissions += 1
+                else:
+                    self.highest_sent = seq
+                    # A SealedDatagram (pipeline.py) carries its CRC32 trailer already.
+                    metrics.bytes_sent += len(data) - HEADER_SIZE - (CHECKSUM_SIZE if type(data) is SealedDatagram else 0)
+        return self.sock.sendto(data, address)
+
+    def recvfrom(self, bufsize):
+        data, address = self.sock.recvfrom(bufsize)
+        self._received(len(data))
+        return data, address
+
+    def recvfrom_into(self, buffer, nbytes=0):
+        received, address = self.sock.recvfrom_into(buffer, nbytes)
+        self._received(received)
+        return received, address
+
+    def _received(self, length):
+        if length > HEADER_SIZE:
+            self.metrics.packets_received += 1
+            self.metrics.bytes_received += length - HEADER_SIZE
+        else:
+            self.metrics.acks_received += 1
+
+    # Everything else (settimeout, close, getsockname, ...) goes straight to the real socket.
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.exporter.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # No access log, the transfer's own output is on stdout.
+    def log_message(self, format, *args):
+        pass
+
+
+class _HTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class MetricsServer:
+
+    def __init__(self, address):
+        # address: "PORT", "HOST:PORT" or "unix:PATH".
+        self.sessions = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.path = None
+        if address.startswith("unix:"):
+            self.address = address
+            self.path = address[len("unix:"):]
+            self.server = _UnixHTTPServer(self.path, _MetricsHandler)
+        else:
+            host, _, port = address.rpartition(':')
+            self.server = _HTTPServer((host or '127.0.0.1', int(port)), _MetricsHandler)
+            self.address = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}/metrics"
+        self.server.exporter = self
+        self.running = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._sample_loop, daemon=True).start()
+
+    # Adds a session, its metrics are reported until FINISHED_RETENTION seconds after it is finished.
+    def add(self, metrics):
+        with self.lock:
+            self.sessions[next(self.ids)] = metrics
+
+    def _sample_loop(self):
+        while self.running:
+            now = time.monotonic()
+            with self.lock:
+                # Age out the finished sessions, so a long-running server does not keep them all.
+                for session, metrics in list(self.sessions.items()):
+                    if metrics.finished is not None and now - metrics.finished >= FINISHED_RETENTION:
+                        del self.sessions[session]
+                sessions = list(self.sessions.values())
+            for metrics in sessions:
+                if metrics.finished is None:
+                    metrics.sample(now)
+            time.sleep(SAMPLE_INTERVAL)
+
+    def render(self):
+        with self.lock:
+            sessions = list(self.sessions.items())
+        values = [(session, metrics, metrics.values()) for session, metrics in sessions]
+        lines = []
+        for name, kind, help_text in METRICS:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for session, metrics, session_values in values:
+                value = session_values[name]
+                if value is None:
+                    continue
+                labels = f'session="{session}",role="{metrics.role}",peer="{metrics.peer[0]}:{metrics.peer[1]}",method="{metrics.method}"'
+                lines.append(f"{name}{{{labels}}} {value:g}" if isinstance(value, float) else f"{name}{{{labels}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        self.running = False
+        self.server.shutdown()
+        self.server.server_close()
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
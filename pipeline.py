@@ -0,0 +1,190 @@
+'''
+    #Packet pipeline: worker processes build the data packets of a file ahead of the sender, so the
+    #sender thread only copies finished datagrams out and calls sendto.
+    #The packets go through a ring in shared memory (multiprocessing.shared_memory) of RING_BATCHES
+    #batches of BATCH slots. Slot layout:
+    #   length (2 bytes) + datagram (header + payload [+ CRC32 trailer]), SLOT_SIZE bytes in all
+    #The parent hands out a batch (its first packet number and ring position) on a task queue, a worker
+    #reads the payloads with pread, packs the headers (seq = ISN + packet number, FIN on the last one)
+    #and with seal=True appends the CRC32 trailer, then reports the batch on the done queue. Once the
+    #sender has taken every packet of a batch, its ring position gets the batch RING_BATCHES further on.
+    #The packet numbers are known up front, so this only works for files (not streams) and for the
+    #window protocols, whose data packets do not depend on the ACKs (stop_and_wait's do).
+
+'''
+
+import multiprocessing
+import os
+import time
+import zlib
+from multiprocessing import shared_memory
+from struct import pack_into, unpack_from, calcsize
+
+from header import header_format, HEADER_SIZE, MSS, seq_add
+from integrity import SealedDatagram, CHECKSUM_SIZE
+
+FIN_FLAG = (1 << 1)
+
+BATCH = 64
+RING_BATCHES = 16
+length_format = '!H'
+LENGTH_SIZE = calcsize(length_format)
+SLOT_SIZE = LENGTH_SIZE + HEADER_SIZE + MSS + CHECKSUM_SIZE
+
+
+def _build_batches(ring_name, path, mss, isn, total, seal, tasks, done):
+    ring = shared_memory.SharedMemory(name=ring_name)
+    buffer = ring.buf
+    try:
+        with open(path, 'rb') as file:
+            fd = file.fileno()
+            while True:
+                task = tasks.get()
+                if task is None:
+                    break
+                batch, position = task
+                offset = position * BATCH * SLOT_SIZE
+                first = batch * BATCH + 1
+                for n in range(first, min(first + BATCH, total + 1)):
+                    start = offset + LENGTH_SIZE
+                    payload = os.pread(fd, mss, (n - 1) * mss)
+                    length = HEADER_SIZE + len(payload)
+                    pack_into(header_format, buffer, start, seq_add(isn, n), 0, FIN_FLAG if n == total else 0, 0)
+                    buffer[start + HEADER_SIZE:start + length] = payload
+                    if seal:
+                        pack_into('!I', buffer, start + length, zlib.crc32(buffer[start:start + length]))
+                        length += CHECKSUM_SIZE
+                    pack_into(length_format, buffer, offset, length)
+                    offset += SLOT_SIZE
+                done.put(batch)
+    finally:
+        del buffer
+        ring.close()
+
+
+class PacketPipeline:
+
+    def __init__(self, path, isn=0, mss=MSS, workers=2, seal=False):
+        # seal=True: the datagrams carry their CRC32 trailer (SealedDatagram, for a ChecksumSocket), the
+        # mss must leave room for it then.
+        self.isn = isn
+        self.mss = mss
+        self.seal = seal
+        self.size = os.path.getsize(path)
+        # An empty file still gives one (empty) packet with the FIN flag.
+        self.total = max(1, -(-self.size // mss))
+        self.batches = -(-self.total // BATCH)
+        self.next = 1
+        self.sent_bytes = 0
+        # Time the sender waited for a batch, i.e. the workers did not keep up.
+        self.wait_time = 0.0
+        self.finished = set()
+
+        self.ring = shared_memory.SharedMemory(create=True, size=RING_BATCHES * BATCH * SLOT_SIZE)
+        self.view = self.ring.buf
+        # Spawned, not forked: the parent may already run threads (the DigestWorker) whose locks a fork
+        # would copy in whatever state they are.
+        context = multiprocessing.get_context("spawn")
+        self.tasks = context.SimpleQueue()
+        self.done = context.SimpleQueue()
+        self.workers = [context.Process(target=_build_batches, args=(self.ring.name, path, mss, isn, self.total, seal, self.tasks, self.done), daemon=True)
+                        for _ in range(max(1, workers))]
+        for worker in self.workers:
+            worker.start()
+        for batch in range(min(RING_BATCHES, self.batches)):
+            self.tasks.put((batch, batch))
+
+    # Returns (packet, is_last) like ChunkSource.next_packet. The packets come out in order, seq must be
+    # the one the pipeline built the packet with.
+    def next_packet(self, seq):
+        n = self.next
+        if seq != seq_add(self.isn, n):
+            raise ValueError(f"packet #{n} was built with seq {seq_add(self.isn, n)}, not {seq}")
+        batch, index = divmod(n - 1, BATCH)
+        if batch not in self.finished:
+            start = time.perf_counter()
+            while batch not in self.finished:
+                self.finished.add(self.done.get())
+            self.wait_time += time.perf_counter() - start
+        position = batch % RING_BATCHES
+        offset = (position * BATCH + index) * SLOT_SIZE
+        length, = unpack_from(length_format, self.view, offset)
+        data = self.view[offset + LENGTH_SIZE:offset + LENGTH_SIZE + length]
+        packet = SealedDatagram(data) if self.seal else bytes(data)
+        self.sent_bytes += length - HEADER_SIZE - (CHECKSUM_SIZE if self.seal else 0)
+        self.next += 1
+
+        # The last packet of a batch frees its place in the ring for a later batch.
+        if index == BATCH - 1 or n == self.total:
+            self.finished.discard(batch)
+            if batch + RING_BATCHES < self.batches:
+                self.tasks.put((batch + RING_BATCHES, position))
+        return packet, n == self.total
+
+    def close(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join(timeout=1.0)
+            if worker.is_alive():
+                worker.terminate()
+        self.view.release()
+        self.ring.close()
+        self.ring.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Benchmark: python pipeline.py FILE [max workers]
+# Builds every data packet of FILE (with CRC32 trailers) and sends it to a local UDP port nobody reads,
+# once in the sender thread as the protocols do without a pipeline and then with 1, 2, 4, ... workers.
+# The send rate shows how far the sender thread gets when it only does the sendto calls (the workers need
+# cores of their own for that, the sender thread's CPU time per packet shows the work it no longer does).
+if __name__ == "__main__":
+    import socket
+    import sys
+    from DRTP import ChunkSource
+    from integrity import ChecksumSocket
+
+    path = sys.argv[1]
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    mss = MSS - CHECKSUM_SIZE
+    isn = 12345
+
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    address = sink.getsockname()
+    sender = ChecksumSocket(socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
+
+    def send_all(source):
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        n = 0
+        is_last = False
+        while not is_last:
+            n += 1
+            packet, is_last = source.next_packet(seq_add(isn, n))
+            sender.sendto(packet, address)
+        return n, time.perf_counter() - start, time.thread_time() - cpu_start
+
+    def report(name, packets, elapsed, cpu, waited=None):
+        waits = f", waited {waited:.2f} s for the workers" if waited is not None else ""
+        print(f"{name:>12}: {packets / elapsed:9.0f} packets/s {packets * mss * 8 / elapsed / 1000000:8.1f} Mbps, "
+              f"sender thread {cpu / packets * 1000000:.2f} us CPU/packet{waits}")
+
+    print("----------------------------------------------------------")
+    print(f"FILE: {os.path.getsize(path)} bytes, {mss} byte payloads with CRC32 trailers")
+    with open(path, 'rb') as file:
+        packets, elapsed, cpu = send_all(ChunkSource(iter(lambda: file.read(1 << 20), b''), mss))
+    report("in thread", packets, elapsed, cpu)
+    workers = 1
+    while workers <= max_workers:
+        with PacketPipeline(path, isn, mss, workers, seal=True) as pipeline:
+            packets, elapsed, cpu = send_all(pipeline)
+            report(f"{workers} worker(s)", packets, elapsed, cpu, pipeline.wait_time)
+        workers *= 2
+    print("----------------------------------------------------------")
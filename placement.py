@@ -0,0 +1,230 @@
+'''
+    #Direct-placement receiver: instead of holding out-of-order payloads in a list until the gap is
+    #filled, every payload is written straight to its final offset in the output file,
+    #offset = (seq - 1) * MSS. A compact bitmap of received chunks is enough to know
+    #when the transfer is complete.
+    #
+    #When the total size is known the bitmap is also saved in a sidecar file next to the output
+    #(<output>.part), so an interrupted transfer can be resumed and only the missing
+    #chunks have to be sent again.
+
+'''
+
+import os
+import mmap
+import struct
+
+from header import MSS
+
+# Sidecar layout: file size (8 bytes), MSS (4 bytes), followed by the chunk bitmap.
+progress_format = '!QI'
+
+# How many new chunks are placed between two saves of the sidecar bitmap.
+SAVE_EVERY = 256
+
+
+def progress_file_name(file_name):
+    return file_name + ".part"
+
+
+class PlacementWriter:
+
+    def __init__(self, file_name, file_size=None, mss=MSS, resume=False, digest=None):
+        self.file_name = file_name
+        self.mss = mss
+        self.file_size = file_size
+        self.progress_file = progress_file_name(file_name) if file_size is not None else None
+
+        # One bit per chunk of the file (bit i = bytes i*mss .. (i+1)*mss), grown on demand.
+        self.received = bytearray()
+        # Chunk index sent in packet seq is chunk_map[seq-1]. None means packet seq carries chunk seq-1,
+        # a resumed transfer only sends the missing chunks and sets the map with set_chunk_map().
+        self.chunk_map = None
+        # Highest sequence number such that every packet 1..contiguous has been placed.
+        self.contiguous = 0
+        # Sequence number and payload length of the FIN-flagged (last) packet, once seen.
+        self.last_seq = None
+        self.last_len = 0
+        # Highest byte offset written so far, used when the total size is not known.
+        self.end = 0
+        # Number of chunks marked in the bitmap, so completion is a single comparison.
+        self.count = 0
+        self.unsaved = 0
+        # Optional DigestWorker, fed with the file in order as the leading run of chunks grows.
+        self.digest = digest
+        self.digested = 0
+
+        # Pick up the bitmap of an earlier, interrupted transfer of the same file.
+        if resume and self._load_progress():
+            self.fd = os.open(file_name, os.O_RDWR | os.O_CREAT, 0o644)
+        else:
+            self.fd = os.open(file_name, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.mm = None
+
+        # If the client told us the total size, reserve the whole file up front and map it,
+        # so each payload is just a memory copy into the page cache.
+        if file_size:
+            if os.fstat(self.fd).st_size != file_size:
+                try:
+                    os.posix_fallocate(self.fd, 0, file_size)
+                except (AttributeError, OSError):
+                    # posix_fallocate is not available on every platform/filesystem,
+                    # a sparse file of the right length works as well.
+                    os.ftruncate(self.fd, file_size)
+            self.mm = mmap.mmap(self.fd, file_size)
+
+        # Chunks kept from an earlier attempt are part of the digest as well.
+        self._feed_digest()
+
+    def _load_progress(self):
+        try:
+            with open(self.progress_file, 'rb') as file:
+                data = file.read()
+        except (TypeError, OSError):
+            return False
+
+        header_size = struct.calcsize(progress_format)
+        if len(data) < header_size or not os.path.exists(self.file_name):
+            return False
+        file_size, mss = struct.unpack_from(progress_format, data)
+        if file_size != self.file_size or mss != self.mss:
+            # Different file (or chunking) than last time, start over.
+            return False
+
+        self.received = bytearray(data[header_size:])
+        self.count = sum(bin(byte).count('1') for byte in self.received)
+        return True
+
+    def save_progress(self):
+        if self.progress_file is None:
+            return
+        # Write to a temporary file and rename, so a crash never leaves a half written bitmap behind.
+        temp_file = self.progress_file + ".tmp"
+        with open(temp_file, 'wb') as file:
+            file.write(struct.pack(progress_format, self.file_size, self.mss))
+            file.write(self.received)
+        os.replace(temp_file, self.progress_file)
+        self.unsaved = 0
+
+    def total_chunks(self):
+        return (self.file_size + self.mss - 1) // self.mss
+
+    def has_chunk(self, index):
+        byte = index >> 3
+        return byte < len(self.received) and self.received[byte] & (1 << (index & 7)) != 0
+
+    def _mark(self, index):
+        byte = index >> 3
+        if byte >= len(self.received):
+            self.received.extend(bytes(byte - len(self.received) + 1))
+        self.received[byte] |= 1 << (index & 7)
+        self.count += 1
+
+    # Half-open ranges [start, end) of chunk indices that are not on disk yet.
+    def missing_ranges(self):
+        ranges = []
+        start = None
+        for index in range(self.total_chunks()):
+            if not self.has_chunk(index):
+                if start is None:
+                    start = index
+            elif start is not None:
+                ranges.append((start, index))
+                start = None
+        if start is not None:
+            ranges.append((start, self.total_chunks()))
+        return ranges
+
+    # From now on packet seq carries chunk chunk_map[seq-1] (only the missing chunks are sent).
+    def set_chunk_map(self, ranges):
+        self.chunk_map = [index for start, end in ranges for index in range(start, end)]
+
+    def chunk_for(self, seq):
+        if self.chunk_map is None:
+            return seq - 1
+        if seq > len(self.chunk_map):
+            return None
+        return self.chunk_map[seq - 1]
+
+    def has(self, seq):
+        index = self.chunk_for(seq)
+        return index is not None and self.has_chunk(index)
+
+    # Writes one payload at its offset. Returns False for duplicates, which are simply ignored.
+    def place(self, seq, payload, is_last=False):
+        if seq < 1 or self.has(seq):
+            return False
+        index = self.chunk_for(seq)
+        # A chunk beyond the end of a file of known size is a stray packet, it must not grow the file.
+        if index is None or (self.file_size is not None and index >= self.total_chunks()):
+            return False
+
+        offset = index * self.mss
+        length = len(payload)
+        if self.mm is not None and offset + length <= len(self.mm):
+            self.mm[offset:offset + length] = payload
+        else:
+            os.pwrite(self.fd, payload, offset)
+
+        self._mark(index)
+        self.end = max(self.end, offset + length)
+        if is_last:
+            self.last_seq = seq
+            self.last_len = length
+
+        # Slide the contiguous edge over everything that is already in place.
+        while self.has(self.contiguous + 1):
+            self.contiguous += 1
+        self._feed_digest()
+
+        self.unsaved += 1
+        if self.unsaved >= SAVE_EVERY:
+            self.save_progress()
+        return True
+
+    # Hands the newly completed leading run of chunks to the digest worker, which reads it back
+    # from the file itself, so the receive loop never hashes anything.
+    def _feed_digest(self):
+        if self.digest is None:
+            return
+        start = self.digested
+        while self.has_chunk(self.digested):
+            self.digested += 1
+        if self.digested > start:
+            self.digest.update_range(self.fd, start * self.mss, (self.digested - start) * self.mss)
+
+    def is_complete(self):
+        if self.file_size is not None:
+            return self.count >= self.total_chunks()
+        return self.last_seq is not None and self.contiguous >= self.last_seq
+
+    # Number of bytes the finished file should have.
+    def final_size(self):
+        if self.file_size is not None:
+            return self.file_size
+        if self.last_seq is not None:
+            return (self.last_seq - 1) * self.mss + self.last_len
+        return self.end
+
+    def close(self):
+        complete = self.is_complete()
+        # The digest worker reads from our file descriptor, let it catch up first.
+        if self.digest is not None:
+            self.digest.digest()
+        if self.mm is not None:
+            self.mm.flush()
+            self.mm.close()
+            self.mm = None
+        if complete:
+            # Cut off whatever was preallocated but never written.
+            os.ftruncate(self.fd, self.final_size())
+        os.close(self.fd)
+        self.fd = None
+
+        # A finished file needs no sidecar, an unfinished one keeps it for the next attempt.
+        if self.progress_file is not None:
+            if complete:
+                if os.path.exists(self.progress_file):
+                    os.remove(self.progress_file)
+            else:
+                self.save_progress()
@@ -0,0 +1,253 @@
+'''
+    #Timing and profiling of a transfer.
+    #1) PhaseTimer adds up where a transfer spends its time (setup, transfer, timeout waits, disk I/O,
+    #   teardown). Phases nest per thread: time spent in an inner phase is not counted in the outer one,
+    #   so the phases of one thread add up to its wall time. Phases of other threads (the receive thread
+    #   waiting for a timeout, a worker writing to disk) run at the same time and are reported alongside.
+    #2) profiled() wraps a whole run in one of three profilers and saves the result:
+    #   cprofile    - every thread gets its own cProfile.Profile, the stats are merged (pstats file)
+    #   sample      - a thread samples the stacks of all threads every few ms (collapsed stacks, flamegraph.pl format)
+    #   tracemalloc - allocations by source line (tracemalloc snapshot)
+
+'''
+
+import collections
+import contextlib
+import sys
+import threading
+import time
+
+
+class PhaseTimer:
+
+    def __init__(self):
+        self.totals = collections.defaultdict(float)
+        self.counts = collections.defaultdict(int)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self._begin(name)
+        try:
+            yield
+        finally:
+            self._end()
+
+    # Ends the current phase of this thread and starts the next one (None: only end it), for code that
+    # goes through its phases one after the other.
+    def switch(self, name):
+        if self.local.__dict__.get('stack'):
+            self._end()
+        if name is not None:
+            self._begin(name)
+
+    def _begin(self, name):
+        # [name, time spent in nested phases, start]
+        self.local.__dict__.setdefault('stack', []).append([name, 0.0, time.perf_counter()])
+
+    def _end(self):
+        stack = self.local.stack
+        name, nested, start = stack.pop()
+        elapsed = time.perf_counter() - start
+        # add() counts the exclusive time as nested in the outer phase, the rest was nested already.
+        self.add(name, elapsed - nested)
+        if stack:
+            stack[-1][1] += nested
+
+    # Also used for time measured elsewhere (see TimingSocket), which counts as nested in the current phase.
+    def add(self, name, seconds):
+        stack = self.local.__dict__.get('stack')
+        if stack:
+            stack[-1][1] += seconds
+        with self.lock:
+            self.totals[name] += seconds
+            self.counts[name] += 1
+
+    def report(self, who, data_bytes=None):
+        wall = time.perf_counter() - self.started
+        print("----------------------------------------------------------")
+        print(f"{who}: time per phase (wall time {wall:.3f} s)")
+        for name, seconds in sorted(self.totals.items(), key=lambda item: -item[1]):
+            print(f"  {name:<14} {seconds:9.3f} s {seconds / wall if wall else 0:7.1%}  ({self.counts[name]} x)")
+        if data_bytes:
+            print(f"  END TO END: {data_bytes * 8 / wall / 1e6:.2f} Mbps over the whole session")
+        print("----------------------------------------------------------")
+
+
+# `with timed_phase(timer, "disk write"):` for code where the timer is optional.
+def timed_phase(timer, name):
+    return timer.phase(name) if timer is not None else contextlib.nullcontext()
+
+
+# Times the blocks an iterable produces (e.g. reading a file) as a phase of the thread that consumes them.
+def timed_blocks(blocks, timer, name="disk read"):
+    iterator = iter(blocks)
+    while True:
+        with timer.phase(name):
+            block = next(iterator, None)
+        if block is None:
+            return
+        yield block
+
+
+# Proxy that times the given methods of an object (a file's write, a placement writer's place)
+# as a phase, everything else goes straight to the object.
+class TimedCalls:
+
+    def __init__(self, obj, timer, name, methods=('write',)):
+        self.obj = obj
+        for method_name in methods:
+            setattr(self, method_name, self._timed(getattr(obj, method_name), timer, name))
+
+    @staticmethod
+    def _timed(method, timer, name):
+        def call(*args, **kwargs):
+            with timer.phase(name):
+                return method(*args, **kwargs)
+        return call
+
+    def __getattr__(self, name):
+        return getattr(self.obj, name)
+
+
+# Socket layer that counts the time the protocol spends blocked in a receive that ends in a timeout,
+# i.e. waiting before it retransmits (client) or waiting for the next packet (server).
+class TimingSocket:
+
+    def __init__(self, sock, timer):
+        self.sock = sock
+        self.timer = timer
+
+    def recvfrom(self, bufsize):
+        start = time.perf_counter()
+        try:
+            return self.sock.recvfrom(bufsize)
+        except TimeoutError:
+            self.timer.add("timeout wait", time.perf_counter() - start)
+            raise
+
+    def recvfrom_into(self, buffer, nbytes=0):
+        start = time.perf_counter()
+        try:
+            return self.sock.recvfrom_into(buffer, nbytes)
+        except TimeoutError:
+            self.timer.add("timeout wait", time.perf_counter() - start)
+            raise
+
+    # Everything else (sendto, settimeout, close, ...) goes straight to the real socket.
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+PROFILERS = ("cprofile", "sample", "tracemalloc")
+
+
+@contextlib.contextmanager
+def profiled(kind, output):
+    if kind == "cprofile":
+        with _cprofile(output):
+            yield
+    elif kind == "sample":
+        with _sample(output):
+            yield
+    elif kind == "tracemalloc":
+        with _tracemalloc(output):
+            yield
+    else:
+        yield
+
+
+@contextlib.contextmanager
+def _cprofile(output):
+    import cProfile
+    import pstats
+
+    # cProfile only sees the thread that enables it, so every thread started meanwhile runs under its own profile.
+    profiles = []
+    original_run = threading.Thread.run
+
+    def profiled_run(thread):
+        profile = cProfile.Profile()
+        profiles.append((thread, profile))
+        profile.runcall(original_run, thread)
+
+    threading.Thread.run = profiled_run
+    main = cProfile.Profile()
+    main.enable()
+    try:
+        yield
+    finally:
+        main.disable()
+        threading.Thread.run = original_run
+        stats = pstats.Stats(main, stream=sys.stdout)
+        for thread, profile in profiles:
+            # Threads that are still running (daemon workers) have no finished stats yet.
+            if not thread.is_alive():
+                stats.add(profile)
+        stats.dump_stats(output)
+        print(f"Profile: cProfile stats of {1 + len(profiles)} thread(s) saved to '{output}', top functions:")
+        stats.sort_stats("cumulative").print_stats(15)
+
+
+@contextlib.contextmanager
+def _sample(output, interval=0.005):
+    samples = collections.Counter()
+    done = threading.Event()
+
+    def sampler():
+        me = threading.get_ident()
+        while not done.wait(interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                samples[';'.join(reversed(stack))] += 1
+
+    thread = threading.Thread(target=sampler, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+        with open(output, 'w') as file:
+            for stack, count in samples.most_common():
+                file.write(f"{stack} {count}\n")
+
+        # Self time is where a sample's stack ends, total time every function on the stack.
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, count in samples.items():
+            functions = stack.split(';')
+            own[functions[-1]] += count
+            for function in set(functions):
+                total[function] += count
+        count = sum(samples.values())
+        print(f"Profile: {count} stack samples every {interval * 1000:.0f} ms saved to '{output}' (collapsed stacks), "
+              f"most frequent at the top of the stack:")
+        for function, hits in own.most_common(15):
+            print(f"  {hits / max(count, 1):6.1%} self {total[function] / max(count, 1):6.1%} total  {function}")
+
+
+@contextlib.contextmanager
+def _tracemalloc(output):
+    import tracemalloc
+
+    tracemalloc.start(25)
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        snapshot.dump(output)
+        print(f"Profile: tracemalloc snapshot saved to '{output}', {current / 1e6:.2f} MB still allocated, "
+              f"peak {peak / 1e6:.2f} MB, largest by line:")
+        for statistic in snapshot.statistics("lineno")[:15]:
+            print(f"  {statistic}")
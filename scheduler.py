@@ -0,0 +1,372 @@
+'''
+    #Fair scheduling of concurrent sessions on one server socket.
+    #A dispatcher thread reads every datagram from the socket and queues it for the session of its sender
+    #(a SYN from a new address opens a session, accept() hands it to the server). Each session is a
+    #socket-like SessionSocket that its own thread runs the usual handshake and protocol on.
+    #1) Receive processing: queued packets are released to the session threads by deficit round-robin.
+    #   Every round a session may release QUANTUM * weight bytes, and only READY_LIMIT packets can wait
+    #   unread in a session, so a busy upload gets the next packets to process only after the other
+    #   sessions had their turn and the ACKs of a small transfer are not stuck behind it.
+    #2) Isolation: the backlog a session may queue is its weighted share of the socket buffer, a sender
+    #   that sends more than that only loses its own packets.
+    #3) Windows: every ACK advertises the session's current share of the receive window (advertised_window
+    #   in DRTP.py), so well-behaved senders do not overrun their share in the first place.
+    #4) Rate limits: a session with a rate gets its packets released by a token bucket (BURST seconds deep)
+    #   and advertises at most BURST seconds of data as its window.
+    #Weights (priorities) and rates are given per client host, "*" for every other host.
+
+'''
+
+import collections
+import queue
+import select
+import socket
+import threading
+import time
+
+from header import PACKET_SIZE, HEADER_SIZE, parse_header_from
+from DRTP import receive_window
+
+SYN_FLAG = (1 << 3)
+
+# Bytes a session of weight 1 may release per round, one full packet.
+QUANTUM = PACKET_SIZE
+# Packets released to a session but not read by its thread yet.
+READY_LIMIT = 4
+# Depth of the token bucket of a rate-limited session, in seconds at its rate.
+BURST = 0.1
+# A session nothing arrives for in this time is closed (its client is gone).
+IDLE_TIMEOUT = 60.0
+# Largest datagram the dispatcher reads.
+DATAGRAM_SIZE = 65536
+
+
+# Parses ["HOST=VALUE", ...] (a command line option given several times) into {host: float}.
+def parse_client_values(items):
+    values = {}
+    for item in items or ():
+        host, _, value = item.partition('=')
+        if not host or not value:
+            raise ValueError(f"'{item}' is not HOST=VALUE")
+        values[host] = float(value)
+        if values[host] <= 0:
+            raise ValueError(f"'{item}' must be positive")
+    return values
+
+
+class SessionSocket:
+
+    def __init__(self, scheduler, address, weight=1.0, rate=None):
+        # rate is in bytes per second, None for no limit.
+        self.scheduler = scheduler
+        self.address = address
+        self.weight = weight
+        self.rate = rate
+        self.tokens = self.bucket_size() if rate else 0.0
+        self.refilled = time.monotonic()
+        self.backlog = collections.deque()
+        self.ready = collections.deque()
+        self.deficit = 0
+        self.condition = threading.Condition(scheduler.lock)
+        self.timeout = scheduler.timeout
+        self.last_seen = time.monotonic()
+        self.closed = False
+        self.received = 0
+        self.dropped = 0
+
+    def sendto(self, data, address):
+        return self.scheduler.sock.sendto(data, address)
+
+    # flags: only socket.MSG_PEEK (leave the datagram for the next call) is supported, as the handshake needs it.
+    def recvfrom(self, bufsize, flags=0):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self.condition:
+            while not self.ready:
+                if self.closed:
+                    raise ConnectionResetError(f"session of {self.address[0]}:{self.address[1]} was closed")
+                # Out of packets to process: run a round ourselves instead of waiting for the dispatcher.
+                if self.backlog:
+                    self.scheduler._schedule()
+                    if self.ready:
+                        break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("timed out")
+                self.condition.wait(remaining)
+            data, address = self.ready[0] if flags & socket.MSG_PEEK else self.ready.popleft()
+        return data[:bufsize], address
+
+    def recvfrom_into(self, buffer, nbytes=0):
+        data, address = self.recvfrom(nbytes or len(buffer))
+        buffer[:len(data)] = data
+        return len(data), address
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def gettimeout(self):
+        return self.timeout
+
+    def getsockname(self):
+        return self.scheduler.sock.getsockname()
+
+    # This session's part of the scheduler's receive window, in bytes (at least one packet).
+    def window_share(self):
+        share = self.scheduler.window * self.weight / max(self.scheduler.total_weight, self.weight)
+        if self.rate:
+            share = min(share, self.rate * BURST)
+        return max(int(share), PACKET_SIZE)
+
+    # Packets this session may queue before the dispatcher drops them.
+    def backlog_limit(self):
+        return max(self.window_share() // PACKET_SIZE, 2 * READY_LIMIT)
+
+    # The token bucket holds BURST seconds at the rate, and always room for a packet.
+    def bucket_size(self):
+        return max(self.rate * BURST, 2 * PACKET_SIZE)
+
+    def refill(self, now):
+        if self.rate:
+            self.tokens = min(self.tokens + (now - self.refilled) * self.rate, self.bucket_size())
+            self.refilled = now
+
+    # True if the rate allows a packet of size bytes now (after refill()).
+    def allows(self, size):
+        return not self.rate or self.tokens >= size
+
+    def close(self):
+        self.scheduler._close_session(self)
+
+
+class FairScheduler:
+
+    def __init__(self, sock, max_sessions=8, weights=None, rates=None, fair=True):
+        # weights and rates map client hosts ("*" for any other host) to a weight and a rate in Mbps.
+        # fair=False releases every packet as it arrives (one FIFO for all sessions), for comparison.
+        self.sock = sock
+        self.max_sessions = max_sessions
+        self.weights = weights or {}
+        self.rates = rates or {}
+        self.fair = fair
+        self.window = receive_window(sock)
+        # The sessions start with the socket's timeout, the socket itself blocks from now on: the
+        # dispatcher waits in select() and the session threads' sendto() must not fail on a full buffer.
+        self.timeout = sock.gettimeout()
+        sock.settimeout(None)
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.total_weight = 0.0
+        # Sessions with a backlog, in round-robin order.
+        self.active = collections.deque()
+        self.accepted = queue.Queue()
+        self.refused = 0
+        self.stray = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._dispatch, daemon=True)
+        self.thread.start()
+
+    # Waits for the next new session (a SessionSocket with the client's SYN waiting in it).
+    def accept(self, timeout=None):
+        return self.accepted.get(timeout=timeout)
+
+    def _policy(self, values, host, default):
+        return values.get(host, values.get('*', default))
+
+    def _dispatch(self):
+        buffer = bytearray(DATAGRAM_SIZE)
+        view = memoryview(buffer)
+        next_expiry = time.monotonic() + 1.0
+        while self.running:
+            # Wait for the first packet (or until a rate-limited packet may go), then take what else is
+            # waiting without blocking, so a round sees the packets of every sender.
+            packets = []
+            try:
+                readable, _, _ = select.select([self.sock], [], [], self._next_release())
+                while readable and len(packets) < 64:
+                    nbytes, address = self.sock.recvfrom_into(buffer, 0, socket.MSG_DONTWAIT)
+                    packets.append((bytes(view[:nbytes]), address))
+            except BlockingIOError:
+                pass
+            except (OSError, ValueError):
+                # The socket was closed.
+                if self.running:
+                    raise
+                break
+
+            now = time.monotonic()
+            with self.lock:
+                for data, address in packets:
+                    self._enqueue(data, address, now)
+                self._schedule(now)
+                if now >= next_expiry:
+                    self._expire(now)
+                    next_expiry = now + 1.0
+
+    # Seconds until the dispatcher must run a round again without a new packet: when a rate-limited
+    # session could release its next packet.
+    def _next_release(self):
+        wait = 0.5
+        now = time.monotonic()
+        with self.lock:
+            for session in self.active:
+                if session.rate and len(session.ready) < READY_LIMIT:
+                    needed = (len(session.backlog[0][0]) - session.tokens) / session.rate - (now - session.refilled)
+                    wait = min(wait, max(needed, 0.001))
+        return wait
+
+    def _enqueue(self, data, address, now):
+        session = self.sessions.get(address)
+        if session is None:
+            if len(data) < HEADER_SIZE or parse_header_from(data)[2] != SYN_FLAG:
+                # A late packet of a closed session (or not ours at all).
+                self.stray += 1
+                return
+            if len(self.sessions) >= self.max_sessions:
+                # The client retransmits its SYN, one of the sessions may have ended by then.
+                self.refused += 1
+                print(f"Scheduler: {len(self.sessions)} sessions open, SYN from {address[0]}:{address[1]} dropped")
+                return
+            rate = self._policy(self.rates, address[0], None)
+            session = SessionSocket(self, address, self._policy(self.weights, address[0], 1.0), rate * 1000000 / 8 if rate else None)
+            self.sessions[address] = session
+            self.total_weight += session.weight
+            print(f"Scheduler: New session of {address[0]}:{address[1]} (weight {session.weight:g}"
+                  f"{f', {session.rate * 8 / 1000000:g} Mbps' if session.rate else ''}), {len(self.sessions)} open")
+            self.accepted.put(session)
+
+        session.last_seen = now
+        session.received += 1
+        if not self.fair:
+            session.ready.append((data, address))
+            session.condition.notify()
+            return
+        if len(session.backlog) >= session.backlog_limit():
+            session.dropped += 1
+            return
+        if not session.backlog:
+            self.active.append(session)
+        session.backlog.append((data, address))
+
+    # One round of deficit round-robin over the sessions with a backlog (the lock is held).
+    def _schedule(self, now=None):
+        now = time.monotonic() if now is None else now
+        for _ in range(len(self.active)):
+            session = self.active[0]
+            # A session that can not take packets now (its thread is busy or its rate is used up) does
+            # not collect credit for the round.
+            session.refill(now)
+            if len(session.ready) < READY_LIMIT and session.allows(len(session.backlog[0][0])):
+                session.deficit += QUANTUM * session.weight
+                released = False
+                while session.backlog and len(session.ready) < READY_LIMIT:
+                    size = len(session.backlog[0][0])
+                    if size > session.deficit or not session.allows(size):
+                        break
+                    session.ready.append(session.backlog.popleft())
+                    session.deficit -= size
+                    if session.rate:
+                        session.tokens -= size
+                    released = True
+                if released:
+                    session.condition.notify()
+            if session.backlog:
+                self.active.rotate(-1)
+            else:
+                session.deficit = 0
+                self.active.popleft()
+
+    def _expire(self, now):
+        for session in list(self.sessions.values()):
+            if now - session.last_seen > IDLE_TIMEOUT:
+                print(f"Scheduler: Nothing from {session.address[0]}:{session.address[1]} for {IDLE_TIMEOUT:g} s, session closed")
+                self._remove(session)
+
+    def _remove(self, session):
+        if self.sessions.get(session.address) is session:
+            del self.sessions[session.address]
+            self.total_weight -= session.weight
+        if session in self.active:
+            self.active.remove(session)
+        session.backlog.clear()
+        session.closed = True
+        session.condition.notify_all()
+
+    def _close_session(self, session):
+        with self.lock:
+            self._remove(session)
+
+    def close(self):
+        self.running = False
+        with self.lock:
+            for session in list(self.sessions.values()):
+                self._remove(session)
+        self.thread.join()
+
+
+# Benchmark: python scheduler.py [big MB] [small KB] [small transfers]
+# One big gbn upload runs while small transfers are sent one after the other, with the fair scheduler
+# and with all packets in one FIFO. The time of a small transfer is the latency a short request sees.
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import os
+    import sys
+    from connection import DRTPConnection, GoBackN
+
+    big_size = int(float(sys.argv[1]) * 1000000) if len(sys.argv) > 1 else 50000000
+    small_size = int(float(sys.argv[2]) * 1000) if len(sys.argv) > 2 else 50000
+    small_count = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    big_count = int(sys.argv[4]) if len(sys.argv) > 4 else 3
+
+    def run(fair):
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server_socket.bind(('127.0.0.1', 0))
+        port = server_socket.getsockname()[1]
+        scheduler = FairScheduler(server_socket, fair=fair)
+        session_threads = []
+
+        def receive(session):
+            DRTPConnection(session, GoBackN(64)).recv()
+            session.close()
+
+        def serve():
+            while True:
+                session_threads.append(threading.Thread(target=receive, args=(scheduler.accept(),), daemon=True))
+                session_threads[-1].start()
+
+        threading.Thread(target=serve, daemon=True).start()
+        big_time = []
+
+        def big():
+            start = time.perf_counter()
+            with DRTPConnection.connect('127.0.0.1', port, GoBackN(64)) as connection:
+                connection.send(os.urandom(big_size), "big")
+            big_time.append(time.perf_counter() - start)
+
+        small_times = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            big_threads = [threading.Thread(target=big) for _ in range(big_count)]
+            for big_thread in big_threads:
+                big_thread.start()
+            time.sleep(0.1)
+            for _ in range(small_count):
+                start = time.perf_counter()
+                with DRTPConnection.connect('127.0.0.1', port, GoBackN(64)) as connection:
+                    connection.send(os.urandom(small_size), "small")
+                small_times.append(time.perf_counter() - start)
+            for big_thread in big_threads:
+                big_thread.join()
+            # The server sessions linger a little after their FIN handshake.
+            for thread in session_threads:
+                thread.join()
+        scheduler.close()
+        server_socket.close()
+        return max(big_time), small_times
+
+    print("----------------------------------------------------------")
+    print(f"BIG: {big_size} bytes, SMALL: {small_count} x {small_size} bytes, gbn window 64")
+    for fair in (False, True):
+        big_time, small_times = run(fair)
+        print(f"{'FAIR (DRR)' if fair else 'FIFO':>10}: big transfer {big_time:.2f} s, small transfers "
+              f"mean {sum(small_times) / len(small_times):.3f} s, max {max(small_times):.3f} s")
+    print("----------------------------------------------------------")
@@ -0,0 +1,532 @@
+'''
+    #Deterministic simulation of a DRTP transfer: the real stop_and_wait/gbn/sr code runs against an
+    #in-memory network and a virtual clock instead of UDP sockets and wall-clock time.
+    #
+    #DRTP's module reference to `time` is swapped for a simulated one while a case runs. The client and
+    #the server run in real threads, but only one of them runs at a time: a thread that blocks
+    #(recvfrom, Condition.wait, join, sleep) hands the baton to the next ready thread, and when nobody is
+    #ready the clock jumps straight to the next event (a packet arriving, a timeout running out).
+    #A 0.5 s timeout therefore costs no real time, and since every choice is made in a fixed order and
+    #the loss pattern comes from a seeded random generator, the same seed always gives the same run.
+    #
+    #The network models a one-way latency, a bandwidth (packets are serialized one after another per
+    #direction) and random loss. Like --loss in application.py, loss starts after the handshake, unless
+    #handshake_loss is set (to test the SYN/SYN-ACK retransmissions).
+
+'''
+
+import contextlib
+import heapq
+import itertools
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from collections import deque
+
+import DRTP
+from DRTP import handshake, fin_handshake, stop_and_wait, gbn, sr, auto, STRATEGIES, receive_transfer, ChunkSource, RTTEstimator
+from placement import PlacementWriter
+
+PROTOCOLS = {"stop_and_wait": stop_and_wait, "gbn": gbn, "sr": sr, "auto": auto}
+
+
+# Raised inside the simulated threads that are still blocked when a simulation ends,
+# so they unwind and exit. It is a BaseException so the protocol's except clauses do not catch it.
+class SimulationEnded(BaseException):
+    pass
+
+
+class _Wait:
+
+    __slots__ = ('thread', 'done', 'woken')
+
+    def __init__(self, thread):
+        self.thread = thread
+        self.done = False
+        self.woken = False
+
+
+class Simulation:
+
+    def __init__(self, limit=120.0):
+        # limit: virtual seconds after which a run that has not finished is given up.
+        self.now = 0.0
+        self.limit = limit
+        self.ready = deque()
+        self.timers = []
+        self.order = itertools.count()
+        self.threads = []
+        self.current = None
+        self.roots_alive = 0
+        self.ended = False
+        self.timed_out = False
+        self.events = 0
+        self.done = threading.Event()
+
+    # ---------- scheduling ----------
+
+    def call_at(self, when, callback):
+        heapq.heappush(self.timers, (when, next(self.order), callback))
+
+    def new_wait(self):
+        return _Wait(self.current)
+
+    # Makes the thread of a wait ready again. Returns False if the wait was already over.
+    def wake(self, wait, woken=True):
+        if wait.done or self.ended:
+            return False
+        wait.done = True
+        wait.woken = woken
+        self.ready.append(wait.thread)
+        return True
+
+    # Blocks the current thread until the wait is woken or the timeout (virtual seconds) runs out.
+    # Returns True if it was woken, False on timeout.
+    def block(self, wait, timeout=None):
+        if timeout is not None:
+            self.call_at(self.now + timeout, lambda: self.wake(wait, False))
+        me = self.current
+        self._run_next()
+        me.go.acquire()
+        if self.ended:
+            raise SimulationEnded()
+        return wait.woken
+
+    # Hands the baton to the next ready thread, first moving the clock to the next event if needed.
+    def _run_next(self):
+        if self.ended:
+            return
+        while not self.ready:
+            if self.roots_alive == 0 or not self.timers:
+                self._end()
+                return
+            when, _, callback = heapq.heappop(self.timers)
+            if when > self.limit:
+                self.timed_out = True
+                self._end()
+                return
+            self.now = max(self.now, when)
+            self.events += 1
+            callback()
+        thread = self.ready.popleft()
+        self.current = thread
+        thread.go.release()
+
+    def _end(self):
+        self.ended = True
+        # Unblock every thread that is still waiting, they raise SimulationEnded and exit.
+        for thread in self.threads:
+            if not thread.finished:
+                thread.go.release()
+        self.done.set()
+
+    # Runs the given functions as simulated threads until they have all returned (or the limit is hit).
+    def run(self, *functions):
+        for function in functions:
+            SimThread(self, target=function, root=True).start()
+        self._run_next()
+        self.done.wait()
+
+    # ---------- simulated modules ----------
+
+    @contextlib.contextmanager
+    def patched(self, *modules):
+        # Swaps `time` and `threading` of the given modules for the simulated ones (a module that runs
+        # everything in the calling thread, like DRTP, has no `threading` to swap).
+        saved = [(module, module.time, getattr(module, 'threading', None)) for module in modules]
+        for module in modules:
+            module.time = SimClock(self)
+            if hasattr(module, 'threading'):
+                module.threading = SimThreading(self)
+        try:
+            yield
+        finally:
+            for module, real_time, real_threading in saved:
+                module.time = real_time
+                if real_threading is not None:
+                    module.threading = real_threading
+
+
+class SimThread:
+
+    def __init__(self, sim, target=None, args=(), kwargs=None, daemon=None, name=None, root=False):
+        self.sim = sim
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.daemon = daemon
+        self.name = name
+        self.root = root
+        self.go = threading.Semaphore(0)
+        self.finished = False
+        self.error = None
+        self.joiners = []
+
+    def start(self):
+        self.sim.threads.append(self)
+        if self.root:
+            self.sim.roots_alive += 1
+        threading.Thread(target=self._bootstrap, daemon=True).start()
+        self.sim.ready.append(self)
+
+    def _bootstrap(self):
+        self.go.acquire()
+        if self.sim.ended:
+            return
+        try:
+            self.target(*self.args, **self.kwargs)
+        except SimulationEnded:
+            return
+        except BaseException as error:
+            # An uncaught exception ends this thread, like in real threading.
+            self.error = error
+        self.finished = True
+        if self.root:
+            self.sim.roots_alive -= 1
+        for wait in self.joiners:
+            self.sim.wake(wait)
+        self.sim._run_next()
+
+    def join(self, timeout=None):
+        if not self.finished:
+            wait = self.sim.new_wait()
+            self.joiners.append(wait)
+            self.sim.block(wait, timeout)
+
+    def is_alive(self):
+        return not self.finished
+
+
+class SimLock:
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.owner = None
+        self.waiters = deque()
+
+    def acquire(self, blocking=True, timeout=-1):
+        while self.owner is not None:
+            if not blocking:
+                return False
+            wait = self.sim.new_wait()
+            self.waiters.append(wait)
+            self.sim.block(wait)
+        self.owner = self.sim.current
+        return True
+
+    def release(self):
+        self.owner = None
+        while self.waiters:
+            if self.sim.wake(self.waiters.popleft()):
+                break
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class SimCondition:
+
+    def __init__(self, sim, lock=None):
+        self.sim = sim
+        self.lock = lock if lock is not None else SimLock(sim)
+        self.waiters = deque()
+
+    def wait(self, timeout=None):
+        wait = self.sim.new_wait()
+        self.waiters.append(wait)
+        self.lock.release()
+        woken = self.sim.block(wait, timeout)
+        self.lock.acquire()
+        return woken
+
+    def notify(self, n=1):
+        woken = 0
+        while self.waiters and woken < n:
+            if self.sim.wake(self.waiters.popleft()):
+                woken += 1
+
+    def notify_all(self):
+        self.notify(len(self.waiters))
+
+    def __enter__(self):
+        self.lock.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+
+
+# Stands in for the threading module inside DRTP.
+class SimThreading:
+
+    def __init__(self, sim):
+        self.sim = sim
+
+    def Thread(self, target=None, args=(), kwargs=None, daemon=None, name=None):
+        return SimThread(self.sim, target, args, kwargs, daemon, name)
+
+    def Lock(self):
+        return SimLock(self.sim)
+
+    def Condition(self, lock=None):
+        return SimCondition(self.sim, lock)
+
+
+# Stands in for the time module inside DRTP.
+class SimClock:
+
+    def __init__(self, sim):
+        self.sim = sim
+
+    def time(self):
+        return self.sim.now
+
+    monotonic = time
+    perf_counter = time
+
+    def sleep(self, seconds):
+        self.sim.block(self.sim.new_wait(), seconds)
+
+
+class SimNetwork:
+
+    def __init__(self, sim, latency=0.01, bandwidth=100e6, loss=0.0, seed=0):
+        # latency in seconds (one way), bandwidth in bits per second, loss as a share of the datagrams.
+        self.sim = sim
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.sockets = {}
+        self.link_free = {}
+        self.sent = 0
+        self.dropped = 0
+
+    def socket(self, address):
+        sock = SimSocket(self, address)
+        self.sockets[address] = sock
+        return sock
+
+    def send(self, source, data, address):
+        self.sent += 1
+        if source.lossy and self.random.random() < self.loss:
+            self.dropped += 1
+            return len(data)
+        # Each direction is a link that sends one datagram after the other.
+        link = (source.address, address)
+        start = max(self.sim.now, self.link_free.get(link, 0.0))
+        self.link_free[link] = start + len(data) * 8 / self.bandwidth
+        target = self.sockets.get(address)
+        if target is not None:
+            self.sim.call_at(self.link_free[link] + self.latency, lambda: target.deliver(data, source.address))
+        return len(data)
+
+
+class SimSocket:
+
+    def __init__(self, network, address):
+        self.network = network
+        self.sim = network.sim
+        self.address = address
+        self.inbox = deque()
+        self.waiters = deque()
+        self.timeout = 0.5
+        self.lossy = False
+
+    def sendto(self, data, address):
+        return self.network.send(self, bytes(data), address)
+
+    # flags: only socket.MSG_PEEK (leave the datagram in the inbox) is supported.
+    def recvfrom(self, bufsize, flags=0):
+        while not self.inbox:
+            wait = self.sim.new_wait()
+            self.waiters.append(wait)
+            if not self.sim.block(wait, self.timeout):
+                raise TimeoutError("timed out")
+        data, address = self.inbox[0] if flags & socket.MSG_PEEK else self.inbox.popleft()
+        return data[:bufsize], address
+
+    def recvfrom_into(self, buffer, nbytes=0):
+        data, address = self.recvfrom(nbytes or len(buffer))
+        buffer[:len(data)] = data
+        return len(data), address
+
+    def deliver(self, data, address):
+        self.inbox.append((data, address))
+        while self.waiters:
+            if self.sim.wake(self.waiters.popleft()):
+                break
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def gettimeout(self):
+        return self.timeout
+
+    def getsockname(self):
+        return self.address
+
+    def close(self):
+        self.network.sockets.pop(self.address, None)
+
+
+class _Discard:
+
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+# Simulates one transfer of size bytes and returns what happened, all times in virtual seconds.
+# The client's initial sequence number comes from the seed as well, unless isn is given (e.g. 2**32 - 10 to wrap early).
+# With direct the server places the data straight into a temporary file (PlacementWriter, not for stop_and_wait).
+def simulate(method="gbn", size=100000, window=5, latency=0.01, bandwidth=10e6, loss=0.0, seed=0, limit=120.0, verbose=False, isn=None, handshake_loss=False, direct=False):
+    sim = Simulation(limit)
+    network = SimNetwork(sim, latency, bandwidth, loss, seed)
+    server_address = ('10.0.0.1', 8088)
+    server_socket = network.socket(server_address)
+    client_socket = network.socket(('10.0.0.2', 50000))
+    server_socket.lossy = client_socket.lossy = handshake_loss
+    protocol = PROTOCOLS[method]
+
+    def protocol_options(wscale):
+        return {} if method == "stop_and_wait" else {"N": window, "wscale": wscale}
+
+    rng = random.Random(seed)
+    data = rng.randbytes(size)
+    client_isn = rng.getrandbits(32) if isn is None else isn
+    received = bytearray()
+    result = {"method": method, "size": size, "window": window, "latency": latency,
+              "bandwidth": bandwidth, "loss": loss, "seed": seed, "direct": direct}
+    directory = tempfile.TemporaryDirectory() if direct else None
+
+    class Sink:
+        def write(self, payload):
+            received.extend(payload)
+
+    def server():
+        rtt = RTTEstimator()
+        _, isn, wscale = handshake(server_socket, None, True, rtt=rtt)
+        server_socket.lossy = True
+        result["server_connected_at"] = sim.now
+        receiver = STRATEGIES[method]()
+        if directory is None:
+            receive_transfer(receiver, server_socket, sink=Sink(), isn=isn, wscale=wscale)
+        else:
+            file_name = os.path.join(directory.name, "received")
+            placement = PlacementWriter(file_name, size)
+            try:
+                receive_transfer(receiver, server_socket, placement=placement, isn=isn, wscale=wscale)
+            finally:
+                placement.close()
+            with open(file_name, 'rb') as file:
+                received.extend(file.read())
+        result["received_at"] = sim.now
+        fin_handshake(server_socket, None, True, method=method, rtt=rtt, last_seq=receiver.last_seq)
+        result["server_closed_at"] = sim.now
+
+    def client():
+        rtt = RTTEstimator()
+        _, isn, wscale = handshake(None, client_socket, False, *server_address, init_seq_number=client_isn, rtt=rtt)
+        client_socket.lossy = True
+        start = sim.now
+        result["client_connected_at"] = start
+        protocol(client_socket, False, file_data=ChunkSource(data), server_ip=server_address[0], server_port=server_address[1], isn=isn, rtt=rtt, **protocol_options(wscale))
+        result["transfer_time"] = sim.now - start
+        fin_started = sim.now
+        fin_handshake(None, client_socket, False, *server_address, rtt=rtt)
+        result["close_time"] = sim.now - fin_started
+
+    wall_start = time.perf_counter()
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(_Discard())
+    with output, sim.patched(DRTP):
+        sim.run(server, client)
+    if directory is not None:
+        directory.cleanup()
+
+    result["ok"] = bytes(received) == data
+    result["timed_out"] = sim.timed_out
+    result["virtual_time"] = sim.now
+    result["wall_time"] = time.perf_counter() - wall_start
+    result["datagrams"] = network.sent
+    result["dropped"] = network.dropped
+    result["events"] = sim.events
+    result["errors"] = [repr(thread.error) for thread in sim.threads if thread.error is not None]
+    return result
+
+
+# Regression run for the end of a transfer under heavy loss: a lost final ACK used to leave the sr and auto
+# clients waiting for good. Every seed has to deliver the data and finish before the limit, with the data
+# collected in memory and placed directly into a file. Returns the runs that did not.
+REGRESSION_METHODS = ("sr", "auto")
+REGRESSION_LOSS = 0.2
+REGRESSION_SEEDS = 20
+
+def regression(methods=REGRESSION_METHODS, loss=REGRESSION_LOSS, seeds=REGRESSION_SEEDS, limit=300.0):
+    failures = []
+    for method, direct, seed in itertools.product(methods, (False, True), range(seeds)):
+        run = simulate(method, loss=loss, seed=seed, limit=limit, direct=direct)
+        if not run["ok"] or run["timed_out"] or run["errors"]:
+            failures.append(run)
+    return failures
+
+
+# Parameter sweep: python simulation.py --method gbn sr --window 5 32 --loss 0 0.02 --seeds 5
+# Prints the median transfer time per combination, and how much faster than real time the sweep ran.
+# python simulation.py --regression runs regression() instead.
+if __name__ == "__main__":
+    import argparse
+    import statistics
+    import sys
+
+    parser = argparse.ArgumentParser(description="Deterministic DRTP simulation sweep")
+    parser.add_argument("--method", nargs="+", default=["stop_and_wait", "gbn", "sr", "auto"], choices=list(PROTOCOLS))
+    parser.add_argument("--window", nargs="+", type=int, default=[5, 16, 64])
+    parser.add_argument("--loss", nargs="+", type=float, default=[0.0, 0.01, 0.05])
+    parser.add_argument("--latency", nargs="+", type=float, default=[0.01], help="One-way latency in seconds")
+    parser.add_argument("--bandwidth", type=float, default=10.0, help="Link bandwidth in Mbps")
+    parser.add_argument("--size", type=int, default=200000, help="Bytes per transfer")
+    parser.add_argument("--seeds", type=int, default=3, help="Runs per combination (seeds 0..n-1)")
+    parser.add_argument("--limit", type=float, default=120.0, help="Give up a run after this many virtual seconds")
+    parser.add_argument("--isn", type=int, help="Initial sequence number of every run (default: random per seed)")
+    parser.add_argument("--handshake-loss", action="store_true", help="Lose packets of the handshake too")
+    parser.add_argument("--regression", action="store_true", help=f"Run {REGRESSION_SEEDS} seeds of {'/'.join(REGRESSION_METHODS)} at {REGRESSION_LOSS:.0%} loss and report the failures")
+    args = parser.parse_args()
+
+    if args.regression:
+        failures = regression()
+        for run in failures:
+            print(f"FAILED: {run['method']} seed {run['seed']}{' direct' if run['direct'] else ''}: ok {run['ok']}, timed out {run['timed_out']}, errors {run['errors']}")
+        print(f"REGRESSION: {len(failures)} of {2 * len(REGRESSION_METHODS) * REGRESSION_SEEDS} runs failed")
+        sys.exit(1 if failures else 0)
+
+    total_virtual = 0.0
+    sweep_start = time.perf_counter()
+    print(f"{'method':>13} {'window':>6} {'latency':>8} {'loss':>6} {'time (s)':>9} {'Mbps':>7} {'datagrams':>9} {'failed':>6}")
+    for method, window, latency, loss in itertools.product(args.method, args.window, args.latency, args.loss):
+        if method == "stop_and_wait" and window != args.window[0]:
+            continue
+        runs = [simulate(method, args.size, window, latency, args.bandwidth * 1e6, loss, seed, args.limit, isn=args.isn, handshake_loss=args.handshake_loss) for seed in range(args.seeds)]
+        total_virtual += sum(run["virtual_time"] for run in runs)
+        finished = [run for run in runs if run["ok"] and "transfer_time" in run]
+        failed = len(runs) - len(finished)
+        if finished:
+            median = statistics.median(run["transfer_time"] for run in finished)
+            throughput = args.size * 8 / median / 1e6 if median else float('inf')
+            datagrams = statistics.median(run["datagrams"] for run in finished)
+            print(f"{method:>13} {window if method != 'stop_and_wait' else '-':>6} {latency:>8} {loss:>6} {median:>9.3f} {throughput:>7.2f} {datagrams:>9.0f} {failed:>6}")
+        else:
+            print(f"{method:>13} {window if method != 'stop_and_wait' else '-':>6} {latency:>8} {loss:>6} {'-':>9} {'-':>7} {'-':>9} {failed:>6}")
+
+    wall = time.perf_counter() - sweep_start
+    print("----------------------------------------------------------")
+    print(f"SIMULATED: {total_virtual:.1f} s of virtual time in {wall:.1f} s wall ({total_virtual / max(wall, 1e-9):.0f}x real time)")
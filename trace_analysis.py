@@ -0,0 +1,204 @@
+'''
+    #Offline analysis of a packet trace written with --trace (see tracing.py):
+    #goodput over time, the RTT distribution, clusters of retransmissions and a time-sequence plot.
+    #    python trace_analysis.py TRACE [--interval 0.1] [--gap 0.1] [--plot time_sequence.png]
+    #Needs NumPy, the plot also needs matplotlib.
+
+'''
+
+import argparse
+import sys
+from struct import unpack_from
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from tracing import MAGIC, file_header_format, FILE_HEADER_SIZE, RECORD_SIZE, SEND, RETRANSMIT, RECV, ACK, TIMEOUT, PARITY
+
+# Same layout as tracing.record_format.
+RECORD_FIELDS = {
+    'names': ['time', 'seq', 'ack', 'flags', 'size', 'event'],
+    'formats': ['<u8', '<u4', '<u4', '<u2', '<u2', 'u1'],
+    'offsets': [0, 8, 12, 16, 18, 20],
+    'itemsize': RECORD_SIZE,
+}
+
+
+def load_trace(path):
+    with open(path, 'rb') as file:
+        magic, start = unpack_from(file_header_format, file.read(FILE_HEADER_SIZE))
+    if magic != MAGIC:
+        raise ValueError(f"'{path}' is not a DRTP trace")
+    records = np.fromfile(path, dtype=np.dtype(RECORD_FIELDS), offset=FILE_HEADER_SIZE)
+    # Records of different threads can be slightly out of order in the ring.
+    records = records[np.argsort(records['time'], kind='stable')]
+    seconds = (records['time'].astype(np.int64) - np.int64(start)) / 1e9
+    return relative_numbers(records), seconds
+
+
+# Sequence and ACK numbers start at a random ISN and wrap around at 2**32. They are turned into packet
+# numbers counted from the ISN (the trace starts after the handshake, so the ISN is taken as one below
+# the first data packet), so the plot and the RTT matching see numbers that grow from 1 across a wrap.
+# 0 stays 0, it marks the control packets.
+def relative_numbers(records):
+    data = np.flatnonzero((records['seq'] > 0) & (records['size'] > 0))
+    if not len(data):
+        return records
+    records = records.copy()
+    isn = np.int64(records['seq'][data[0]]) - 1
+    for field in ('seq', 'ack'):
+        values = records[field].astype(np.int64)
+        relative = (values - isn) % (1 << 32)
+        # Numbers just below the ISN (an ACK of nothing yet) stay small instead of becoming huge.
+        relative = np.where(relative >= 1 << 31, relative - (1 << 32), relative)
+        records[field] = np.where(values == 0, 0, np.maximum(relative, 0))
+    return records
+
+
+# The data packets this side sent for the first time (a sender trace) or received for the first time
+# (a receiver trace), as (times, seqs, sizes).
+def new_data(records, seconds):
+    data = (records['seq'] > 0) & (records['size'] > 0)
+    sent = data & (records['event'] == SEND)
+    received = data & (records['event'] == RECV)
+    if sent.sum() >= received.sum():
+        return "sender", seconds[sent], records['seq'][sent], records['size'][sent]
+    _, first = np.unique(records['seq'][received], return_index=True)
+    index = np.flatnonzero(received)[np.sort(first)]
+    return "receiver", seconds[index], records['seq'][index], records['size'][index]
+
+
+def goodput(times, sizes, interval):
+    edges = np.arange(0.0, times.max() + interval, interval) if len(times) else np.array([0.0, interval])
+    if len(edges) < 2:
+        edges = np.array([0.0, interval])
+    counts, edges = np.histogram(times, bins=edges, weights=sizes.astype(np.float64))
+    return edges[:-1], counts * 8 / interval / 1e6
+
+
+# RTT samples of a sender trace. Packets that were retransmitted are left out (Karn's rule), since
+# their ACK can not be matched to one send. A packet is matched with an ACK carrying its own seq if
+# there is one (sr, stop_and_wait), otherwise with the first cumulative ACK that covers it (gbn).
+def rtt_samples(records, seconds, send_times, send_seqs):
+    retransmitted = np.unique(records['seq'][records['event'] == RETRANSMIT])
+    keep = ~np.isin(send_seqs, retransmitted)
+    send_times, send_seqs = send_times[keep], send_seqs[keep]
+
+    acks = records['event'] == ACK
+    ack_times, ack_numbers = seconds[acks], records['ack'][acks].astype(np.int64)
+    if not len(ack_times) or not len(send_seqs):
+        return np.array([])
+
+    unique_acks, first = np.unique(ack_numbers, return_index=True)
+    position = np.clip(np.searchsorted(unique_acks, send_seqs), 0, len(unique_acks) - 1)
+    exact = unique_acks[position] == send_seqs
+    matched = np.where(exact, ack_times[first[position]], np.nan)
+
+    covered = np.maximum.accumulate(ack_numbers)
+    cumulative = np.searchsorted(covered, send_seqs)
+    found = cumulative < len(covered)
+    matched = np.where(~exact & found, ack_times[np.minimum(cumulative, len(covered) - 1)], matched)
+
+    rtts = matched - send_times
+    return rtts[np.isfinite(rtts) & (rtts >= 0)]
+
+
+# Groups retransmissions that follow each other within gap seconds, returns (start, end, count, first seq, last seq) rows.
+def retransmission_clusters(records, seconds, gap):
+    retransmits = records['event'] == RETRANSMIT
+    times, seqs = seconds[retransmits], records['seq'][retransmits]
+    if not len(times):
+        return []
+    breaks = np.flatnonzero(np.diff(times) > gap) + 1
+    clusters = []
+    for part_times, part_seqs in zip(np.split(times, breaks), np.split(seqs, breaks)):
+        clusters.append((part_times[0], part_times[-1], len(part_times), part_seqs.min(), part_seqs.max()))
+    return clusters
+
+
+def plot_time_sequence(records, seconds, path):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    figure, axes = plt.subplots(figsize=(10, 6))
+    for event, label, style in ((SEND, 'send', dict(s=3, c='tab:blue')),
+                                (RECV, 'recv', dict(s=3, c='tab:blue')),
+                                (RETRANSMIT, 'retransmit', dict(s=12, c='tab:red', marker='x')),
+                                (TIMEOUT, 'timeout', dict(s=12, c='tab:orange', marker='|'))):
+        selected = records['event'] == event
+        if selected.any():
+            axes.scatter(seconds[selected], records['seq'][selected], label=label, **style)
+    acks = records['event'] == ACK
+    if acks.any():
+        axes.scatter(seconds[acks], records['ack'][acks], s=2, c='tab:green', label='ack')
+    axes.set_xlabel('time (s)')
+    axes.set_ylabel('sequence number')
+    axes.legend()
+    figure.savefig(path, dpi=120)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse a DRTP packet trace")
+    parser.add_argument("trace", help="Trace file written with --trace")
+    parser.add_argument("--interval", type=float, help="Goodput interval in seconds (default: about 20 intervals)")
+    parser.add_argument("--gap", type=float, default=0.1, help="Retransmissions closer than this (s) form one cluster")
+    parser.add_argument("--plot", type=str, help="Write a time-sequence plot to this file (needs matplotlib)")
+    args = parser.parse_args()
+
+    if np is None:
+        print("Error: trace_analysis.py needs NumPy (pip install numpy).")
+        return
+
+    records, seconds = load_trace(args.trace)
+    if not len(records):
+        print("Error: the trace is empty.")
+        return
+    counts = np.bincount(records['event'], minlength=PARITY + 1)
+    duration = seconds[-1] - seconds[0]
+    role, times, seqs, sizes = new_data(records, seconds)
+
+    print("----------------------------------------------------------")
+    print(f"TRACE: {len(records)} records over {duration:.3f} s ({role} side)")
+    print(f"EVENTS: send {counts[SEND]}, retransmit {counts[RETRANSMIT]}, recv {counts[RECV]}, ack {counts[ACK]}, timeout {counts[TIMEOUT]}, parity {counts[PARITY]}")
+    print(f"DATA: {sizes.sum()} bytes in {len(seqs)} new packets, "
+          f"{counts[RETRANSMIT] / max(len(seqs), 1):.1%} retransmitted")
+
+    interval = args.interval or max(duration / 20, 0.001)
+    print("----------------------------------------------------------")
+    print(f"GOODPUT per {interval:.3f} s:")
+    starts, rates = goodput(times, sizes, interval)
+    peak = rates.max() if len(rates) else 0
+    for start, rate in zip(starts, rates):
+        bar = '#' * int(40 * rate / peak) if peak else ''
+        print(f"  {start:8.3f} s {rate:9.2f} Mbps {bar}")
+
+    if role == "sender":
+        rtts = rtt_samples(records, seconds, times, seqs)
+        print("----------------------------------------------------------")
+        if len(rtts):
+            p50, p90, p99 = np.percentile(rtts, [50, 90, 99]) * 1000
+            print(f"RTT: {len(rtts)} samples, min {rtts.min() * 1000:.2f} ms, p50 {p50:.2f} ms, "
+                  f"p90 {p90:.2f} ms, p99 {p99:.2f} ms, max {rtts.max() * 1000:.2f} ms")
+        else:
+            print("RTT: no samples (no ACKs could be matched)")
+
+    clusters = retransmission_clusters(records, seconds, args.gap)
+    print("----------------------------------------------------------")
+    print(f"RETRANSMISSION CLUSTERS (gap {args.gap} s): {len(clusters)}")
+    for start, end, count, first_seq, last_seq in sorted(clusters, key=lambda cluster: -cluster[2])[:10]:
+        print(f"  at {start:8.3f} s for {(end - start) * 1000:7.1f} ms: {count} packet(s), seq {first_seq}-{last_seq}")
+    print("----------------------------------------------------------")
+
+    if args.plot:
+        try:
+            plot_time_sequence(records, seconds, args.plot)
+            print(f"Time-sequence plot written to '{args.plot}'")
+        except ImportError:
+            print("Error: the plot needs matplotlib (pip install matplotlib).")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+'''
+    #Binary packet traces: TracingSocket records one fixed-size record per packet event, so a slow
+    #transfer can be analysed afterwards (trace_analysis.py) instead of reading print() output.
+    #
+    #Record (24 bytes, little endian):
+    #   time (8 bytes, monotonic ns) + seq (4) + ack (4) + flags (2) + size (2, payload bytes) + event (1) + padding (3)
+    #Events: SEND, RETRANSMIT (a data packet with a seq that was sent before), RECV (a received packet with
+    #payload), ACK (a received packet without payload: ACKs and handshake packets, see the flags),
+    #TIMEOUT (a recvfrom that timed out) and PARITY (an FEC parity packet sent or received).
+    #
+    #The records go into a preallocated ring buffer. Recording is one counter increment and one pack_into,
+    #the file is written by a background thread each time half of the ring is full. Recording never waits
+    #for the disk: if the writer falls a whole ring behind, the overwritten records are lost (and counted).
+    #The trace file starts with a 16 byte header: the magic b'DRTPTRC1' and the start time (monotonic ns).
+
+'''
+
+import itertools
+import queue
+import threading
+import time
+from struct import pack, pack_into, unpack_from, calcsize
+
+from header import header_format, HEADER_SIZE, seq_le
+from integrity import SealedDatagram, CHECKSUM_SIZE
+
+MAGIC = b'DRTPTRC1'
+file_header_format = '<8sQ'
+FILE_HEADER_SIZE = calcsize(file_header_format)
+record_format = '<QIIHHB3x'
+RECORD_SIZE = calcsize(record_format)
+
+SEND = 0
+RETRANSMIT = 1
+RECV = 2
+ACK = 3
+TIMEOUT = 4
+PARITY = 5
+
+EVENT_NAMES = {SEND: "send", RETRANSMIT: "retransmit", RECV: "recv", ACK: "ack", TIMEOUT: "timeout", PARITY: "parity"}
+
+SYN_FLAG = (1 << 3)
+ACK_FLAG = (1 << 2)
+PARITY_FLAG = (1 << 4)
+
+
+class TraceRecorder:
+
+    def __init__(self, path, capacity=1 << 16):
+        # capacity is the number of records in the ring, the file is written half a ring at a time.
+        self.capacity = capacity - capacity % 2
+        self.half = self.capacity // 2
+        self.buffer = bytearray(self.capacity * RECORD_SIZE)
+        self.counter = itertools.count()
+        self.file = open(path, 'wb')
+        self.file.write(pack(file_header_format, MAGIC, time.monotonic_ns()))
+        self.recorded = 0
+        self.written = 0
+        self.lost = 0
+        self.full_halves = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self.thread.start()
+
+    # Called from the protocol threads, next() on the counter hands every caller its own slot.
+    def record(self, event, seq, ack, flags, size):
+        index = next(self.counter)
+        pack_into(record_format, self.buffer, (index % self.capacity) * RECORD_SIZE, time.monotonic_ns(), seq, ack, flags, size, event)
+        self.recorded = index + 1
+        if (index + 1) % self.half == 0:
+            self.full_halves.put(index + 1)
+
+    def _flush_loop(self):
+        while True:
+            end = self.full_halves.get()
+            if end is None:
+                break
+            self._write_until(end)
+
+    # Writes the records from self.written up to end (exclusive) to the file. Records the recorder has
+    # already overwritten (the writer fell a whole ring behind) are skipped and counted in self.lost.
+    def _write_until(self, end):
+        overwritten = max(end, self.recorded) - self.capacity
+        if self.written < overwritten:
+            self.lost += overwritten - self.written
+            self.written = overwritten
+        view = memoryview(self.buffer)
+        while self.written < end:
+            start = self.written % self.capacity
+            count = min(end - self.written, self.capacity - start)
+            self.file.write(view[start * RECORD_SIZE:(start + count) * RECORD_SIZE])
+            self.written += count
+
+    # Writes what is left and returns the number of records in the file.
+    def close(self):
+        total = next(self.counter)
+        self.full_halves.put(None)
+        self.thread.join()
+        self._write_until(total)
+        self.file.close()
+        return total - self.lost
+
+
+class TracingSocket:
+
+    def __init__(self, sock, recorder):
+        self.sock = sock
+        self.recorder = recorder
+        self.highest_sent = None
+
+    def sendto(self, data, address):
+        if len(data) >= HEADER_SIZE:
+            seq, ack, flags, _ = unpack_from(header_format, data)
+            # A SealedDatagram (pipeline.py) carries its CRC32 trailer already, it is not payload.
+            size = len(data) - HEADER_SIZE - (CHECKSUM_SIZE if type(data) is SealedDatagram else 0)
+            event = SEND
+            # A parity packet carries the first seq of its FEC block, it is not a retransmission of it.
+            if flags & PARITY_FLAG:
+                event = PARITY
+            # Data packets only (a payload, no SYN/ACK): a seq seen before is a retransmission.
+            elif size and not flags & (SYN_FLAG | ACK_FLAG):
+                if self.highest_sent is not None and seq_le(seq, self.highest_sent):
+                    event = RETRANSMIT
+                else:
+                    self.highest_sent = seq
+            self.recorder.record(event, seq, ack, flags, size)
+        return self.sock.sendto(data, address)
+
+    def recvfrom(self, bufsize):
+        try:
+            data, address = self.sock.recvfrom(bufsize)
+        except TimeoutError:
+            self.recorder.record(TIMEOUT, 0, 0, 0, 0)
+            raise
+        self._received(data, len(data))
+        return data, address
+
+    def recvfrom_into(self, buffer, nbytes=0):
+        try:
+            received, address = self.sock.recvfrom_into(buffer, nbytes)
+        except TimeoutError:
+            self.recorder.record(TIMEOUT, 0, 0, 0, 0)
+            raise
+        self._received(buffer, received)
+        return received, address
+
+    def _received(self, packet, length):
+        if length >= HEADER_SIZE:
+            seq, ack, flags, _ = unpack_from(header_format, packet)
+            size = length - HEADER_SIZE
+            event = PARITY if flags & PARITY_FLAG else RECV if size else ACK
+            self.recorder.record(event, seq, ack, flags, size)
+
+    # Everything else (settimeout, close, getsockname, ...) goes straight to the real socket.
+    def __getattr__(self, name):
+        return getattr(self.sock, name)